@@ -5,29 +5,43 @@ Cloud Runで動作するAPIサーバー
 GASから呼び出されて、記事を生成する
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import os
 import logging
 from google.oauth2 import service_account
+from google.auth.transport.requests import Request as GoogleAuthRequest
+import google_auth_httplib2
+import httplib2
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+import openai
 from openai import OpenAI
 import anthropic
 import json
+import hashlib
+import sqlite3
 import random
 import requests
 from io import BytesIO
 import re
+import math
+import unicodedata
 import base64
 from google.cloud import aiplatform
 from PIL import Image
 import google.generativeai as genai
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed, wait, FIRST_COMPLETED
 import threading
+import contextvars
+import functools
+from contextlib import contextmanager
 import time
+import uuid
+from types import SimpleNamespace
 from bs4 import BeautifulSoup
 from janome.tokenizer import Tokenizer
-from collections import Counter
+from collections import Counter, deque
+from difflib import SequenceMatcher
 from google.cloud import tasks_v2
 from google.protobuf import timestamp_pb2
 import datetime
@@ -47,6 +61,147 @@ SCOPES = [
     'https://www.googleapis.com/auth/cloud-platform'  # Vertex AI（画像生成）に必要
 ]
 
+# 見出しシートの読み取り範囲（H列まで広めに取得）
+HEADING_RANGE = 'A1:H100'
+# values.batchGet 1回あたりのシート数（URL長の上限を超えないように分割）
+HEADINGS_BATCH_SIZE = int(os.environ.get('HEADINGS_BATCH_SIZE', '40'))
+# Docs保存時に表をネイティブの表として挿入する（false の場合はマークダウンのまま挿入）
+DOCS_NATIVE_TABLES = os.environ.get('DOCS_NATIVE_TABLES', 'true').lower() == 'true'
+# process_all_sheets で同時に生成する記事数（リクエストの concurrency で上書き可）と、リクエストで指定できる上限
+ARTICLE_CONCURRENCY = int(os.environ.get('ARTICLE_CONCURRENCY', '1'))
+MAX_ARTICLE_CONCURRENCY = int(os.environ.get('MAX_ARTICLE_CONCURRENCY', '8'))
+
+
+def parse_article_concurrency(value):
+    """リクエストの concurrency を検証して 1〜MAX_ARTICLE_CONCURRENCY に収める
+
+    Returns:
+        (同時生成数 or None（未指定 = ARTICLE_CONCURRENCY）, エラーメッセージ or None)
+    """
+    if value is None:
+        return None, None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None, 'concurrency must be an integer'
+    try:
+        concurrency = int(value)
+    except ValueError:
+        return None, 'concurrency must be an integer'
+    return max(1, min(concurrency, MAX_ARTICLE_CONCURRENCY)), None
+
+# ステージ所要時間のヒストグラムのバケット上限（秒）
+STAGE_DURATION_BUCKETS = [float(b) for b in os.environ.get(
+    'STAGE_DURATION_BUCKETS', '0.1,0.25,0.5,1,2.5,5,10,20,30,60,120,300,600'
+).split(',') if b.strip()]
+# p50/p95 の算出に使う直近のサンプル数（ステージごと）
+STAGE_QUANTILE_WINDOW = int(os.environ.get('STAGE_QUANTILE_WINDOW', '500'))
+
+
+class StageMetrics:
+    """パイプラインのステージごとの所要時間を集計し、Prometheus のテキスト形式で出力
+
+    累積のヒストグラム（stage, status 別）と、直近 STAGE_QUANTILE_WINDOW 件から求めた p50/p95 を持つ。
+    """
+
+    def __init__(self, buckets, window):
+        self.buckets = sorted(buckets)
+        self.window = window
+        self.histograms = {}  # (stage, status) → {'counts': [...], 'sum': float, 'count': int}
+        self.recent = {}  # stage → deque(秒)
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds, status='ok'):
+        with self.lock:
+            histogram = self.histograms.setdefault(
+                (stage, status), {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            )
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['counts'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            self.recent.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    @staticmethod
+    def _quantile(samples, q):
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def render_prometheus(self):
+        """/metrics 用のテキスト（text/plain; version=0.0.4）"""
+        lines = [
+            '# HELP article_stage_duration_seconds Duration of article pipeline stages.',
+            '# TYPE article_stage_duration_seconds histogram',
+        ]
+        with self.lock:
+            for (stage, status), histogram in sorted(self.histograms.items()):
+                labels = f'stage="{stage}",status="{status}"'
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    lines.append(f'article_stage_duration_seconds_bucket{{{labels},le="{bound:g}"}} {count}')
+                lines.append(f'article_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+                lines.append(f'article_stage_duration_seconds_sum{{{labels}}} {histogram["sum"]:.3f}')
+                lines.append(f'article_stage_duration_seconds_count{{{labels}}} {histogram["count"]}')
+
+            lines.append('# HELP article_stage_recent_duration_seconds Quantiles over the most recent stage durations.')
+            lines.append('# TYPE article_stage_recent_duration_seconds summary')
+            for stage, samples in sorted(self.recent.items()):
+                if not samples:
+                    continue
+                for q in (0.5, 0.95):
+                    lines.append(f'article_stage_recent_duration_seconds{{stage="{stage}",quantile="{q}"}} {self._quantile(samples, q):.3f}')
+                lines.append(f'article_stage_recent_duration_seconds_sum{{stage="{stage}"}} {sum(samples):.3f}')
+                lines.append(f'article_stage_recent_duration_seconds_count{{stage="{stage}"}} {len(samples)}')
+        return '\n'.join(lines) + '\n'
+
+
+# プロセス共通のステージ所要時間
+STAGE_METRICS = StageMetrics(STAGE_DURATION_BUCKETS, STAGE_QUANTILE_WINDOW)
+
+
+def _is_failed_result(result):
+    """エラーを例外ではなく戻り値で返す関数（"ERROR: ..." / False / (None, ...) / {'status': 'error'}）の失敗判定"""
+    if result is False:
+        return True
+    if isinstance(result, dict):
+        return result.get('status') == 'error'
+    if isinstance(result, tuple) and result:
+        result = result[0]
+        if result is None:
+            return True
+    return isinstance(result, str) and result.startswith('ERROR')
+
+
+class timed_stage:
+    """ステージの所要時間を STAGE_METRICS に記録する（with 文・デコレーターの両方で使える）
+
+    例外を送出した場合、またはデコレートした関数がエラーを戻り値で返した場合は status="error" で記録する。
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.status = 'ok'
+        self.start = None
+
+    def __enter__(self):
+        self.status = 'ok'
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_METRICS.observe(self.stage, time.perf_counter() - self.start, 'error' if exc_type else self.status)
+        return False
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed_stage(self.stage) as span:
+                result = fn(*args, **kwargs)
+                if _is_failed_result(result):
+                    span.status = 'error'
+                return result
+        return wrapper
+
+
+@timed_stage('slack')
 def send_slack_notification(message, webhook_url=None):
     """Slackに通知を送信"""
     webhook_url = webhook_url or os.environ.get('SLACK_WEBHOOK_URL')
@@ -70,11 +225,2211 @@ def send_slack_notification(message, webhook_url=None):
         logger.error(f"Slack通知エラー: {e}")
         return False
 
+class GoogleClientPool:
+    """Google APIの認証情報とサービスクライアントをプロセス全体で共有するプール
+
+    - GOOGLE_SERVICE_ACCOUNT_KEY の解析と認証情報の生成はプロセスで1回だけ
+    - httplib2 はスレッドセーフではないため、サービスはスレッドごとに
+      専用の AuthorizedHttp で build() してスレッドローカルに保持する
+    - アクセストークンは期限切れ前にバックグラウンドスレッドで更新する
+    """
+
+    def __init__(self, scopes, refresh_margin_seconds=300):
+        self.scopes = scopes
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._credentials = None
+        self._local = threading.local()
+        self._refresh_thread = None
+        self._vertex_projects = set()
+
+    def get_credentials(self):
+        """共有の認証情報を取得（初回のみ生成してトークン更新スレッドを起動）"""
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+                self._refresh_token()
+                self._refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
+                self._refresh_thread.start()
+            return self._credentials
+
+    def _load_credentials(self):
+        """環境変数のサービスアカウントキーから認証情報を生成"""
+        service_account_key = os.environ.get('GOOGLE_SERVICE_ACCOUNT_KEY')
+
+        if not service_account_key:
+            raise ValueError("GOOGLE_SERVICE_ACCOUNT_KEY environment variable is not set")
+
+        try:
+            service_account_info = json.loads(service_account_key)
+            logger.info(f"[AUTH] 認証情報を読み込みました: {service_account_info.get('client_email', 'N/A')}")
+        except json.JSONDecodeError as e:
+            logger.error(f"JSONパースエラー: {e}")
+            raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_KEY: {e}")
+
+        return service_account.Credentials.from_service_account_info(
+            service_account_info,
+            scopes=self.scopes
+        )
+
+    def _refresh_token(self):
+        """アクセストークンを更新（複数スレッドから同時に更新しない）"""
+        with self._refresh_lock:
+            self._credentials.refresh(GoogleAuthRequest())
+            logger.info(f"[AUTH] アクセストークンを更新しました（有効期限: {self._credentials.expiry}）")
+
+    def _refresh_loop(self):
+        """有効期限の refresh_margin_seconds 秒前にトークンを更新し続ける"""
+        while True:
+            expiry = self._credentials.expiry
+            if expiry:
+                wait_seconds = (expiry - datetime.datetime.utcnow()).total_seconds() - self.refresh_margin_seconds
+            else:
+                wait_seconds = 0
+            time.sleep(max(wait_seconds, 30))
+            try:
+                self._refresh_token()
+            except Exception as e:
+                # 失敗してもリクエスト時に AuthorizedHttp が再取得するので継続
+                logger.warning(f"[AUTH] バックグラウンドでのトークン更新に失敗: {e}")
+
+    def service(self, name, version):
+        """呼び出し元スレッド専用のサービスクライアントを取得"""
+        services = getattr(self._local, 'services', None)
+        if services is None:
+            services = self._local.services = {}
+
+        key = (name, version)
+        if key not in services:
+            authorized_http = google_auth_httplib2.AuthorizedHttp(
+                self.get_credentials(),
+                http=httplib2.Http(timeout=120)
+            )
+            services[key] = build(name, version, http=authorized_http, cache_discovery=False)
+        return services[key]
+
+    def ensure_vertex_initialized(self, project_id, location='us-central1'):
+        """Vertex AIの初期化をプロジェクトごとに1回だけ行う"""
+        key = (project_id, location)
+        if key in self._vertex_projects:
+            return
+        credentials = self.get_credentials()
+        with self._lock:
+            if key not in self._vertex_projects:
+                aiplatform.init(
+                    project=project_id,
+                    location=location,
+                    credentials=credentials
+                )
+                self._vertex_projects.add(key)
+
+
+# プロセス共通のGoogle APIクライアントプール
+GOOGLE_CLIENTS = GoogleClientPool(SCOPES)
+
+
+# プロバイダー・クォータ種別ごとのレート上限（RATE_LIMITS 環境変数のJSONで上書き可）
+# requests_per_minute / tokens_per_minute はトークンバケット、max_concurrency は同時実行数の上限
+DEFAULT_RATE_LIMITS = {
+    'openai': {'requests_per_minute': 500, 'tokens_per_minute': 450000, 'max_concurrency': 16},
+    'anthropic': {'requests_per_minute': 50, 'tokens_per_minute': 80000, 'max_concurrency': 8},
+    'vertex_imagen': {'requests_per_minute': 20, 'max_concurrency': 4},
+    'sheets_read': {'requests_per_minute': 60, 'max_concurrency': 8},
+    'sheets_write': {'requests_per_minute': 60, 'max_concurrency': 4},
+    'docs_read': {'requests_per_minute': 300, 'max_concurrency': 8},
+    'docs_write': {'requests_per_minute': 60, 'max_concurrency': 4},
+    'drive': {'requests_per_minute': 600, 'max_concurrency': 16},
+    'searchconsole': {'requests_per_minute': 60, 'max_concurrency': 2},
+    'custom_search': {'requests_per_minute': 100, 'max_concurrency': 4},
+}
+
+# Google APIの一時エラー・429時のリトライ回数
+GOOGLE_API_MAX_RETRIES = int(os.environ.get('GOOGLE_API_MAX_RETRIES', '3'))
+# LLM APIの一時エラー・429時のリトライ回数（SDK側のリトライは無効化し、ここで一元管理する）
+LLM_API_MAX_RETRIES = int(os.environ.get('LLM_API_MAX_RETRIES', '3'))
+
+
+class TokenBucket:
+    """1分あたりの上限量で回復するトークンバケット（予約方式）"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        """amount を予約し、使えるようになるまでの待ち秒数を返す（残高は負になりうる）"""
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, delta):
+        """予約量と実使用量の差分を反映（正なら追加で消費、負なら返却）"""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class ProviderRateLimiter:
+    """1プロバイダー分のレート制限
+
+    クォータ種別（requests/min, tokens/min）ごとのトークンバケットに加え、
+    429を観測したら同時実行数を半減してクールダウンし、成功が続けば1ずつ戻す（AIMD）。
+    """
+
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None, max_concurrency=8):
+        self.name = name
+        self.buckets = {}
+        if requests_per_minute:
+            self.buckets['requests'] = TokenBucket(requests_per_minute)
+        if tokens_per_minute:
+            self.buckets['tokens'] = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = max_concurrency
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_throttles = 0
+        self.successes_since_change = 0
+        self.throttle_count = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, tokens=0, requests=1):
+        """実行枠を取得し、バケットに空きができるまで待つ。予約したトークン数を返す
+
+        requests はリクエスト数のバケットから予約する件数（バッチリクエストは中の件数分）。
+        """
+        with self.condition:
+            while True:
+                cooldown = self.cooldown_until - time.monotonic()
+                if cooldown > 0:
+                    self.condition.wait(cooldown)
+                    continue
+                if self.in_flight < self.concurrency_limit:
+                    break
+                self.condition.wait()
+            self.in_flight += 1
+
+        wait_seconds = 0.0
+        if 'requests' in self.buckets:
+            wait_seconds = max(wait_seconds, self.buckets['requests'].reserve(requests))
+        if tokens and 'tokens' in self.buckets:
+            wait_seconds = max(wait_seconds, self.buckets['tokens'].reserve(tokens))
+        if wait_seconds > 0:
+            logger.info(f"[RATE_LIMIT] {self.name}: クォータ待ち {wait_seconds:.1f}秒")
+            time.sleep(wait_seconds)
+        return tokens
+
+    def release(self, throttled=False):
+        """実行枠を返却し、429の有無に応じて同時実行数を調整"""
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_count += 1
+                self.consecutive_throttles += 1
+                self.successes_since_change = 0
+                self.concurrency_limit = max(1, self.concurrency_limit // 2)
+                backoff = min(60, 2 ** min(self.consecutive_throttles, 6))
+                self.cooldown_until = max(self.cooldown_until, time.monotonic() + backoff)
+                logger.warning(f"[RATE_LIMIT] {self.name}: 429を検出。同時実行数を{self.concurrency_limit}に下げ、{backoff}秒クールダウン")
+            else:
+                self.consecutive_throttles = 0
+                self.successes_since_change += 1
+                if (self.concurrency_limit < self.max_concurrency
+                        and self.successes_since_change >= self.concurrency_limit):
+                    self.concurrency_limit += 1
+                    self.successes_since_change = 0
+            self.condition.notify_all()
+
+    def record_tokens(self, reserved, actual):
+        """予約時の見積もりと実際の使用トークン数の差分をバケットに反映"""
+        if actual is not None and 'tokens' in self.buckets:
+            self.buckets['tokens'].adjust(actual - reserved)
+
+
+class RateLimiterRegistry:
+    """プロセス共通のレート制限（全APIの呼び出しはここを通す）"""
+
+    def __init__(self, limits):
+        self.limiters = {
+            name: ProviderRateLimiter(name, **config)
+            for name, config in limits.items()
+        }
+
+    def get(self, provider):
+        return self.limiters[provider]
+
+    def call(self, provider, fn, tokens=0, max_retries=0, actual_tokens=None, retry_transient=True, requests=1):
+        """レート制限を適用して fn() を実行
+
+        Args:
+            provider: DEFAULT_RATE_LIMITS のキー
+            fn: 実行する関数（引数なし）
+            tokens: tokens/min バケットから予約する見積もりトークン数
+            max_retries: 429・一時エラー時のリトライ回数
+            actual_tokens: 結果から実使用トークン数を取り出す関数（見積もりとの差分を精算）
+            retry_transient: False なら 429 のみリトライ（5xx・タイムアウトはサーバー側で
+                反映済みの可能性があるため、冪等でない書き込みでは再送しない）
+            requests: 1回の実行で消費するリクエスト数（バッチリクエストは中の件数）
+        """
+        limiter = self.get(provider)
+
+        for attempt in range(max_retries + 1):
+            reserved = limiter.acquire(tokens, requests=requests)
+            throttled = False
+            try:
+                result = fn()
+                if actual_tokens:
+                    limiter.record_tokens(reserved, actual_tokens(result))
+                return result
+            except Exception as e:
+                throttled = _is_rate_limit_error(e)
+                if attempt < max_retries and (throttled or (retry_transient and _is_transient_error(e))):
+                    logger.warning(f"[RATE_LIMIT] {provider}: リトライします ({attempt + 1}/{max_retries}) - {e}")
+                    if not throttled:
+                        time.sleep(2 ** attempt)
+                    continue
+                raise
+            finally:
+                limiter.release(throttled=throttled)
+
+
+def _load_rate_limits():
+    """DEFAULT_RATE_LIMITS に RATE_LIMITS 環境変数（JSON）の上書きを適用"""
+    limits = {name: dict(config) for name, config in DEFAULT_RATE_LIMITS.items()}
+    overrides = os.environ.get('RATE_LIMITS')
+    if overrides:
+        try:
+            for name, config in json.loads(overrides).items():
+                limits.setdefault(name, {}).update(config)
+        except (json.JSONDecodeError, AttributeError) as e:
+            logger.error(f"RATE_LIMITS の解析に失敗しました（既定値を使用）: {e}")
+    return limits
+
+
+def _is_rate_limit_error(error):
+    """429・クォータ超過系のエラーか判定（OpenAI の insufficient_quota は課金エラーなので対象外）"""
+    if isinstance(error, GenerationAborted):
+        return False
+    if isinstance(error, GoogleBatchThrottled):
+        return True
+    if _is_insufficient_quota_error(error):
+        return False
+    if isinstance(error, (openai.RateLimitError, anthropic.RateLimitError)):
+        return True
+    if isinstance(error, HttpError):
+        status = getattr(error.resp, 'status', None)
+        if status == 429:
+            return True
+        return status == 403 and 'ratelimitexceeded' in str(error).lower()
+    if isinstance(error, requests.exceptions.HTTPError):
+        return getattr(error.response, 'status_code', None) == 429
+    status = getattr(error, 'status_code', None)
+    code = getattr(error, 'code', None)
+    if status is None and isinstance(code, int):
+        status = code  # google.api_core の例外（Vertex AI の ResourceExhausted 等）
+    if status is not None:
+        return status == 429
+    # ステータスを持たない例外だけメッセージで判定（IDやバイト数に含まれる数字を誤検知しないよう単語単位）
+    error_str = str(error).lower()
+    return (re.search(r'\b429\b', error_str) is not None
+            or 'resource exhausted' in error_str or 'quota exceeded' in error_str)
+
+
+def _is_insufficient_quota_error(error):
+    """OpenAI の残高・利用上限切れ（429 で返るがリトライしても回復しない）か判定"""
+    if getattr(error, 'code', None) == 'insufficient_quota':
+        return True
+    return isinstance(error, openai.RateLimitError) and 'insufficient_quota' in str(error)
+
+
+def _is_transient_error(error):
+    """リトライで回復しうる一時エラー（5xx・タイムアウト・接続エラー）か判定"""
+    if isinstance(error, (openai.APIConnectionError, openai.InternalServerError,
+                          anthropic.APIConnectionError, anthropic.InternalServerError)):
+        return True
+    if isinstance(error, HttpError):
+        return getattr(error.resp, 'status', None) in (500, 502, 503, 504)
+    return isinstance(error, (TimeoutError, ConnectionError, requests.exceptions.ConnectionError,
+                              requests.exceptions.Timeout))
+
+
+def _estimate_prompt_tokens(messages, system=None):
+    """プロンプトのトークン数を文字数で概算（日本語は概ね1文字≒1トークン）"""
+    def text_length(content):
+        if isinstance(content, str):
+            return len(content)
+        if isinstance(content, list):
+            return sum(len(block.get('text', '')) for block in content if isinstance(block, dict))
+        return 0
+
+    total = text_length(system) if system else 0
+    for message in messages or []:
+        total += text_length(message.get('content'))
+    return total
+
+
+def _google_quota_bucket(http_request):
+    """googleapiclient の HttpRequest からクォータ種別を判定"""
+    uri = getattr(http_request, 'uri', '') or ''
+    is_read = getattr(http_request, 'method', 'GET') == 'GET'
+    if 'sheets.googleapis.com' in uri:
+        return 'sheets_read' if is_read else 'sheets_write'
+    if 'docs.googleapis.com' in uri:
+        return 'docs_read' if is_read else 'docs_write'
+    if 'searchconsole.googleapis.com' in uri:
+        return 'searchconsole'
+    return 'drive'
+
+
+# POST でも何度送っても結果が同じになる Google API（値の上書き・クリア・検索系）
+_IDEMPOTENT_GOOGLE_POSTS = ('/values:batchUpdate', ':clear', ':batchGet', '/searchAnalytics/query')
+
+
+def _is_idempotent_google_request(http_request):
+    """再送しても副作用が重複しないリクエストか（GET/PUT/DELETE と _IDEMPOTENT_GOOGLE_POSTS）"""
+    method = getattr(http_request, 'method', 'GET')
+    if method in ('GET', 'HEAD', 'PUT', 'DELETE'):
+        return True
+    uri = (getattr(http_request, 'uri', '') or '').split('?')[0]
+    return any(marker in uri for marker in _IDEMPOTENT_GOOGLE_POSTS)
+
+
+class GoogleBatchThrottled(Exception):
+    """バッチリクエスト内の一部が 429・rateLimitExceeded で失敗した（その分だけ再送する）"""
+
+
+def execute_google(http_request, max_retries=None):
+    """Google API（Sheets/Docs/Drive/Search Console）のリクエストをレート制限付きで実行
+
+    5xx・タイムアウトのリトライは冪等なリクエストのみ。documents().batchUpdate・files().create 等の
+    書き込みは 429（未反映）のときだけリトライする（本文やファイルの二重作成を防ぐため）。
+    """
+    if max_retries is None:
+        max_retries = GOOGLE_API_MAX_RETRIES
+    return RATE_LIMITER.call(
+        _google_quota_bucket(http_request),
+        http_request.execute,
+        max_retries=max_retries,
+        retry_transient=_is_idempotent_google_request(http_request)
+    )
+
+
+# Google API のバッチリクエスト1回あたりの最大件数
+GOOGLE_BATCH_MAX_REQUESTS = 100
+
+
+def execute_google_batch(service, requests, max_retries=None):
+    """複数のリクエストをバッチHTTPリクエストにまとめて実行
+
+    レート制限のバケットからは中のリクエスト件数分を予約する。429・rateLimitExceeded で失敗した
+    リクエストだけをクールダウン後に再送し、5xx・タイムアウトでのバッチ全体の再送は
+    中身がすべて冪等な場合に限る。
+
+    Args:
+        service: googleapiclient のサービス（drive_service 等）
+        requests: {request_id: HttpRequest}
+
+    Returns:
+        {request_id: (レスポンス, 例外 or None)}
+    """
+    if max_retries is None:
+        max_retries = GOOGLE_API_MAX_RETRIES
+    results = {}
+    last_errors = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None and _is_rate_limit_error(exception):
+            last_errors[request_id] = exception  # 未完了のまま残し、次の試行で再送する
+            return
+        results[request_id] = (response, exception)
+
+    items = list(requests.items())
+    for start in range(0, len(items), GOOGLE_BATCH_MAX_REQUESTS):
+        chunk = dict(items[start:start + GOOGLE_BATCH_MAX_REQUESTS])
+        http_request = next(iter(chunk.values()))
+
+        def run(chunk=chunk):
+            remaining = [request_id for request_id in chunk if request_id not in results]
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id in remaining:
+                batch.add(chunk[request_id], request_id=request_id)
+            batch.execute()
+            throttled = [request_id for request_id in remaining if request_id not in results]
+            if throttled:
+                raise GoogleBatchThrottled(f"429: バッチ内の{len(throttled)}/{len(remaining)}件がレート制限されました")
+
+        try:
+            RATE_LIMITER.call(
+                _google_quota_bucket(http_request),
+                run,
+                max_retries=max_retries,
+                retry_transient=all(_is_idempotent_google_request(r) for r in chunk.values()),
+                requests=len(chunk)
+            )
+        except GoogleBatchThrottled:
+            for request_id in chunk:
+                if request_id not in results:
+                    results[request_id] = (None, last_errors.get(request_id))
+    return results
+
+
+# プロセス内の永続状態（LLM応答キャッシュ等）を保存するSQLiteファイル
+LOCAL_STATE_DB = os.environ.get('LOCAL_STATE_DB', '/tmp/seo_article_state.sqlite3')
+# LLM応答キャッシュ: 有効なステップ（カンマ区切り。既定は空 = 無効で、使うステップを明示的に指定する）・有効期限・最大件数
+# 例: design,related_keywords,outline（draft・audit は再実行で結果が変わることを期待されるため通常は含めない）
+LLM_CACHE_STEPS = [step.strip() for step in os.environ.get('LLM_CACHE_STEPS', '').split(',') if step.strip()]
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '2000'))
+
+
+class LLMResponseCache:
+    """LLM応答の永続キャッシュ
+
+    モデル + メッセージ + パラメータのハッシュをキーに応答本文を SQLite に保存する。
+    キャッシュするのは LLM_CACHE_STEPS に含まれるステップの呼び出しのみ（呼び出し側が cache_step で指定）。
+    有効期限切れは読み出し時に破棄し、件数が上限を超えたら最終アクセスの古い順に削除する。
+    """
+
+    def __init__(self, path, steps, ttl_seconds, max_entries):
+        self.path = path
+        self.steps = set(steps)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = bool(path) and bool(self.steps)
+        self.conn = None
+        self.writes = 0
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_cache ('
+                'key TEXT PRIMARY KEY, step TEXT, response TEXT, created_at REAL, accessed_at REAL)'
+            )
+            self.conn.commit()
+        return self.conn
+
+    def _disable(self, error):
+        logger.error(f"[LLM_CACHE] キャッシュを無効化します: {error}")
+        self.enabled = False
+
+    def enabled_for(self, step):
+        return self.enabled and step in self.steps
+
+    @staticmethod
+    def make_key(provider, params):
+        payload = json.dumps({'provider': provider, 'params': params}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _record(self, step, hit):
+        counter = self.stats.setdefault(step, {'hits': 0, 'misses': 0})
+        counter['hits' if hit else 'misses'] += 1
+
+    def get(self, key, step):
+        """キャッシュ済みの応答（dict）を返す。なければ None"""
+        now = time.time()
+        with self.lock:
+            try:
+                conn = self._connection()
+                row = conn.execute('SELECT response, created_at FROM llm_cache WHERE key = ?', (key,)).fetchone()
+                if row and now - row[1] > self.ttl_seconds:
+                    conn.execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+                    row = None
+                elif row:
+                    conn.execute('UPDATE llm_cache SET accessed_at = ? WHERE key = ?', (now, key))
+                conn.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None
+            self._record(step, row is not None)
+
+        if row:
+            logger.info(f"[LLM_CACHE] ヒット: {step}")
+            return json.loads(row[0])
+        return None
+
+    def put(self, key, step, response):
+        now = time.time()
+        with self.lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO llm_cache (key, step, response, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                    (key, step, json.dumps(response, ensure_ascii=False), now, now)
+                )
+                self.writes += 1
+                if self.writes % 50 == 0:
+                    self._evict(conn, now)
+                conn.commit()
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    def _evict(self, conn, now):
+        """期限切れと、上限件数を超えた分（最終アクセスが古い順）を削除"""
+        conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+        count = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                'DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)',
+                (count - self.max_entries,)
+            )
+            logger.info(f"[LLM_CACHE] {count - self.max_entries}件を削除しました（上限: {self.max_entries}件）")
+
+    def get_stats(self):
+        """ステップごとのヒット率とキャッシュ件数"""
+        with self.lock:
+            steps = {}
+            for step, counter in self.stats.items():
+                total = counter['hits'] + counter['misses']
+                steps[step] = dict(counter, hit_rate=round(counter['hits'] / total, 3) if total else 0.0)
+            entries = None
+            if self.enabled:
+                try:
+                    entries = self._connection().execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+                except sqlite3.Error as e:
+                    self._disable(e)
+            return {
+                'enabled': self.enabled,
+                'cached_steps': sorted(self.steps),
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'steps': steps
+            }
+
+
+# プロセス共通のLLM応答キャッシュ
+LLM_CACHE = LLMResponseCache(LOCAL_STATE_DB, LLM_CACHE_STEPS, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES)
+
+# モデルごとの料金（USD / 100万トークン。image は1枚あたり）。LLM_PRICING（JSON）で上書き・追加できる
+DEFAULT_LLM_PRICING = {
+    'gpt-4o-mini': {'input': 0.15, 'cached_input': 0.075, 'output': 0.60},
+    'gpt-4o': {'input': 2.50, 'cached_input': 1.25, 'output': 10.00},
+    'gpt-4.1-mini': {'input': 0.40, 'cached_input': 0.10, 'output': 1.60},
+    'gpt-4.1': {'input': 2.00, 'cached_input': 0.50, 'output': 8.00},
+    'gpt-5.2': {'input': 1.75, 'cached_input': 0.175, 'output': 14.00},
+    'claude-sonnet-4': {'input': 3.00, 'cached_input': 0.30, 'cache_write': 3.75, 'output': 15.00},
+    'imagen-3.0-generate': {'image': 0.04},
+}
+# スプレッドシートID → クライアント名（利用料のクライアント別集計に使う。未登録は USAGE_DEFAULT_CLIENT）
+def _load_usage_client_labels():
+    try:
+        labels = json.loads(os.environ.get('USAGE_CLIENT_LABELS', '{}') or '{}')
+    except json.JSONDecodeError as e:
+        logger.error(f"[USAGE] USAGE_CLIENT_LABELS の解析に失敗しました。クライアント名の対応を無視します: {e}")
+        return {}
+    if not isinstance(labels, dict):
+        logger.error("[USAGE] USAGE_CLIENT_LABELS はJSONオブジェクトで指定してください。クライアント名の対応を無視します")
+        return {}
+    return labels
+
+
+USAGE_CLIENT_LABELS = _load_usage_client_labels()
+USAGE_DEFAULT_CLIENT = os.environ.get('USAGE_DEFAULT_CLIENT', 'default')
+
+# 利用料の集計タグ（spreadsheet_id / sheet_name / step 等）。スレッドをまたぐ場合は submit_with_usage_tags を使う
+_USAGE_TAGS = contextvars.ContextVar('usage_tags', default={})
+
+
+@contextmanager
+def usage_scope(**tags):
+    """with ブロック内のLLM・画像生成の呼び出しに集計タグを付ける（外側のタグを引き継いで上書き）"""
+    token = _USAGE_TAGS.set({**_USAGE_TAGS.get(), **tags})
+    try:
+        yield
+    finally:
+        _USAGE_TAGS.reset(token)
+
+
+def set_usage_step(step):
+    """現在の集計スコープのステップ名を切り替える（スコープを抜けると元に戻る）"""
+    _USAGE_TAGS.set({**_USAGE_TAGS.get(), 'step': step})
+
+
+def submit_with_usage_tags(executor, fn, *args, **kwargs):
+    """executor.submit と同じだが、呼び出し元の集計タグをワーカースレッドに引き継ぐ"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _load_llm_pricing():
+    pricing = {name: dict(prices) for name, prices in DEFAULT_LLM_PRICING.items()}
+    overrides = os.environ.get('LLM_PRICING')
+    if overrides:
+        try:
+            for name, prices in json.loads(overrides).items():
+                pricing.setdefault(name, {}).update(prices)
+        except (json.JSONDecodeError, AttributeError) as e:
+            logger.error(f"[USAGE] LLM_PRICING の解析に失敗しました。既定の料金を使用します: {e}")
+    return pricing
+
+
+class UsageLedger:
+    """LLM・画像生成の呼び出しごとのトークン数・所要時間・推定コストを SQLite に記録
+
+    記録には usage_scope で付けたタグ（spreadsheet_id / sheet_name / step）とクライアント名を付与し、
+    記事・月・クライアント・ステップ・モデル単位で集計できる。
+    """
+
+    GROUP_COLUMNS = {
+        'article': ['spreadsheet_id', 'sheet_name'],
+        'month': ["strftime('%Y-%m', created_at, 'unixepoch', 'localtime')"],
+        'client': ['client'],
+        'step': ['step'],
+        'model': ['provider', 'model'],
+    }
+
+    def __init__(self, path, pricing):
+        self.path = path
+        self.pricing = pricing
+        self.enabled = bool(path)
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_usage ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL, provider TEXT, model TEXT, '
+                'client TEXT, spreadsheet_id TEXT, sheet_name TEXT, step TEXT, '
+                'input_tokens INTEGER, cached_tokens INTEGER, cache_write_tokens INTEGER, output_tokens INTEGER, '
+                'images INTEGER, latency_seconds REAL, cost_usd REAL, cache_hit INTEGER)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS llm_usage_created_at ON llm_usage (created_at)')
+            self.conn.commit()
+        return self.conn
+
+    def _prices(self, model):
+        """モデル名に一致する料金（日付付きのモデル名は最長一致の接頭辞で引く）"""
+        if model in self.pricing:
+            return self.pricing[model]
+        matches = [name for name in self.pricing if model.startswith(name)]
+        return self.pricing[max(matches, key=len)] if matches else None
+
+    def estimate_cost(self, model, input_tokens=0, cached_tokens=0, cache_write_tokens=0, output_tokens=0, images=0):
+        """推定コスト（USD）。料金表にないモデルは None
+
+        input_tokens はキャッシュ読込・書込を除いた通常の入力トークン数。
+        """
+        prices = self._prices(model)
+        if prices is None:
+            return None
+        input_price = prices.get('input', 0)
+        return (
+            input_tokens * input_price
+            + cached_tokens * prices.get('cached_input', input_price)
+            + cache_write_tokens * prices.get('cache_write', input_price)
+            + output_tokens * prices.get('output', 0)
+        ) / 1_000_000 + images * prices.get('image', 0)
+
+    def record(self, provider, model, input_tokens=0, cached_tokens=0, cache_write_tokens=0, output_tokens=0,
+               images=0, latency=0.0, cache_hit=False):
+        if not self.enabled:
+            return
+        tags = _USAGE_TAGS.get()
+        spreadsheet_id = tags.get('spreadsheet_id')
+        client = tags.get('client') or USAGE_CLIENT_LABELS.get(spreadsheet_id or '') or USAGE_DEFAULT_CLIENT
+        cost = self.estimate_cost(model, input_tokens, cached_tokens, cache_write_tokens, output_tokens, images)
+        if cost is None:
+            logger.warning(f"[USAGE] 料金表にないモデルです（コストは0として記録）: {model}")
+        with self.lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT INTO llm_usage (created_at, provider, model, client, spreadsheet_id, sheet_name, step, '
+                    'input_tokens, cached_tokens, cache_write_tokens, output_tokens, images, latency_seconds, cost_usd, cache_hit) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (time.time(), provider, model, client, spreadsheet_id, tags.get('sheet_name'), tags.get('step'),
+                     input_tokens, cached_tokens, cache_write_tokens, output_tokens, images, round(latency, 3),
+                     cost or 0.0, int(cache_hit))
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"[USAGE] 記録に失敗: {e}")
+
+    def record_openai(self, model, usage, latency, cache_hit=False):
+        if usage is None:
+            return
+        cached = _cached_prompt_tokens(usage)
+        self.record('openai', model, input_tokens=usage.prompt_tokens - cached, cached_tokens=cached,
+                    output_tokens=usage.completion_tokens, latency=latency, cache_hit=cache_hit)
+
+    def record_anthropic(self, model, usage, latency, cache_hit=False):
+        if usage is None:
+            return
+        info = _claude_usage_info(usage)
+        self.record('anthropic', model, input_tokens=info['input_tokens'], cached_tokens=info['cache_read_input_tokens'],
+                    cache_write_tokens=info['cache_creation_input_tokens'], output_tokens=info['output_tokens'],
+                    latency=latency, cache_hit=cache_hit)
+
+    def summarize(self, group_by='article', since=None, until=None, spreadsheet_id=None, client=None, limit=200):
+        """group_by（article / month / client / step / model）ごとの合計を新しい順に返す"""
+        columns = self.GROUP_COLUMNS.get(group_by)
+        if columns is None:
+            raise ValueError(f"group_by は {', '.join(self.GROUP_COLUMNS)} のいずれかを指定してください")
+        conditions, params = [], []
+        for column, operator, value in (('created_at', '>=', since), ('created_at', '<', until),
+                                        ('spreadsheet_id', '=', spreadsheet_id), ('client', '=', client)):
+            if value is not None:
+                conditions.append(f'{column} {operator} ?')
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        keys = ', '.join(columns)
+        query = (
+            f'SELECT {keys}, COUNT(*), SUM(cache_hit), SUM(input_tokens), SUM(cached_tokens), SUM(cache_write_tokens), '
+            f'SUM(output_tokens), SUM(images), SUM(latency_seconds), SUM(cost_usd), MIN(created_at), MAX(created_at) '
+            f'FROM llm_usage {where} GROUP BY {keys} ORDER BY MAX(created_at) DESC LIMIT ?'
+        )
+        with self.lock:
+            rows = self._connection().execute(query, params + [limit]).fetchall()
+
+        key_names = ['month'] if group_by == 'month' else columns
+        results = []
+        for row in rows:
+            values = row[len(columns):]
+            results.append({
+                **dict(zip(key_names, row[:len(columns)])),
+                'calls': values[0],
+                'cache_hits': values[1],
+                'input_tokens': values[2],
+                'cached_tokens': values[3],
+                'cache_write_tokens': values[4],
+                'output_tokens': values[5],
+                'images': values[6],
+                'latency_seconds': round(values[7] or 0, 1),
+                'cost_usd': round(values[8] or 0, 4),
+                'first_at': datetime.datetime.fromtimestamp(values[9]).isoformat(timespec='seconds'),
+                'last_at': datetime.datetime.fromtimestamp(values[10]).isoformat(timespec='seconds'),
+            })
+        return results
+
+
+# プロセス共通の利用料台帳
+USAGE_LEDGER = UsageLedger(LOCAL_STATE_DB, _load_llm_pricing())
+
+
+def _stream_chat_completion(client, on_text, kwargs):
+    """chat.completions をストリーミングで呼び出し、受信のたびに on_text(累積テキスト) を呼ぶ
+
+    on_text が GenerationAborted を送出した場合はストリームを閉じて生成を打ち切る。
+    戻り値は非ストリーミング時と同じ形（choices[0].message.content / usage）。
+    """
+    stream = client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **kwargs)
+    text = ""
+    usage = None
+    finish_reason = None
+    try:
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta and choice.delta.content:
+                text += choice.delta.content
+                on_text(text)
+    finally:
+        stream.close()
+
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason=finish_reason)],
+        usage=usage
+    )
+
+
+def chat_completion(client, on_text=None, cache_step=None, usage_step=None, **kwargs):
+    """OpenAI chat.completions.create をレート制限付きで呼び出す
+
+    on_text を渡した場合はストリーミングで受信し、累積テキストを逐次コールバックする。
+    cache_step を渡した場合は LLM_CACHE を参照し、ヒットすればAPIを呼ばずに返す（usage は0）。
+    呼び出しは USAGE_LEDGER に記録する（usage_step を渡すと集計スコープのステップ名より優先）。
+    """
+    if usage_step:
+        with usage_scope(step=usage_step):
+            return chat_completion(client, on_text=on_text, cache_step=cache_step, **kwargs)
+
+    cache_key = LLMResponseCache.make_key('openai', kwargs) if LLM_CACHE.enabled_for(cache_step) else None
+    if cache_key:
+        cached = LLM_CACHE.get(cache_key, cache_step)
+        if cached:
+            if on_text:
+                on_text(cached['content'])
+            usage = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0,
+                                    prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+            USAGE_LEDGER.record_openai(kwargs.get('model', ''), usage, 0.0, cache_hit=True)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content=cached['content']), finish_reason=cached.get('finish_reason'))],
+                usage=usage,
+                cached=True
+            )
+
+    estimated_tokens = _estimate_prompt_tokens(kwargs.get('messages')) + kwargs.get('max_completion_tokens', 0)
+    if on_text:
+        request_fn = lambda: _stream_chat_completion(client, on_text, kwargs)
+    else:
+        request_fn = lambda: client.chat.completions.create(**kwargs)
+    start_time = time.time()
+    response = RATE_LIMITER.call(
+        'openai',
+        request_fn,
+        tokens=estimated_tokens,
+        max_retries=LLM_API_MAX_RETRIES,
+        actual_tokens=lambda response: response.usage.total_tokens if response.usage else None
+    )
+    USAGE_LEDGER.record_openai(kwargs.get('model', ''), response.usage, time.time() - start_time)
+
+    # 途中で打ち切られた応答（length）はキャッシュしない
+    choice = response.choices[0]
+    if cache_key and choice.message.content and choice.finish_reason != 'length':
+        LLM_CACHE.put(cache_key, cache_step, {'content': choice.message.content, 'finish_reason': choice.finish_reason})
+    return response
+
+
+def claude_message(client, cache_step=None, usage_step=None, **kwargs):
+    """Anthropic messages.create をレート制限付きで呼び出す
+
+    cache_step を渡した場合は LLM_CACHE を参照し、ヒットすればAPIを呼ばずに返す（usage は0）。
+    呼び出しは USAGE_LEDGER に記録する（usage_step を渡すと集計スコープのステップ名より優先）。
+    """
+    if usage_step:
+        with usage_scope(step=usage_step):
+            return claude_message(client, cache_step=cache_step, **kwargs)
+
+    cache_key = LLMResponseCache.make_key('anthropic', kwargs) if LLM_CACHE.enabled_for(cache_step) else None
+    if cache_key:
+        cached = LLM_CACHE.get(cache_key, cache_step)
+        if cached:
+            usage = SimpleNamespace(input_tokens=0, output_tokens=0,
+                                    cache_creation_input_tokens=0, cache_read_input_tokens=0)
+            USAGE_LEDGER.record_anthropic(kwargs.get('model', ''), usage, 0.0, cache_hit=True)
+            return SimpleNamespace(
+                content=[SimpleNamespace(type='text', text=cached['text'])],
+                stop_reason=cached.get('stop_reason'),
+                usage=usage,
+                cached=True
+            )
+
+    estimated_tokens = _estimate_prompt_tokens(kwargs.get('messages'), kwargs.get('system')) + kwargs.get('max_tokens', 0)
+    start_time = time.time()
+    response = RATE_LIMITER.call(
+        'anthropic',
+        lambda: client.messages.create(**kwargs),
+        tokens=estimated_tokens,
+        max_retries=LLM_API_MAX_RETRIES,
+        actual_tokens=lambda response: _claude_usage_info(response.usage)['total_tokens']
+    )
+    USAGE_LEDGER.record_anthropic(kwargs.get('model', ''), response.usage, time.time() - start_time)
+
+    # 途中で打ち切られた応答（max_tokens）はキャッシュしない
+    if cache_key and response.content and response.stop_reason != 'max_tokens':
+        LLM_CACHE.put(cache_key, cache_step, {'text': response.content[0].text, 'stop_reason': response.stop_reason})
+    return response
+
+
+# プロセス共通のレート制限
+RATE_LIMITER = RateLimiterRegistry(_load_rate_limits())
+
+# Vertex AI Imagen のモデル名
+IMAGEN_MODEL = os.environ.get('IMAGEN_MODEL', 'imagen-3.0-generate-001')
+
+
+class ImageGenerationScheduler:
+    """Vertex AI Imagen の画像生成をプロセス全体で共有するスケジューラー
+
+    - モデルはモデル名ごとに1回だけ読み込んで使い回す
+    - ワーカー数は vertex_imagen の max_concurrency。実際の同時実行数・生成間隔は
+      RATE_LIMITER（vertex_imagen）が 429 の発生状況に応じて調整する
+    - 待ち行列は記事（キー）ごとに持ち、記事間で1件ずつ順番に取り出す（同時に生成中の記事を公平に進める）
+    """
+
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self.models = {}
+        self.model_lock = threading.Lock()
+        self.queues = {}  # キー → deque[(Future, fn, args, kwargs)]（挿入順 = 取り出し順）
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def model(self, model_name):
+        """読み込み済みの ImageGenerationModel（初回のみ from_pretrained）"""
+        with self.model_lock:
+            if model_name not in self.models:
+                from vertexai.preview.vision_models import ImageGenerationModel
+                self.models[model_name] = ImageGenerationModel.from_pretrained(model_name)
+                logger.info(f"[IMAGEN] モデルを読み込みました: {model_name}")
+            return self.models[model_name]
+
+    def _start_workers(self):
+        # condition 取得済みで呼ぶ
+        while len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f'imagen-{len(self.threads)}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, fn, *args, **kwargs):
+        """fn(*args, **kwargs) をキー（記事）の待ち行列に追加して Future を返す（集計タグは引き継ぐ）"""
+        future = Future()
+        context = contextvars.copy_context()
+        with self.condition:
+            self.queues.setdefault(key, deque()).append((future, context, fn, args, kwargs))
+            self._start_workers()
+            self.condition.notify()
+        return future
+
+    def cancel(self, key):
+        """キーの待ち行列に残っている生成を取り消す。取り消した件数を返す"""
+        with self.condition:
+            pending = self.queues.pop(key, deque())
+        for future, *_ in pending:
+            future.cancel()
+        return len(pending)
+
+    def _next(self):
+        with self.condition:
+            while not self.queues:
+                self.condition.wait()
+            key = next(iter(self.queues))
+            queue = self.queues.pop(key)
+            item = queue.popleft()
+            if queue:
+                self.queues[key] = queue  # 末尾に回して次は別の記事から取り出す
+            return item
+
+    def _worker(self):
+        while True:
+            future, context, fn, args, kwargs = self._next()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(context.run(fn, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+
+# プロセス共通の画像生成スケジューラー
+IMAGE_SCHEDULER = ImageGenerationScheduler(RATE_LIMITER.get('vertex_imagen').max_concurrency)
+
+# 同じプロンプト・モデル・保存先の生成画像を再生成せずに再利用する
+GENERATED_IMAGE_CACHE = os.environ.get('GENERATED_IMAGE_CACHE', 'true').lower() == 'true'
+
+
+def image_prompt(h2_heading, keyword):
+    """Vertex AI Imagen に渡す日本語プロンプト"""
+    return f"{keyword}、{h2_heading}に関連する明るく親しみやすいイラスト"
+
+
+def drive_image_url(file_id):
+    """Docs の insertInlineImage から参照できる Drive 画像のURL"""
+    return f"https://drive.google.com/uc?export=view&id={file_id}"
+
+
+# 生成画像のアップロード: 保存形式（png / jpeg）・JPEGの品質・縮小後の最大幅（px、0で縮小しない。Docs上は400pt幅）
+UPLOAD_IMAGE_FORMAT = os.environ.get('UPLOAD_IMAGE_FORMAT', 'png').lower()
+UPLOAD_IMAGE_JPEG_QUALITY = int(os.environ.get('UPLOAD_IMAGE_JPEG_QUALITY', '85'))
+UPLOAD_IMAGE_MAX_WIDTH = int(os.environ.get('UPLOAD_IMAGE_MAX_WIDTH', '0'))
+# このサイズ（バイト）以下はマルチパート（1リクエスト）、超える場合は再開可能アップロード
+UPLOAD_MULTIPART_MAX_BYTES = int(os.environ.get('UPLOAD_MULTIPART_MAX_BYTES', str(5 * 1024 * 1024)))
+
+_IMAGE_SIGNATURES = {'png': b'\x89PNG\r\n\x1a\n', 'jpeg': b'\xff\xd8\xff'}
+
+
+def prepare_upload_image(image_bytes):
+    """アップロードする画像データ (bytes, mimetype, 拡張子)
+
+    すでに UPLOAD_IMAGE_FORMAT の形式で縮小も不要な場合はデコード・再エンコードしない。
+    """
+    target = 'jpeg' if UPLOAD_IMAGE_FORMAT in ('jpeg', 'jpg') else 'png'
+    extension = 'jpg' if target == 'jpeg' else 'png'
+    is_target = image_bytes.startswith(_IMAGE_SIGNATURES[target])
+
+    image = None
+    if not is_target or UPLOAD_IMAGE_MAX_WIDTH:
+        image = Image.open(BytesIO(image_bytes))
+        if UPLOAD_IMAGE_MAX_WIDTH and image.width > UPLOAD_IMAGE_MAX_WIDTH:
+            height = max(1, round(image.height * UPLOAD_IMAGE_MAX_WIDTH / image.width))
+            image = image.resize((UPLOAD_IMAGE_MAX_WIDTH, height), Image.LANCZOS)
+        elif is_target:
+            image = None
+
+    if image is not None:
+        output = BytesIO()
+        if target == 'jpeg':
+            image.convert('RGB').save(output, format='JPEG', quality=UPLOAD_IMAGE_JPEG_QUALITY)
+        else:
+            image.save(output, format='PNG')
+        image_bytes = output.getvalue()
+    return image_bytes, f'image/{target}', extension
+
+
+# フォルダーID → 組織内共有（または「リンクを知っている全員」）がフォルダーに設定済みか
+_FOLDER_SHARING = {}
+_FOLDER_SHARING_LOCK = threading.Lock()
+
+
+class GeneratedImageStore:
+    """生成してDriveにアップロードした画像の記録
+
+    プロンプト + モデル + 保存先フォルダーのハッシュをキーに Drive のファイルIDを SQLite に保存する。
+    再利用前に Drive でファイルの存在を確認し（複数件は1回のバッチリクエスト）、
+    削除・ゴミ箱に移動されたファイルの記録は破棄する。
+    """
+
+    def __init__(self, path, enabled):
+        self.path = path
+        self.enabled = bool(path) and enabled
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS generated_images (key TEXT PRIMARY KEY, file_id TEXT, created_at REAL)'
+            )
+            self.conn.commit()
+        return self.conn
+
+    @staticmethod
+    def key(prompt, model_name, folder_id):
+        raw = json.dumps([prompt, model_name, folder_id], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def put(self, key, file_id):
+        if not self.enabled or not file_id:
+            return
+        with self.lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO generated_images (key, file_id, created_at) VALUES (?, ?, ?)',
+                    (key, file_id, time.time())
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"[IMAGE_STORE] 保存に失敗: {e}")
+
+    def _evict(self, keys):
+        with self.lock:
+            try:
+                conn = self._connection()
+                conn.executemany('DELETE FROM generated_images WHERE key = ?', [(key,) for key in keys])
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"[IMAGE_STORE] 削除に失敗: {e}")
+
+    def lookup(self, drive_service, keys):
+        """{キー: ファイルID}（Drive 上に存在し、ゴミ箱にないものだけ）"""
+        keys = list(dict.fromkeys(keys))
+        if not self.enabled or not keys:
+            return {}
+        with self.lock:
+            try:
+                placeholders = ','.join('?' * len(keys))
+                rows = self._connection().execute(
+                    f'SELECT key, file_id FROM generated_images WHERE key IN ({placeholders})', keys
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"[IMAGE_STORE] 読み込みに失敗: {e}")
+                return {}
+        if not rows:
+            return {}
+
+        file_ids = dict(rows)
+        try:
+            checked = execute_google_batch(drive_service, {
+                key: drive_service.files().get(fileId=file_id, fields='id, trashed', supportsAllDrives=True)
+                for key, file_id in file_ids.items()
+            })
+        except Exception as e:
+            logger.warning(f"[IMAGE_STORE] 生成画像の確認に失敗。再利用しません: {e}")
+            return {}
+
+        found = {}
+        stale = []
+        for key, file_id in file_ids.items():
+            response, error = checked.get(key, (None, None))
+            if error is None and response and not response.get('trashed'):
+                found[key] = file_id
+            elif (isinstance(error, HttpError) and error.resp.status == 404) or (response or {}).get('trashed'):
+                stale.append(key)
+        if stale:
+            logger.info(f"[IMAGE_STORE] 削除済みの生成画像{len(stale)}件の記録を破棄します")
+            self._evict(stale)
+        return found
+
+
+# プロセス共通の生成画像の記録
+GENERATED_IMAGES = GeneratedImageStore(LOCAL_STATE_DB, GENERATED_IMAGE_CACHE)
+
+
+# 初稿の生成方式: 'single'（記事全体を1回で生成）/ 'sectioned'（H2ごとに並列生成して結合）
+DRAFT_MODE = os.environ.get('DRAFT_MODE', 'single')
+# sectioned モードでH2セクション・導入文を生成するモデルと同時実行数
+SECTION_DRAFT_MODEL = os.environ.get('SECTION_DRAFT_MODEL', 'gpt-5.2')
+SECTION_DRAFT_CONCURRENCY = int(os.environ.get('SECTION_DRAFT_CONCURRENCY', '8'))
+
+
+def _cached_prompt_tokens(usage):
+    """usage からプロンプトキャッシュにヒットした入力トークン数を取得（OpenAI / Anthropic 両対応）"""
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return usage.get('cache_read_input_tokens', 0) or 0
+    details = getattr(usage, 'prompt_tokens_details', None)
+    if details is not None:
+        return getattr(details, 'cached_tokens', 0) or 0
+    return getattr(usage, 'cache_read_input_tokens', 0) or 0
+
+
+def _claude_usage_info(usage):
+    """Anthropic の usage を辞書に変換（プロンプトキャッシュの書込・読込トークン数を含む）"""
+    cache_creation = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+    cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+    return {
+        'input_tokens': usage.input_tokens,
+        'output_tokens': usage.output_tokens,
+        'cache_creation_input_tokens': cache_creation,
+        'cache_read_input_tokens': cache_read,
+        'total_tokens': usage.input_tokens + cache_creation + cache_read + usage.output_tokens
+    }
+
+
+def _merge_usage(usages):
+    """複数のAPI呼び出しのusageを合算（Noneは無視）"""
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    return SimpleNamespace(
+        prompt_tokens=sum(u.prompt_tokens for u in usages),
+        completion_tokens=sum(u.completion_tokens for u in usages),
+        total_tokens=sum(u.total_tokens for u in usages),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=sum(_cached_prompt_tokens(u) for u in usages))
+    )
+
+
+# 進捗イベントの送信間隔（秒）と、イベントに含める途中テキストの末尾文字数
+PROGRESS_EVENT_INTERVAL = float(os.environ.get('PROGRESS_EVENT_INTERVAL', '1.0'))
+PROGRESS_PARTIAL_CHARS = int(os.environ.get('PROGRESS_PARTIAL_CHARS', '400'))
+# 完了したジョブの進捗を保持する秒数
+PROGRESS_RETENTION_SECONDS = int(os.environ.get('PROGRESS_RETENTION_SECONDS', '3600'))
+
+
+class GenerationAborted(Exception):
+    """進捗ジョブの中断要求（利用者による中断・ストリーミング中の異常検知）"""
+
+
+class ProgressJob:
+    """1記事分の生成進捗（ステージ遷移・文字数・途中テキスト）をイベント列として保持"""
+
+    def __init__(self, job_id, sheet_name):
+        self.job_id = job_id
+        self.sheet_name = sheet_name
+        self.created_at = time.time()
+        self.finished_at = None
+        self.current_stage = None
+        self.abort_reason = None
+        self.events = []
+        self.last_text_event = {}
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def emit(self, event_type, **data):
+        with self.condition:
+            event = {'seq': len(self.events), 'type': event_type, 'time': time.time()}
+            event.update(data)
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def stage(self, stage, message=""):
+        """ステージ遷移を記録"""
+        self.current_stage = stage
+        self.emit('stage', stage=stage, message=message)
+
+    def update_text(self, stage, text):
+        """ストリーミング中の累積テキストを記録（PROGRESS_EVENT_INTERVAL ごとに間引く）"""
+        now = time.monotonic()
+        if now - self.last_text_event.get(stage, 0) < PROGRESS_EVENT_INTERVAL:
+            return
+        self.last_text_event[stage] = now
+        self.emit('text', stage=stage, chars=len(text), partial=text[-PROGRESS_PARTIAL_CHARS:])
+
+    def abort(self, reason):
+        """中断を要求（生成中のストリーミングは次のチャンク受信時に打ち切られる）"""
+        if self.abort_reason or self.finished:
+            return
+        self.abort_reason = reason
+        logger.warning(f"[PROGRESS] ジョブ {self.job_id} を中断します: {reason}")
+        self.emit('abort', reason=reason)
+
+    def check_abort(self):
+        if self.abort_reason:
+            raise GenerationAborted(self.abort_reason)
+
+    def finish(self, result):
+        self.emit('done', result=result)
+        self.finished_at = time.time()
+
+    def wait_events(self, since, timeout):
+        """since 番目以降のイベントを返す（なければ timeout 秒まで待つ）"""
+        with self.condition:
+            if len(self.events) <= since and not self.finished:
+                self.condition.wait(timeout)
+            return self.events[since:]
+
+
+class ProgressRegistry:
+    """プロセス内の進捗ジョブ一覧（完了後 PROGRESS_RETENTION_SECONDS で破棄）"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def create(self, sheet_name):
+        job = ProgressJob(uuid.uuid4().hex, sheet_name)
+        with self.lock:
+            self._prune()
+            self.jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and now - job.finished_at > PROGRESS_RETENTION_SECONDS]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+PROGRESS_JOBS = ProgressRegistry()
+
+# force 再生成時、前回から変わったセクションだけを再生成する（見出しと本文のスナップショットを LOCAL_STATE_DB に保存）
+INCREMENTAL_REGENERATION = os.environ.get('INCREMENTAL_REGENERATION', 'true').lower() == 'true'
+
+
+def _split_article_sections(article):
+    """Markdown記事を導入部とH2セクションに分割
+
+    Returns:
+        (intro, [(h2_text, section_md), ...])  section_md は「## 見出し」行から次のH2の直前まで
+    """
+    intro_lines = []
+    sections = []
+    current = None
+    for line in article.split('\n'):
+        match = re.match(r'^##(?!#)\s*(.+)$', line.strip())
+        if match:
+            current = [match.group(1).strip(), [line]]
+            sections.append(current)
+        elif current:
+            current[1].append(line)
+        elif not re.match(r'^#(?!#)', line.strip()):
+            intro_lines.append(line)
+    return '\n'.join(intro_lines).strip(), [(h2, '\n'.join(lines).strip()) for h2, lines in sections]
+
+
+class ArticleSnapshotStore:
+    """記事ごとの前回生成結果（見出し構成・導入部・H2セクション本文）を SQLite に保存"""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS article_snapshots ('
+                'spreadsheet_id TEXT, sheet_name TEXT, keyword TEXT, h1_title TEXT, '
+                'intro TEXT, sections TEXT, updated_at REAL, '
+                'PRIMARY KEY (spreadsheet_id, sheet_name))'
+            )
+            self.conn.commit()
+        return self.conn
+
+    def load(self, spreadsheet_id, sheet_name):
+        """前回のスナップショット（dict）を返す。なければ None"""
+        with self.lock:
+            try:
+                row = self._connection().execute(
+                    'SELECT keyword, h1_title, intro, sections FROM article_snapshots '
+                    'WHERE spreadsheet_id = ? AND sheet_name = ?',
+                    (spreadsheet_id, sheet_name)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.error(f"[SNAPSHOT] 読み込みに失敗: {e}")
+                return None
+        if not row:
+            return None
+        return {'keyword': row[0], 'h1_title': row[1], 'intro': row[2], 'sections': json.loads(row[3])}
+
+    def save(self, spreadsheet_id, sheet_name, heading_data, h2_groups, article):
+        """生成した記事をH2セクション単位で保存（記事のH2が見出し構成と一致しない場合は保存しない）"""
+        intro, article_sections = _split_article_sections(article)
+        if [re.sub(r'\s', '', h2) for h2, _ in article_sections] != [re.sub(r'\s', '', g['h2']) for g in h2_groups]:
+            logger.warning(f"[SNAPSHOT] 記事のH2が見出し構成と一致しないため保存しません: {sheet_name}")
+            return
+
+        sections = [
+            {'h2': group['h2'], 'sub_headings': group['sub_headings'], 'content': content}
+            for group, (_, content) in zip(h2_groups, article_sections)
+        ]
+        with self.lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    'INSERT OR REPLACE INTO article_snapshots '
+                    '(spreadsheet_id, sheet_name, keyword, h1_title, intro, sections, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (spreadsheet_id, sheet_name, heading_data['keyword'], heading_data['h1_title'],
+                     intro, json.dumps(sections, ensure_ascii=False), time.time())
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"[SNAPSHOT] 保存に失敗: {e}")
+
+
+ARTICLE_SNAPSHOTS = ArticleSnapshotStore(LOCAL_STATE_DB)
+
+# 画像フォルダーの一覧（サブフォルダーと画像）を Drive の変更履歴で確認する間隔と、無条件に作り直すまでの秒数
+IMAGE_CATALOG_CHECK_SECONDS = int(os.environ.get('IMAGE_CATALOG_CHECK_SECONDS', '300'))
+IMAGE_CATALOG_TTL_SECONDS = int(os.environ.get('IMAGE_CATALOG_TTL_SECONDS', str(24 * 3600)))
+# 画像一覧のクエリ1回に含めるサブフォルダー数（'a' in parents or 'b' in parents ... の長さを抑える）
+IMAGE_CATALOG_PARENTS_PER_QUERY = int(os.environ.get('IMAGE_CATALOG_PARENTS_PER_QUERY', '40'))
+
+
+class ImageFolderCatalog:
+    """画像フォルダー（IMAGE_FOLDER_ID）のサブフォルダーと画像の一覧、画像の共有設定の状態をプロセス内と SQLite に保持
+
+    - IMAGE_CATALOG_CHECK_SECONDS 以内はAPIを呼ばずに返す
+    - それを過ぎたら Drive の changes（前回のページトークン以降）を確認し、
+      画像フォルダー配下に変更がなければそのまま使い続ける
+    - IMAGE_CATALOG_TTL_SECONDS を過ぎた場合や変更があった場合は作り直す
+      （サブフォルダーの一覧 + 複数フォルダーをまとめた画像の一覧、いずれも全ページ取得）
+    """
+
+    def __init__(self, path, check_seconds, ttl_seconds):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}  # root_folder_id → {'folders', 'folder_ids', 'page_token', 'built_at', 'checked_at'}
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS image_folder_catalog ('
+                'root_folder_id TEXT PRIMARY KEY, folders TEXT, folder_ids TEXT, page_token TEXT, '
+                'built_at REAL, checked_at REAL)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS image_permissions (file_id TEXT PRIMARY KEY, checked_at REAL)'
+            )
+            self.conn.commit()
+        return self.conn
+
+    def shared_file_ids(self, file_ids):
+        """file_ids のうち、IMAGE_CATALOG_TTL_SECONDS 以内に共有設定済みと確認した画像のID"""
+        file_ids = list(file_ids)
+        if not file_ids:
+            return set()
+        with self.lock:
+            try:
+                placeholders = ','.join('?' * len(file_ids))
+                rows = self._connection().execute(
+                    f'SELECT file_id FROM image_permissions WHERE file_id IN ({placeholders}) AND checked_at >= ?',
+                    (*file_ids, time.time() - self.ttl_seconds)
+                ).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"[IMAGE_CATALOG] 共有設定の読み込みに失敗: {e}")
+                return set()
+        return {row[0] for row in rows}
+
+    def mark_shared(self, file_ids):
+        """共有設定済みの画像として記録"""
+        now = time.time()
+        with self.lock:
+            try:
+                conn = self._connection()
+                conn.executemany(
+                    'INSERT OR REPLACE INTO image_permissions (file_id, checked_at) VALUES (?, ?)',
+                    [(file_id, now) for file_id in file_ids]
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"[IMAGE_CATALOG] 共有設定の保存に失敗: {e}")
+
+    def _forget_shared(self, file_ids):
+        """変更のあった画像の共有設定の記録を破棄（lock 取得済みで呼ぶ）"""
+        if not file_ids:
+            return
+        try:
+            conn = self._connection()
+            conn.executemany('DELETE FROM image_permissions WHERE file_id = ?', [(file_id,) for file_id in file_ids])
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"[IMAGE_CATALOG] 共有設定の破棄に失敗: {e}")
+
+    def _load(self, root_folder_id):
+        try:
+            row = self._connection().execute(
+                'SELECT folders, folder_ids, page_token, built_at, checked_at FROM image_folder_catalog '
+                'WHERE root_folder_id = ?', (root_folder_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"[IMAGE_CATALOG] 読み込みに失敗: {e}")
+            return None
+        if not row:
+            return None
+        return {'folders': json.loads(row[0]), 'folder_ids': json.loads(row[1]), 'page_token': row[2],
+                'built_at': row[3], 'checked_at': row[4]}
+
+    def _save(self, root_folder_id, entry):
+        self.entries[root_folder_id] = entry
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO image_folder_catalog '
+                '(root_folder_id, folders, folder_ids, page_token, built_at, checked_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (root_folder_id, json.dumps(entry['folders'], ensure_ascii=False), json.dumps(entry['folder_ids']),
+                 entry['page_token'], entry['built_at'], entry['checked_at'])
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"[IMAGE_CATALOG] 保存に失敗: {e}")
+
+    @staticmethod
+    def _list_all(drive_service, query, fields):
+        """files().list を全ページ取得"""
+        files = []
+        page_token = None
+        while True:
+            response = execute_google(drive_service.files().list(
+                q=query,
+                spaces='drive',
+                fields=f'nextPageToken, files({fields})',
+                pageSize=1000,
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+                corpora='allDrives'  # 共有ドライブも検索対象に含める
+            ))
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def _build(self, drive_service, root_folder_id):
+        # 一覧の取得中に起きた変更も次回の確認で拾えるよう、先にページトークンを取得しておく
+        page_token = execute_google(drive_service.changes().getStartPageToken(supportsAllDrives=True)).get('startPageToken')
+
+        subfolders = self._list_all(
+            drive_service,
+            f"'{root_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
+            'id, name'
+        )
+        logger.info(f"[IMAGE_CATALOG] サブフォルダー数: {len(subfolders)}")
+        names_by_id = {folder['id']: folder['name'] for folder in subfolders}
+
+        folders = {}
+        folder_ids = list(names_by_id)
+        for start in range(0, len(folder_ids), IMAGE_CATALOG_PARENTS_PER_QUERY):
+            chunk = folder_ids[start:start + IMAGE_CATALOG_PARENTS_PER_QUERY]
+            parents = ' or '.join(f"'{folder_id}' in parents" for folder_id in chunk)
+            images = self._list_all(
+                drive_service,
+                f"({parents}) and (mimeType contains 'image/') and trashed=false",
+                'id, name, webContentLink, parents'
+            )
+            for image in images:
+                for parent in image.pop('parents', []):
+                    if parent in names_by_id:
+                        folders.setdefault(names_by_id[parent], []).append(image)
+                        break
+
+        for folder_name, images in folders.items():
+            logger.info(f"フォルダー '{folder_name}': {len(images)}枚の画像")
+        now = time.time()
+        return {'folders': folders, 'folder_ids': [root_folder_id] + folder_ids, 'page_token': page_token,
+                'built_at': now, 'checked_at': now}
+
+    def _has_changes(self, drive_service, entry):
+        """前回のページトークン以降に画像フォルダー配下の変更があるか。ページトークンは進める
+
+        変更のあった画像（共有設定の変更を含む）は共有設定の記録も破棄する。
+        """
+        # フォルダーに加えて一覧内の画像も監視する（完全に削除された画像は removed のみで parents を持たないため）
+        watched = set(entry['folder_ids'])
+        watched.update(image['id'] for images in entry['folders'].values() for image in images)
+        # ルート直下は生成画像のアップロード先でもあるため、サブフォルダーの追加・変更だけを変更とみなす
+        root_folder_id = entry['folder_ids'][0]
+        subfolder_ids = set(entry['folder_ids'][1:])
+        page_token = entry['page_token']
+        changed = False
+        changed_file_ids = []
+        while page_token:
+            response = execute_google(drive_service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                fields='nextPageToken, newStartPageToken, changes(fileId, removed, file(parents, mimeType))',
+                pageSize=1000,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            ))
+            for change in response.get('changes', []):
+                file = change.get('file') or {}
+                parents = set(file.get('parents', []))
+                is_folder = file.get('mimeType') == 'application/vnd.google-apps.folder'
+                if (change.get('fileId') in watched or parents & subfolder_ids
+                        or (root_folder_id in parents and is_folder)):
+                    changed = True
+                    changed_file_ids.append(change.get('fileId'))
+            if response.get('newStartPageToken'):
+                entry['page_token'] = response['newStartPageToken']
+                break
+            page_token = response.get('nextPageToken')
+        self._forget_shared(changed_file_ids)
+        return changed
+
+    def get(self, drive_service, root_folder_id):
+        """{サブフォルダー名: [画像, ...]}"""
+        with self.lock:
+            now = time.time()
+            entry = self.entries.get(root_folder_id) or self._load(root_folder_id)
+            if entry and now - entry['built_at'] < self.ttl_seconds:
+                if now - entry['checked_at'] < self.check_seconds:
+                    self.entries[root_folder_id] = entry
+                    return entry['folders']
+                try:
+                    changed = entry['page_token'] is None or self._has_changes(drive_service, entry)
+                except HttpError as e:
+                    logger.warning(f"[IMAGE_CATALOG] 変更の確認に失敗。一覧を作り直します: {e}")
+                    changed = True
+                if not changed:
+                    entry['checked_at'] = now
+                    self._save(root_folder_id, entry)
+                    logger.info("[IMAGE_CATALOG] 画像フォルダーに変更なし。保存済みの一覧を使います")
+                    return entry['folders']
+                logger.info("[IMAGE_CATALOG] 画像フォルダーに変更があったため一覧を作り直します")
+
+            entry = self._build(drive_service, root_folder_id)
+            self._save(root_folder_id, entry)
+            return entry['folders']
+
+
+# プロセス共通の画像フォルダー一覧
+IMAGE_FOLDER_CATALOG = ImageFolderCatalog(LOCAL_STATE_DB, IMAGE_CATALOG_CHECK_SECONDS, IMAGE_CATALOG_TTL_SECONDS)
+
+# H2見出しとフォルダー名の類似度（文字n-gramのTF-IDFのコサイン）がこの値未満ならLLMにまとめて問い合わせる
+FOLDER_MATCH_MIN_SCORE = float(os.environ.get('FOLDER_MATCH_MIN_SCORE', '0.3'))
+FOLDER_MATCH_LLM_FALLBACK = os.environ.get('FOLDER_MATCH_LLM_FALLBACK', 'true').lower() == 'true'
+
+
+def _char_ngrams(text, sizes=(1, 2, 3)):
+    """正規化（NFKC・小文字化・記号と空白の除去）した文字列の文字n-gramの出現数"""
+    text = re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', text).lower())
+    grams = Counter()
+    for n in sizes:
+        for i in range(len(text) - n + 1):
+            grams[text[i:i + n]] += 1
+    return grams
+
+
+class FolderNameMatcher:
+    """H2見出しに最も近い画像フォルダー名をローカルで選ぶ
+
+    フォルダー名の文字n-gramのTF-IDFベクトル（正規化済み）と転置インデックスを作成時に計算しておき、
+    見出しごとに共通するn-gramだけを足し合わせてコサイン類似度を求める。
+    フォルダー名が見出しにそのまま含まれる場合は類似度1とする。決定した結果は見出しの文字列ごとに記憶する。
+    """
+
+    def __init__(self, folder_names):
+        self.folder_names = list(folder_names)
+        grams = [_char_ngrams(name) for name in self.folder_names]
+        document_frequency = Counter(gram for name_grams in grams for gram in name_grams)
+        total = len(self.folder_names)
+        self.idf = {gram: math.log((total + 1) / (count + 1)) + 1 for gram, count in document_frequency.items()}
+        self.postings = {}  # n-gram → [(フォルダー番号, 重み), ...]
+        for index, name_grams in enumerate(grams):
+            for gram, weight in self._weights(name_grams).items():
+                self.postings.setdefault(gram, []).append((index, weight))
+        self.normalized_names = [re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', name).lower())
+                                 for name in self.folder_names]
+        self.memo = {}  # 見出し → フォルダー名（None = 該当なし）
+
+    def _weights(self, grams):
+        weights = {gram: count * self.idf[gram] for gram, count in grams.items() if gram in self.idf}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        return {gram: weight / norm for gram, weight in weights.items()} if norm else {}
+
+    def best(self, text):
+        """(フォルダー名, 類似度)。共通するn-gramがなければ (None, 0.0)"""
+        normalized = re.sub(r'[\W_]+', '', unicodedata.normalize('NFKC', text).lower())
+        scores = [0.0] * len(self.folder_names)
+        for gram, weight in self._weights(_char_ngrams(text)).items():
+            for index, folder_weight in self.postings.get(gram, ()):
+                scores[index] += weight * folder_weight
+        for index, name in enumerate(self.normalized_names):
+            if name and name in normalized:
+                scores[index] = max(scores[index], 1.0)
+        if not scores or max(scores) <= 0:
+            return None, 0.0
+        index = max(range(len(scores)), key=scores.__getitem__)
+        return self.folder_names[index], scores[index]
+
+
+_FOLDER_MATCHERS = {}
+_FOLDER_MATCHERS_LOCK = threading.Lock()
+
+
+def get_folder_matcher(folder_names):
+    """フォルダー名の組み合わせごとに FolderNameMatcher を作成・共有（画像フォルダー一覧の読み込み時に作る）"""
+    key = tuple(sorted(folder_names))
+    with _FOLDER_MATCHERS_LOCK:
+        matcher = _FOLDER_MATCHERS.get(key)
+        if matcher is None:
+            if len(_FOLDER_MATCHERS) >= 8:
+                _FOLDER_MATCHERS.clear()
+            matcher = _FOLDER_MATCHERS[key] = FolderNameMatcher(key)
+        return matcher
+
+# 監査結果の指摘カテゴリごとの重み（スコア = Σ 重み × 指摘件数）
+AUDIT_ISSUE_WEIGHTS = {'offtrack': 3, 'contradiction': 3, 'repetition': 2, 'thin': 2, 'term': 1, 'rules': 2}
+# スコアがこの値以下かつ文字数が範囲内なら Step3（修正）をスキップ
+REFINE_SKIP_MAX_SCORE = int(os.environ.get('REFINE_SKIP_MAX_SCORE', '0'))
+# スコアがこの値以下なら軽量モデルで修正
+REFINE_LIGHT_MAX_SCORE = int(os.environ.get('REFINE_LIGHT_MAX_SCORE', '4'))
+REFINE_MODEL = os.environ.get('REFINE_MODEL', 'gpt-4.1')
+REFINE_LIGHT_MODEL = os.environ.get('REFINE_LIGHT_MODEL', 'gpt-4.1-mini')
+# Step3 の方式: 'patch'（編集操作のJSONをローカルで適用）/ 'rewrite'（記事全体を再出力）
+REFINE_MODE = os.environ.get('REFINE_MODE', 'patch')
+# 文字数不足時の追記方式: 'section'（薄いH2セクションだけを並列に加筆）/ 'append'（記事全体を再出力）
+LENGTH_TOPUP_MODE = os.environ.get('LENGTH_TOPUP_MODE', 'section')
+# section モードで1セクションあたりに加筆する文字数の目安
+TOPUP_CHARS_PER_SECTION = int(os.environ.get('TOPUP_CHARS_PER_SECTION', '300'))
+
+
+def parse_audit_issues(issues_json):
+    """監査結果のJSON（コードフェンス付きも可）を辞書に変換。解析できなければ None"""
+    text = issues_json.strip()
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        return None
+    try:
+        issues = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return issues if isinstance(issues, dict) else None
+
+
+def _is_blank_audit_value(value):
+    """空欄か（文字列は空白のみ、リスト・辞書は中身がすべて空欄なら空欄とみなす）"""
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, dict):
+        return all(_is_blank_audit_value(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return all(_is_blank_audit_value(item) for item in value)
+    return False
+
+
+def score_audit_issues(issues):
+    """監査の指摘を重み付きで数える
+
+    空欄だけの行（出力例のテンプレート {"preferred":"","found":["",""],"locations":[""]} を
+    そのまま返した場合など）は数えない。
+    """
+    score = 0
+    for category, weight in AUDIT_ISSUE_WEIGHTS.items():
+        items = issues.get(category) or []
+        if not isinstance(items, list):
+            continue
+        for item in items:
+            if not _is_blank_audit_value(item):
+                score += weight
+    return score
+
+
+def _split_h2_blocks(article):
+    """記事を「最初のH2より前（H1・導入部）」と各H2ブロックに分割（改行で結合すると元に戻る）
+
+    Returns:
+        [(h2_text or None, block_text), ...]  先頭要素の h2_text は None
+    """
+    blocks = [[None, []]]
+    for line in article.split('\n'):
+        match = re.match(r'^##(?!#)\s*(.+)$', line.strip())
+        if match:
+            blocks.append([match.group(1).strip(), [line]])
+        else:
+            blocks[-1][1].append(line)
+    return [(h2, '\n'.join(lines)) for h2, lines in blocks]
+
+
+def _utf16_len(text):
+    """Docs API のインデックス単位（UTF-16 のコード単位）での長さ"""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _native_table_span(rows):
+    """insertTable で挿入した表（直前に入る改行を含む）が占めるインデックス数
+
+    表の開始・終了で2、各行が 1 + 2 × 列数（セルの開始と空段落の改行）、加えてセルに入れた文字数。
+    """
+    num_cols = max(len(row) for row in rows)
+    return 1 + 2 + len(rows) * (2 * num_cols + 1) + sum(_utf16_len(cell) for row in rows for cell in row[:num_cols])
+
+
+class DocumentStructureIndex:
+    """Googleドキュメントの本文の段落構造（見出し・段落の位置）
+
+    保存時にローカルで計算する（from_local）か、必要なフィールドだけを指定して1回取得する（fetch）。
+    画像の挿入など、見出しの位置を使う後処理はすべてこのインデックスを使う。
+
+    paragraphs: 本文の段落 [{'start_index', 'end_index', 'heading_level'（本文は0）, 'text'}]。
+    表のセル内の段落は含まない。
+    """
+
+    # documents().get で取得するフィールド（段落のスタイル・位置・テキストのみ）
+    FIELDS = ('body(content(startIndex,endIndex,'
+              'paragraph(paragraphStyle(namedStyleType),elements(textRun(content)))))')
+    _MARKDOWN_H2 = re.compile(r'^\s*##(?!#)\s*(.+?)\s*$')
+
+    def __init__(self, paragraphs):
+        self.paragraphs = paragraphs
+
+    @classmethod
+    def fetch(cls, docs_service, document_id):
+        """文書を取得してインデックスを作成"""
+        doc = execute_google(docs_service.documents().get(documentId=document_id, fields=cls.FIELDS))
+        paragraphs = []
+        for element in doc.get('body', {}).get('content', []):
+            paragraph = element.get('paragraph')
+            if paragraph is None:
+                continue
+            style = paragraph.get('paragraphStyle', {}).get('namedStyleType', '')
+            level = int(style[-1]) if style.startswith('HEADING_') and style[-1].isdigit() else 0
+            text = ''.join(
+                part['textRun'].get('content', '') for part in paragraph.get('elements', []) if 'textRun' in part
+            )
+            paragraphs.append({
+                'start_index': element.get('startIndex', 0),
+                'end_index': element['endIndex'],
+                'heading_level': level,
+                'text': text.strip()
+            })
+        logger.info(f"[DOC_INDEX] 文書を取得: 段落数={len(paragraphs)}")
+        return cls(paragraphs)
+
+    @classmethod
+    def from_local(cls, body_text, heading_ranges, native_tables):
+        """本文テキスト・見出しの範囲・表の挿入位置（いずれも表の挿入前のインデックス）から作成"""
+        heading_levels = {start: level for start, _, level in heading_ranges}
+        spans = [(location, _native_table_span(rows)) for location, rows in native_tables]
+
+        def shift(index):
+            # 表の挿入位置以降の段落は、その表が占める分だけ後ろにずれる
+            return index + sum(span for location, span in spans if location <= index)
+
+        paragraphs = []
+        start = 1
+        for line in body_text.split('\n')[:-1]:
+            length = _utf16_len(line) + 1
+            final_start = shift(start)
+            paragraphs.append({
+                'start_index': final_start,
+                'end_index': final_start + length,
+                'heading_level': heading_levels.get(start, 0),
+                'text': line.strip()
+            })
+            start += length
+        # insertTable が表の直前に挿入する空段落
+        for location, _ in spans:
+            final_location = location + sum(span for other, span in spans if other < location)
+            paragraphs.append({'start_index': final_location, 'end_index': final_location + 1, 'heading_level': 0, 'text': ''})
+        paragraphs.sort(key=lambda paragraph: paragraph['start_index'])
+        return cls(paragraphs)
+
+    def headings(self, level):
+        """指定レベルの見出しの段落"""
+        return [paragraph for paragraph in self.paragraphs if paragraph['heading_level'] == level]
+
+    def h2_elements(self):
+        """画像の挿入先になるH2見出し [{'text', 'end_index'}]
+
+        見出しスタイルのない「## 見出し」形式の段落もH2として扱う（マークダウンのまま保存された文書との互換）。
+        """
+        h2_elements = []
+        for paragraph in self.paragraphs:
+            if paragraph['heading_level'] == 2:
+                h2_elements.append({'text': paragraph['text'], 'end_index': paragraph['end_index']})
+            elif paragraph['heading_level'] == 0:
+                match = self._MARKDOWN_H2.match(paragraph['text'])
+                if match:
+                    h2_elements.append({'text': match.group(1).strip(), 'end_index': paragraph['end_index']})
+        for index, h2 in enumerate(h2_elements):
+            logger.info(f"[DOC_INDEX] H2 [{index + 1}]: '{h2['text']}' (end_index: {h2['end_index']})")
+        return h2_elements
+
+
+def _heading_lines(text):
+    """見出し行（# 〜 ####）を空白を除いて順に返す"""
+    headings = []
+    for line in text.split('\n'):
+        match = re.match(r'^(#{1,4})\s*(.+)$', line.strip())
+        if match:
+            headings.append(match.group(1) + re.sub(r'\s', '', match.group(2)))
+    return headings
+
+
+def apply_refine_edits(article, edits):
+    """Step3（patch）の編集操作を記事に適用
+
+    - replace_text: section（H2見出し、省略時は記事全体）内で find に一致する箇所を replace に置換。
+      find が1箇所に特定できない場合や見出し行を含む場合は適用しない。
+    - replace_section: H2セクションの本文（H2見出し行を除く）を content で置換。
+      配下のH3/H4見出しが一字一句同じでない場合は適用しない。
+    - 見出し構成は編集ごとにセクション単位で確かめ、変わる編集だけを不適用にする（他の編集は適用する）。
+
+    Returns:
+        (記事, 適用数, 不適用数)。それでも全体の見出し構成が変わった場合は (None, 0, 件数)
+    """
+    blocks = [[h2, text] for h2, text in _split_h2_blocks(article)]
+
+    def find_block(section):
+        key = re.sub(r'\s', '', (section or '').lstrip('#'))
+        if not key:
+            return None
+        for index, (h2, _) in enumerate(blocks):
+            if h2 and re.sub(r'\s', '', h2) == key:
+                return index
+        return 0 if key in ('導入部', 'リード文') else None
+
+    applied = 0
+    failed = 0
+    for edit in edits:
+        if not isinstance(edit, dict):
+            failed += 1
+            continue
+        op = edit.get('op')
+        index = find_block(edit.get('section'))
+
+        if op == 'replace_text':
+            find = edit.get('find') or ''
+            replace = edit.get('replace')
+            targets = [index] if index is not None else range(len(blocks))
+            hits = [i for i in targets if find and find in blocks[i][1]]
+            if (replace is None or len(hits) != 1 or blocks[hits[0]][1].count(find) != 1
+                    or _heading_lines(find) or _heading_lines(replace)):
+                failed += 1
+                continue
+            block = blocks[hits[0]][1]
+            updated = block.replace(find, replace, 1)
+            if _heading_lines(updated) != _heading_lines(block):
+                failed += 1
+                continue
+            blocks[hits[0]][1] = updated
+            applied += 1
+
+        elif op == 'replace_section':
+            content = (edit.get('content') or '').strip()
+            if not index or not content:
+                failed += 1
+                continue
+            block = blocks[index][1]
+            header, _, body = block.partition('\n')
+            if _heading_lines(content) != _heading_lines(body):
+                failed += 1
+                continue
+            trailing = block[len(block.rstrip('\n')):]
+            updated = f"{header}\n{content}{trailing}"
+            if _heading_lines(updated) != _heading_lines(block):
+                failed += 1
+                continue
+            blocks[index][1] = updated
+            applied += 1
+
+        else:
+            failed += 1
+
+    result = '\n'.join(text for _, text in blocks)
+    if _heading_lines(result) != _heading_lines(article):
+        return None, 0, len(edits)
+    return result, applied, failed
+
+
+# 記事全体で必要な表・箇条書き（まとめ以外）の個数（下限, 上限）
+ARTICLE_TABLE_RANGE = (2, 3)
+ARTICLE_BULLET_RANGE = (2, 4)
+# 見出しの表記ゆれとみなして機械的にシートの表記へ戻す類似度の下限
+HEADING_AUTOFIX_MIN_RATIO = 0.6
+
+# 「働」の動詞の活用形（働く・働き・働いて・働ける・働こう 等）。
+# 「働」で終わる熟語（労働から・稼働いたします 等）は対象外（共働きは autofix_article_rules で個別に置換）
+_HATARAKU_COMPOUND_PREFIXES = '労稼実協共可別就'
+_HATARAKU_PATTERN = re.compile(rf'(?<![{_HATARAKU_COMPOUND_PREFIXES}])働(?=[かきくけこい])')
+# 「文字数：5,000字」「(5,162字)」のような文字数カウントの混入
+_CHAR_COUNT_FRAGMENT = re.compile(r'[（(]?\s*文字数\s*[:：]\s*約?[\d,，]*\s*字?\s*[)）]?')
+_CHAR_COUNT_LINE = re.compile(r'^\s*[（(]\s*約?[\d,，]+\s*字\s*[)）]\s*$')
+_BULLET_LINE = re.compile(r'^\s*(?:[-*・])\s+\S')
+
+
+def _article_heading_entries(article):
+    """H2〜H4の見出し行を [(行番号, レベル, 見出し), ...] で返す（H1は含まない）"""
+    entries = []
+    for line_no, line in enumerate(article.split('\n')):
+        match = re.match(r'^(#{2,4})(?!#)\s*(.+)$', line.strip())
+        if match:
+            entries.append((line_no, len(match.group(1)), match.group(2).strip()))
+    return entries
+
+
+def _expected_heading_entries(headings):
+    """シートの見出し（H2〜H4）を [(レベル, 見出し), ...] で返す"""
+    return [(int(h['level'][1]), h['text'].strip()) for h in headings or []
+            if h.get('level') in ('H2', 'H3', 'H4') and h.get('text')]
+
+
+def _count_table_blocks(lines):
+    count = 0
+    in_table = False
+    for line in lines:
+        stripped = line.strip()
+        is_table = stripped.startswith('|') and stripped.endswith('|')
+        if is_table and not in_table:
+            count += 1
+        in_table = is_table
+    return count
+
+
+def _count_bullet_blocks(lines):
+    count = 0
+    in_list = False
+    for line in lines:
+        is_bullet = bool(_BULLET_LINE.match(line))
+        if is_bullet and not in_list:
+            count += 1
+        if line.strip():
+            in_list = is_bullet
+    return count
+
+
+def visible_char_count(article):
+    """Googleドキュメント上で見える文字数（Markdown記法・空白・改行を除く）
+
+    見出しの #、表の | と区切り行、箇条書きの記号、太字の ** は数えない。
+    """
+    count = 0
+    for line in article.split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('|') and stripped.endswith('|'):
+            if re.match(r'^\|[\s\-:|]+\|$', stripped):
+                continue
+            text = stripped.replace('|', '')
+        else:
+            text = re.sub(r'^#{1,6}\s*', '', stripped)
+            text = re.sub(r'^(?:[-*・]|\d+\.)\s+', '', text)
+        text = text.replace('**', '')
+        count += len(re.sub(r'\s', '', text))
+    return count
+
+
+def autofix_article_rules(article, headings=None):
+    """機械的に直せるルール違反をローカルで修正
+
+    - 「働」の活用形を平仮名に（共働き→共ばたらき）
+    - 太字マークダウン（**）を除去
+    - 「文字数：○○字」等の文字数カウントを除去
+    - 見出しがシートと同じ数・レベル順で表記だけ揺れている場合はシートの表記に戻す
+
+    Returns:
+        (記事, {修正の種類: 件数})
+    """
+    fixes = {}
+
+    count = article.count('共働き')
+    if count:
+        article = article.replace('共働き', '共ばたらき')
+    article, hataraku = _HATARAKU_PATTERN.subn('はたら', article)
+    if count + hataraku:
+        fixes['hataraku'] = count + hataraku
+
+    count = article.count('**')
+    if count:
+        article = article.replace('**', '')
+        fixes['bold'] = count // 2 or 1
+
+    lines = []
+    removed = 0
+    for line in article.split('\n'):
+        if re.search(r'文字数\s*[:：]', line):
+            line = _CHAR_COUNT_FRAGMENT.sub('', line)
+            removed += 1
+            if not line.strip() or re.search(r'文字数\s*[:：]', line):
+                continue
+        elif _CHAR_COUNT_LINE.match(line):
+            removed += 1
+            continue
+        lines.append(line)
+    if removed:
+        fixes['char_count'] = removed
+
+    expected = _expected_heading_entries(headings)
+    actual = _article_heading_entries('\n'.join(lines))
+    if expected and len(expected) == len(actual):
+        renamed = 0
+        for (line_no, level, text), (expected_level, expected_text) in zip(actual, expected):
+            if level == expected_level and text == expected_text:
+                continue
+            ratio = SequenceMatcher(None, re.sub(r'\s', '', text), re.sub(r'\s', '', expected_text)).ratio()
+            if ratio < HEADING_AUTOFIX_MIN_RATIO:
+                continue
+            lines[line_no] = f"{'#' * expected_level} {expected_text}"
+            renamed += 1
+        if renamed:
+            fixes['headings'] = renamed
+
+    return '\n'.join(lines), fixes
+
+
+def check_article_rules(article, headings=None):
+    """ローカルで判定できるルールを検査（autofix_article_rules で直せなかった違反のみが残る想定）
+
+    Returns:
+        {'visible_chars', 'tables', 'bullets', 'issues'}。issues は監査結果と同じ
+        {"location", "issue", "fix"} 形式で、Step3 にそのまま渡せる
+    """
+    issues = []
+    lines = article.split('\n')
+
+    expected = _expected_heading_entries(headings)
+    if expected:
+        actual = [(level, text) for _, level, text in _article_heading_entries(article)]
+        normalize = lambda entries: [(level, re.sub(r'\s', '', text)) for level, text in entries]
+        if normalize(actual) != normalize(expected):
+            actual_keys = set(normalize(actual))
+            expected_keys = set(normalize(expected))
+            for level, text in expected:
+                if (level, re.sub(r'\s', '', text)) not in actual_keys:
+                    issues.append({"location": f"H{level}「{text}」", "issue": "シートの見出しが記事にありません",
+                                   "fix": f"H{level}「{text}」を正しい位置に追加する"})
+            for level, text in actual:
+                if (level, re.sub(r'\s', '', text)) not in expected_keys:
+                    issues.append({"location": f"H{level}「{text}」", "issue": "シートにない見出しです",
+                                   "fix": "シートの見出しに合わせて削除または修正する（見出しの追加・変更は禁止）"})
+            if not issues:
+                issues.append({"location": "見出し構成", "issue": "見出しの順序がシートと異なります",
+                               "fix": "見出しをシートと同じ順序に並べ替える"})
+
+    summary_start = len(lines)
+    for line_no, level, text in _article_heading_entries(article):
+        if level == 2 and 'まとめ' in text:
+            summary_start = line_no
+            break
+
+    tables = _count_table_blocks(lines)
+    if not ARTICLE_TABLE_RANGE[0] <= tables <= ARTICLE_TABLE_RANGE[1]:
+        issues.append({"location": "記事全体", "issue": f"表が{tables}個です（{ARTICLE_TABLE_RANGE[0]}〜{ARTICLE_TABLE_RANGE[1]}個必要）",
+                       "fix": "Markdown形式の表を追加する" if tables < ARTICLE_TABLE_RANGE[0] else "重要度の低い表を文章に置き換える"})
+
+    bullets = _count_bullet_blocks(lines[:summary_start])
+    if not ARTICLE_BULLET_RANGE[0] <= bullets <= ARTICLE_BULLET_RANGE[1]:
+        issues.append({"location": "記事全体", "issue": f"箇条書きが{bullets}個です（{ARTICLE_BULLET_RANGE[0]}〜{ARTICLE_BULLET_RANGE[1]}個必要）",
+                       "fix": "まとめ以外のセクションに箇条書き（- ）を追加する" if bullets < ARTICLE_BULLET_RANGE[0] else "箇条書きの一部を文章に置き換える"})
+    if _count_bullet_blocks(lines[summary_start:]):
+        issues.append({"location": "まとめ", "issue": "まとめセクションに箇条書きがあります", "fix": "まとめの箇条書きを文章に書き換える"})
+
+    if _HATARAKU_PATTERN.search(article) or '**' in article or re.search(r'文字数\s*[:：]', article):
+        issues.append({"location": "記事全体", "issue": "表記ルール（働の平仮名・太字・文字数カウント）の違反が残っています",
+                       "fix": "該当箇所を修正する"})
+
+    return {
+        'visible_chars': visible_char_count(article),
+        'tables': tables,
+        'bullets': bullets,
+        'issues': issues
+    }
+
+
+def merge_rule_issues(issues_json, rule_issues):
+    """ローカル検査の残存違反を監査結果の "rules" に追加した JSON を返す"""
+    if not rule_issues:
+        return issues_json
+    issues = parse_audit_issues(issues_json)
+    if issues is None:
+        return f"{issues_json}\n\n" + json.dumps({'rules': rule_issues}, ensure_ascii=False, indent=2)
+    issues['rules'] = rule_issues
+    return json.dumps(issues, ensure_ascii=False, indent=2)
+
+
+class RefineStats:
+    """Step3（修正）の実行方式ごとの件数と、スキップ・軽量化で短縮できた推定時間"""
+
+    def __init__(self):
+        self.counts = {'skip': 0, 'light': 0, 'full': 0}
+        self.full_duration_avg = None  # 通常修正の所要時間の移動平均（秒）
+        self.time_saved_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, plan, duration=0.0):
+        with self.lock:
+            self.counts[plan] += 1
+            if plan == 'full':
+                if self.full_duration_avg is None:
+                    self.full_duration_avg = duration
+                else:
+                    self.full_duration_avg = self.full_duration_avg * 0.8 + duration * 0.2
+            elif self.full_duration_avg is not None:
+                self.time_saved_seconds += max(0.0, self.full_duration_avg - duration)
+
+    def get_stats(self):
+        with self.lock:
+            total = sum(self.counts.values())
+            return {
+                'counts': dict(self.counts),
+                'skip_rate': round(self.counts['skip'] / total, 3) if total else 0.0,
+                'light_rate': round(self.counts['light'] / total, 3) if total else 0.0,
+                'full_duration_avg_seconds': round(self.full_duration_avg, 1) if self.full_duration_avg is not None else None,
+                'time_saved_seconds': round(self.time_saved_seconds, 1)
+            }
+
+
+REFINE_STATS = RefineStats()
+
+
 class ArticleAutomation:
     def __init__(self, spreadsheet_id, openai_api_key, image_folder_id=None, project_id=None, image_generation_method='existing_folder',
-                 master_spreadsheet_id=None, keyword_column='G', article_url_column='N', anthropic_api_key=None):
+                 master_spreadsheet_id=None, keyword_column='G', article_url_column='N', anthropic_api_key=None,
+                 draft_mode=None, bypass_llm_cache=False):
         self.spreadsheet_id = spreadsheet_id
         self.image_folder_id = image_folder_id
+        self.draft_mode = draft_mode or DRAFT_MODE  # 'single' or 'sectioned'
+        self.bypass_llm_cache = bypass_llm_cache  # True の場合、LLM応答キャッシュを参照・保存しない
         self.project_id = project_id or os.environ.get('GCP_PROJECT_ID', 'YOUR_GCP_PROJECT_ID')
         self.image_generation_method = image_generation_method  # 'existing_folder', 'vertex_ai', or 'both'
         # マスターシート関連
@@ -83,66 +2438,46 @@ class ArticleAutomation:
         self.article_url_column = article_url_column  # 初稿URL列（デフォルト: N）
         # OpenAI クライアントを初期化
         self.openai_client = OpenAI(
-            api_key=openai_api_key
+            api_key=openai_api_key,
+            max_retries=0  # 429・一時エラーのリトライは RATE_LIMITER で行う
         )
         # Claude クライアントを初期化（APIキーがあれば）
         self.anthropic_api_key = anthropic_api_key or os.environ.get('ANTHROPIC_API_KEY')
         self.claude_client = None
         if self.anthropic_api_key:
-            self.claude_client = anthropic.Anthropic(api_key=self.anthropic_api_key)
-        self.sheets_service = None
-        self.docs_service = None
-        self.drive_service = None
+            self.claude_client = anthropic.Anthropic(api_key=self.anthropic_api_key, max_retries=0)
         self.image_cache = None  # サブフォルダーと画像のキャッシュ
         self.credentials = None  # Google認証情報を保存
+        self.progress = None  # ProgressJob（ストリーミング生成時のみ）
 
-    def authenticate_google(self):
-        """サービスアカウントで認証"""
-        # 環境変数からサービスアカウントキーを取得
-        service_account_key = os.environ.get('GOOGLE_SERVICE_ACCOUNT_KEY')
-
-        if not service_account_key:
-            raise ValueError("GOOGLE_SERVICE_ACCOUNT_KEY environment variable is not set")
-
-        logger.info(f"[DEBUG] 環境変数の最初の20文字: {service_account_key[:20]}")
-        logger.info(f"[DEBUG] 環境変数の長さ: {len(service_account_key)}")
-
-        try:
-            # JSONとしてパース
-            service_account_info = json.loads(service_account_key)
-            logger.info(f"[DEBUG] JSON解析成功。client_email: {service_account_info.get('client_email', 'N/A')}")
-        except json.JSONDecodeError as e:
-            logger.error(f"JSONパースエラー: {e}")
-            logger.error(f"環境変数の値（最初の100文字）: {service_account_key[:100]}")
-            raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_KEY: {e}")
+    # サービスはスレッドごとに GOOGLE_CLIENTS から取得する（httplib2 はスレッドセーフではないため）
+    @property
+    def sheets_service(self):
+        return GOOGLE_CLIENTS.service('sheets', 'v4') if self.credentials else None
 
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=SCOPES
-        )
+    @property
+    def docs_service(self):
+        return GOOGLE_CLIENTS.service('docs', 'v1') if self.credentials else None
 
-        # 認証情報を保存
-        self.credentials = credentials
+    @property
+    def drive_service(self):
+        return GOOGLE_CLIENTS.service('drive', 'v3') if self.credentials else None
 
-        self.sheets_service = build('sheets', 'v4', credentials=credentials)
-        self.docs_service = build('docs', 'v1', credentials=credentials)
-        self.drive_service = build('drive', 'v3', credentials=credentials)
+    def authenticate_google(self):
+        """サービスアカウントで認証（プロセス共通のクライアントプールを使用）"""
+        self.credentials = GOOGLE_CLIENTS.get_credentials()
 
-        # Vertex AIの初期化（認証情報を使用）
-        aiplatform.init(
-            project=self.project_id,
-            location='us-central1',
-            credentials=credentials
-        )
+        # Vertex AIの初期化（プロセスで1回のみ）
+        GOOGLE_CLIENTS.ensure_vertex_initialized(self.project_id)
 
     def get_all_sheets(self):
         """すべてのシート名を取得"""
         try:
             logger.info(f"[DEBUG] スプレッドシートID: {self.spreadsheet_id}")
             logger.info(f"[DEBUG] Sheets Service: {self.sheets_service}")
-            sheet_metadata = self.sheets_service.spreadsheets().get(
+            sheet_metadata = execute_google(self.sheets_service.spreadsheets().get(
                 spreadsheetId=self.spreadsheet_id
-            ).execute()
+            ))
             logger.info(f"[DEBUG] メタデータ取得成功")
             sheets = sheet_metadata.get('sheets', [])
             logger.info(f"[DEBUG] シート数: {len(sheets)}")
@@ -157,6 +2492,7 @@ class ArticleAutomation:
             logger.error(f"予期しないエラー: {e}")
             return []
 
+    @timed_stage('sheet_read')
     def get_headings_from_sheet(self, sheet_name, force=False):
         """シートから見出しデータを抽出（列ズレ対応版）
 
@@ -165,120 +2501,169 @@ class ArticleAutomation:
             force: Trueの場合、処理済みでも再生成する
         """
         try:
-            range_name = f"'{sheet_name}'!A1:H100"  # H列まで広めに取得
-            result = self.sheets_service.spreadsheets().values().get(
+            range_name = f"'{sheet_name}'!{HEADING_RANGE}"  # H列まで広めに取得
+            result = execute_google(self.sheets_service.spreadsheets().values().get(
                 spreadsheetId=self.spreadsheet_id,
                 range=range_name
-            ).execute()
+            ))
 
-            values = result.get('values', [])
+            return self._parse_heading_values(sheet_name, result.get('values', []), force=force)
 
-            if not values:
-                logger.info(f"[DEBUG] シート '{sheet_name}': データが空")
-                return None
+        except HttpError as err:
+            logger.error(f"エラー: スプレッドシートの取得に失敗 - {err}")
+            return None
 
-            if len(values) < 7:
-                logger.info(f"[DEBUG] シート '{sheet_name}': 行数不足（{len(values)}行、最低7行必要）")
-                return None
+    @timed_stage('sheet_read')
+    def get_headings_from_sheets(self, sheet_names, force=False):
+        """複数シートの見出しデータを values.batchGet でまとめて取得
 
-            # キーワード抽出（3行目付近を探索）
-            keyword = ""
-            if len(values) > 2:
-                for cell in values[2]:
-                    cell_text = cell.strip() if cell else ""
-                    # ラベル（メインKW、キーワード等）をスキップ
-                    if cell_text and not cell_text.startswith("メインKW") and not cell_text.startswith("キーワード"):
-                        keyword = cell_text
-                        break
-            
-            # ステータス確認（F2セル相当を探す）
-            # 2行目の「処理済み」を含むセルを探す
-            status = ""
-            if len(values) > 1:
-                for cell in values[1]:
-                    if cell == "処理済み":
-                        status = "処理済み"
-                        break
-            
-            logger.info(f"[DEBUG] シート '{sheet_name}': ステータス='{status}', force={force}")
-            if status == "処理済み" and not force:
-                logger.info(f"[DEBUG] シート '{sheet_name}': 処理済みのためスキップ")
-                return None
-            elif status == "処理済み" and force:
-                logger.info(f"[DEBUG] シート '{sheet_name}': 処理済みですが、force=Trueのため再生成します")
+        シートごとに values().get を呼ぶ代わりに、HEADINGS_BATCH_SIZE 件ずつ
+        1リクエストで読み込み、get_headings_from_sheet と同じパーサーで解析する。
 
-            # 見出し抽出（全行スキャン、行の中にH1-H4があるか探す）
-            h1_title = ""
-            headings = []
+        Args:
+            sheet_names: シート名のリスト
+            force: Trueの場合、処理済みでも再生成する
 
-            # 2行目のタイトル案（H1）をまずチェック
-            if len(values) > 1:
-                row = values[1]
-                # "タイトル案" の右側、または H1タグがあるか
-                for i, cell in enumerate(row):
-                    if not cell: continue
-                    # H1タグがある場合、その右側をタイトルとする
-                    if cell.strip() == "H1" and i + 1 < len(row):
-                        h1_title = row[i+1].strip()
-                        break
-                    # 単に長い文字列があればタイトル候補とする（後でH1が見つからなければこれを使う）
-                    if len(cell) > 10 and "タイトル" not in cell and not h1_title:
-                         h1_title = cell.strip()
-
-            # 7行目以降をスキャンして見出しを探す
-            for i in range(6, len(values)):
-                row = values[i]
-                if not row: continue
-
-                hierarchy = ""
-                heading_text = ""
-
-                # 行内で H1, H2... を探す
-                for j, cell in enumerate(row):
-                    if not cell: continue
-                    val = cell.strip()
-                    if val in ["H1", "H2", "H3", "H4"]:
-                        hierarchy = val
-                        # マーカーの右側にある最初の空でないセルを見出しテキストとする
-                        for k in range(j + 1, len(row)):
-                            if row[k] and row[k].strip():
-                                heading_text = row[k].strip()
-                                break
-                        break
-                
-                if hierarchy and heading_text:
-                    if hierarchy == "H1":
-                        h1_title = heading_text
-                    else:
-                        headings.append({
-                            'level': hierarchy,
-                            'text': heading_text
-                        })
+        Returns:
+            {シート名: 見出しデータ（対象外ならNone）} の辞書（sheet_namesの順序を保持）
+        """
+        results = {}
 
-            # H2の数をカウント
-            h2_count = len([h for h in headings if h['level'] == 'H2'])
+        for start in range(0, len(sheet_names), HEADINGS_BATCH_SIZE):
+            chunk = sheet_names[start:start + HEADINGS_BATCH_SIZE]
+            ranges = [f"'{name}'!{HEADING_RANGE}" for name in chunk]
+
+            try:
+                response = execute_google(self.sheets_service.spreadsheets().values().batchGet(
+                    spreadsheetId=self.spreadsheet_id,
+                    ranges=ranges
+                ))
+                value_ranges = response.get('valueRanges', [])
+                logger.info(f"[BATCH_GET] {len(chunk)}シートを一括取得（{start + 1}〜{start + len(chunk)}/{len(sheet_names)}）")
+            except HttpError as err:
+                # 1シートでも範囲が不正だとチャンク全体が失敗するため、個別取得にフォールバック
+                logger.warning(f"[BATCH_GET] 一括取得に失敗。シートごとの取得に切り替えます - {err}")
+                for name in chunk:
+                    results[name] = self.get_headings_from_sheet(name, force=force)
+                continue
 
-            logger.info(f"[DEBUG] シート '{sheet_name}': H1='{h1_title}', 見出し総数={len(headings)}, H2数={h2_count}")
+            # valueRanges はリクエストした ranges と同じ順序で返る
+            for i, name in enumerate(chunk):
+                values = value_ranges[i].get('values', []) if i < len(value_ranges) else []
+                results[name] = self._parse_heading_values(name, values, force=force)
 
-            if h1_title and headings:
-                return {
-                    'keyword': keyword,
-                    'h1_title': h1_title,
-                    'headings': headings,
-                    'sheet_name': sheet_name
-                }
-            
-            # データが見つからなかった場合のデバッグログ
-            if not headings:
-                logger.info(f"[DEBUG] シート '{sheet_name}': 見出しが見つかりませんでした。行データをダンプします:")
-                for i in range(min(15, len(values))):
-                     logger.info(f"Row {i}: {values[i]}")
+        return results
 
+    def _parse_heading_values(self, sheet_name, values, force=False):
+        """シートのセル値から見出しデータを抽出（列ズレ対応版）
+
+        Args:
+            sheet_name: シート名
+            values: A1:H100 の値（行ごとのリスト）
+            force: Trueの場合、処理済みでも再生成する
+        """
+        if not values:
+            logger.info(f"[DEBUG] シート '{sheet_name}': データが空")
             return None
 
-        except HttpError as err:
-            logger.error(f"エラー: スプレッドシートの取得に失敗 - {err}")
+        if len(values) < 7:
+            logger.info(f"[DEBUG] シート '{sheet_name}': 行数不足（{len(values)}行、最低7行必要）")
+            return None
+
+        # キーワード抽出（3行目付近を探索）
+        keyword = ""
+        if len(values) > 2:
+            for cell in values[2]:
+                cell_text = cell.strip() if cell else ""
+                # ラベル（メインKW、キーワード等）をスキップ
+                if cell_text and not cell_text.startswith("メインKW") and not cell_text.startswith("キーワード"):
+                    keyword = cell_text
+                    break
+        
+        # ステータス確認（F2セル相当を探す）
+        # 2行目の「処理済み」を含むセルを探す
+        status = ""
+        if len(values) > 1:
+            for cell in values[1]:
+                if cell == "処理済み":
+                    status = "処理済み"
+                    break
+        
+        logger.info(f"[DEBUG] シート '{sheet_name}': ステータス='{status}', force={force}")
+        if status == "処理済み" and not force:
+            logger.info(f"[DEBUG] シート '{sheet_name}': 処理済みのためスキップ")
             return None
+        elif status == "処理済み" and force:
+            logger.info(f"[DEBUG] シート '{sheet_name}': 処理済みですが、force=Trueのため再生成します")
+
+        # 見出し抽出（全行スキャン、行の中にH1-H4があるか探す）
+        h1_title = ""
+        headings = []
+
+        # 2行目のタイトル案（H1）をまずチェック
+        if len(values) > 1:
+            row = values[1]
+            # "タイトル案" の右側、または H1タグがあるか
+            for i, cell in enumerate(row):
+                if not cell: continue
+                # H1タグがある場合、その右側をタイトルとする
+                if cell.strip() == "H1" and i + 1 < len(row):
+                    h1_title = row[i+1].strip()
+                    break
+                # 単に長い文字列があればタイトル候補とする（後でH1が見つからなければこれを使う）
+                if len(cell) > 10 and "タイトル" not in cell and not h1_title:
+                     h1_title = cell.strip()
+
+        # 7行目以降をスキャンして見出しを探す
+        for i in range(6, len(values)):
+            row = values[i]
+            if not row: continue
+
+            hierarchy = ""
+            heading_text = ""
+
+            # 行内で H1, H2... を探す
+            for j, cell in enumerate(row):
+                if not cell: continue
+                val = cell.strip()
+                if val in ["H1", "H2", "H3", "H4"]:
+                    hierarchy = val
+                    # マーカーの右側にある最初の空でないセルを見出しテキストとする
+                    for k in range(j + 1, len(row)):
+                        if row[k] and row[k].strip():
+                            heading_text = row[k].strip()
+                            break
+                    break
+            
+            if hierarchy and heading_text:
+                if hierarchy == "H1":
+                    h1_title = heading_text
+                else:
+                    headings.append({
+                        'level': hierarchy,
+                        'text': heading_text
+                    })
+
+        # H2の数をカウント
+        h2_count = len([h for h in headings if h['level'] == 'H2'])
+
+        logger.info(f"[DEBUG] シート '{sheet_name}': H1='{h1_title}', 見出し総数={len(headings)}, H2数={h2_count}")
+
+        if h1_title and headings:
+            return {
+                'keyword': keyword,
+                'h1_title': h1_title,
+                'headings': headings,
+                'sheet_name': sheet_name
+            }
+        
+        # データが見つからなかった場合のデバッグログ
+        if not headings:
+            logger.info(f"[DEBUG] シート '{sheet_name}': 見出しが見つかりませんでした。行データをダンプします:")
+            for i in range(min(15, len(values))):
+                 logger.info(f"Row {i}: {values[i]}")
+
+        return None
 
     def _group_headings_by_h2(self, headings):
         """見出しをH2ごとにグループ化"""
@@ -304,7 +2689,9 @@ class ArticleAutomation:
     def _summarize_section(self, section_content, h2_text):
         """セクションの要約を作成（次のセクション生成時に使用）"""
         try:
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                usage_step='summary',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "あなたは記事要約の専門家です。簡潔に要約してください。"},
@@ -331,8 +2718,16 @@ class ArticleAutomation:
             logger.error(f"エラー: 要約の作成に失敗 - {e}")
             return ""
 
-    def _generate_h2_section(self, keyword, h2_text, sub_headings, target_chars, section_index, total_sections, previous_summary=""):
-        """1つのH2セクションを生成"""
+    def _generate_h2_section(self, keyword, h2_text, sub_headings, target_chars, section_index, total_sections, previous_summary="",
+                             design_md="", headings_md="", model="gpt-4o-mini"):
+        """1つのH2セクションを生成
+
+        design_md を渡した場合は前セクションの要約の代わりに全体設計を共通コンテキストとして使うため、
+        セクション同士を並列に生成できる。
+
+        Returns:
+            (section_content, usage)
+        """
         try:
             # サブ見出しをマークダウン形式に変換
             sub_headings_text = ""
@@ -361,11 +2756,26 @@ class ArticleAutomation:
 - 上記と重複する内容は書かないでください
 - 上記の流れを受けて、このセクションの話題に自然に進んでください
 - 同じ具体例・数字・表現を繰り返さないでください"""
+            elif design_md:
+                previous_context = f"""
+
+【記事全体の見出し構成】
+{headings_md}
+
+【記事全体の設計（全セクション共通）】
+{design_md}
+
+【注意事項】
+- 上記設計のうち、H2「{h2_text}」の設計（解決する疑問・冒頭の要点）に沿って書いてください
+- 専門用語は設計の説明文を使い、初出時に（）で説明してください
+- 他のH2で扱う話題には深入りせず、重複を避けてください"""
 
             logger.info(f"[{section_index}/{total_sections}] H2セクション生成中: {h2_text}（目標{target_chars}字）")
 
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('draft'),
+                model=model,
                 messages=[
                     {"role": "system", "content": f"""あなたはウェブマガジンの専門ライターです。
 
@@ -420,19 +2830,74 @@ class ArticleAutomation:
 セクション本文のみを出力してください（H1見出しは不要、H2見出しから開始）。
 ※文字数カウント（例：「文字数：○○字」）は絶対に出力しないこと。"""}
                 ],
-                max_completion_tokens=2000
+                max_completion_tokens=4000 if model.startswith('gpt-5') else 2000
             )
 
             section_content = response.choices[0].message.content
             section_char_count = len(section_content)
             logger.info(f"[{section_index}/{total_sections}] セクション生成完了: {section_char_count}字")
 
-            return section_content
+            return section_content, response.usage
 
         except Exception as e:
             logger.error(f"エラー: H2セクション「{h2_text}」の生成に失敗 - {e}")
-            return f"## {h2_text}\n\nERROR: {str(e)}"
+            return f"## {h2_text}\n\nERROR: {str(e)}", None
+
+    def _cache_step(self, step):
+        """LLM応答キャッシュのステップ名（バイパス指定時は None = キャッシュしない）"""
+        return None if self.bypass_llm_cache else step
+
+    def _report_stage(self, stage, message=""):
+        """進捗ジョブがあればステージ遷移を通知（利用料の集計ステップも切り替える）"""
+        set_usage_step(stage)
+        if self.progress:
+            self.progress.stage(stage, message)
+
+    def _aborted_error(self):
+        """中断要求があればエラー文字列を返す"""
+        if self.progress and self.progress.abort_reason:
+            return f"ERROR: 生成を中断しました - {self.progress.abort_reason}"
+        return None
+
+    def _stream_handler(self, stage, headings=None):
+        """進捗ジョブがある場合、ストリーミング受信ごとに進捗を記録し異常を検知するコールバックを返す
+
+        headings を渡した場合、完成した行に現れたH2が期待する順序と一致しなければ中断する。
+        「文字数：」の混入はどのステップでも中断対象。
+        """
+        if not self.progress:
+            return None
+
+        expected_h2 = [re.sub(r'\s', '', h['text']) for h in headings or [] if h['level'] == 'H2']
+        state = {'checked': 0, 'h2_seen': 0}
+
+        def on_text(text):
+            self.progress.update_text(stage, text)
+
+            if '文字数：' in text or '文字数:' in text:
+                self.progress.abort("出力に文字数カウント（文字数：）が混入しました")
+
+            # 前回以降に完成した行だけを検査
+            complete_end = text.rfind('\n') + 1
+            if headings and complete_end > state['checked']:
+                for line in text[state['checked']:complete_end].splitlines():
+                    match = re.match(r'^##(?!#)\s*(.+)$', line.strip())
+                    if not match:
+                        continue
+                    found = re.sub(r'\s', '', match.group(1))
+                    index = state['h2_seen']
+                    state['h2_seen'] += 1
+                    if index >= len(expected_h2) or found != expected_h2[index]:
+                        expected = expected_h2[index] if index < len(expected_h2) else "（なし）"
+                        self.progress.abort(f"見出しが構成と一致しません: 「{match.group(1)}」（期待: 「{expected}」）")
+                        break
+                state['checked'] = complete_end
+
+            self.progress.check_abort()
 
+        return on_text
+
+    @timed_stage('design')
     def generate_design(self, keyword, h1_title, headings):
         """Step0: 全体設計を生成（本文は書かない）"""
         try:
@@ -441,7 +2906,9 @@ class ArticleAutomation:
             # 見出し構造をMarkdown形式で文字列化
             headings_md = self._format_headings_md(headings)
 
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('design'),
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": """あなたは「読者目線」を最重視するSEO編集者。本文はまだ書かない。
@@ -506,6 +2973,7 @@ class ArticleAutomation:
             logger.error(f"エラー: 設計の生成に失敗 - {e}")
             return f"ERROR: {str(e)}", None
 
+    @timed_stage('draft')
     def generate_draft(self, keyword, h1_title, headings, design_md):
         """Step1: 初稿生成（設計に従って本文を書く）"""
         try:
@@ -522,16 +2990,20 @@ class ArticleAutomation:
             max_target = target_per_section + 100
             target_str = f"{min_target}～{max_target}"
 
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('draft'),
+                on_text=self._stream_handler('draft', headings),
                 model="gpt-5.2",
                 messages=[
-                    {"role": "system", "content": f"""あなたはクライアント企業メディアの記事ライターです。
+                    # システムプロンプトは記事ごとの値を含めない（プロンプトキャッシュが効くよう先頭を固定する）
+                    {"role": "system", "content": """あなたはクライアント企業メディアの記事ライターです。
 
 # ■■■ 絶対厳守ルール（違反は不合格） ■■■
 
 ## 【ルール1】見出しは全て使用（省略厳禁）
 提供された見出しを「全て」「そのまま」使用すること。
-- H2が{h2_count}個あれば、記事にもH2を{h2_count}個全て書く
+- H2の個数は依頼文の「今回の記事の条件」を参照し、その個数を全て書く
 - 見出しを1つでも省略したら不合格
 - 見出しを1文字でも変更したら不合格
 - 見出しの順序を変更したら不合格
@@ -540,7 +3012,7 @@ class ArticleAutomation:
 ## 【ルール2】文字数は5,000〜6,000字（厳守）★最重要★
 - 記事全体: 5,000〜6,000文字（絶対厳守）
 - 理想は5,500字（中央値を狙う）
-- 各H2セクション: {target_str}文字
+- 各H2セクション: 依頼文の「今回の記事の条件」に記載の文字数
 - 導入部: 400〜500文字
 - ★5,000字未満は不合格（具体例や説明が不足）★
 - ★6,000字超過も不合格（冗長すぎる）★
@@ -795,31 +3267,18 @@ class ArticleAutomation:
 H1: #、H2: ##、H3: ###、H4: ####
 箇条書き: -
 表: Markdown形式（| 項目 | 内容 | で書く）"""},
-                    {"role": "user", "content": f"""# ■ 記事執筆依頼 ■
-
-キーワード: {keyword}
-
-## H1見出し
-# {h1_title}
-
-## 見出し構造（以下{h2_count}個のH2を全て使用すること）
-{headings_md}
-
-## 参考: 全体設計
-{design_md}
-
----
+                    {"role": "user", "content": """# ■ 記事執筆依頼 ■
 
 # ■■■ 重要な指示 ■■■
 
-1. 上記の見出し構造に含まれる見出しを「全て」使ってください
-   - H2が{h2_count}個あります。{h2_count}個全て書いてください
+1. 末尾の見出し構造に含まれる見出しを「全て」使ってください
+   - 「今回の記事の条件」に記載の個数のH2を全て書いてください
    - 見出しは1文字も変えないでください
    - 見出しを省略しないでください
 
 2. ★文字数は5,000〜6,000文字で書いてください★（最重要）
    - 理想は5,500字前後（中央値を狙う）
-   - 各H2セクション: {target_str}文字
+   - 各H2セクション: 「今回の記事の条件」に記載の文字数
    - ★5,000字未満は不合格（内容不足）★
    - ★6,000字超過も不合格（冗長すぎ）★
 
@@ -896,7 +3355,25 @@ H1: #、H2: ##、H3: ###、H4: ####
 - 文字数カウント（例：「文字数：5,000字」）
 - チェック結果やコメント
 - 説明文や前置き
-- 「以上です」等の締めの言葉"""}
+- 「以上です」等の締めの言葉
+
+---
+
+""" + f"""# ■ 今回の記事の条件 ■
+
+キーワード: {keyword}
+
+- H2の数: {h2_count}個（{h2_count}個全て書くこと）
+- 各H2セクション: {target_str}文字
+
+## H1見出し
+# {h1_title}
+
+## 見出し構造（以下{h2_count}個のH2を全て使用すること）
+{headings_md}
+
+## 参考: 全体設計
+{design_md}"""}
                 ],
                 max_completion_tokens=8000
             )
@@ -912,6 +3389,102 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"エラー: 初稿の生成に失敗 - {e}")
             return f"ERROR: {str(e)}", None
 
+    def _generate_intro(self, keyword, h1_title, headings_md, design_md):
+        """sectioned モード用: H1直下のリード文（導入部）を生成"""
+        try:
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('draft'),
+                model=SECTION_DRAFT_MODEL,
+                messages=[
+                    {"role": "system", "content": """あなたはクライアント企業メディアの記事ライターです。
+記事の導入部（H1直下、最初のH2より前のリード文）だけを書きます。
+
+【必須要件】
+1) 文字数: 400〜500字
+2) 見出し（#）は出力しない。本文のみ
+3) 「働」の漢字のみ平仮名（はたらく等）。共働き→共ばたらき。履歴書・自己PR・面接・職場・時給等は漢字のまま
+4) 太字マークダウン（**）は使用しない。強調は「」（鉤括弧）のみ
+5) 「この記事では」「本記事では」で始めない。「〜を解説します」「〜を紹介します」は使わない
+6) 読者の悩みや状況から書き始め、記事で得られることを端的に伝える
+7) です・ます調。1文は40〜60字以内"""},
+                    {"role": "user", "content": f"""キーワード: {keyword}
+
+# {h1_title}
+
+【記事全体の見出し構成】
+{headings_md}
+
+【記事全体の設計】
+{design_md}
+
+導入部の本文のみを出力してください。
+※文字数カウント（例：「文字数：○○字」）は絶対に出力しないこと。"""}
+                ],
+                max_completion_tokens=2000
+            )
+
+            return response.choices[0].message.content.strip(), response.usage
+
+        except Exception as e:
+            logger.error(f"エラー: 導入部の生成に失敗 - {e}")
+            return f"ERROR: {str(e)}", None
+
+    @timed_stage('draft')
+    def generate_draft_sectioned(self, keyword, h1_title, headings, design_md):
+        """Step1（sectioned モード）: 導入部と各H2セクションを並列生成して結合
+
+        前セクションの要約の代わりに Step0 の設計を共通コンテキストとするため、
+        全セクションを同時に生成できる（所要時間は最も遅い1セクション分）。
+        まとめ等の最終H2も他のH2と同様に1セクションとして生成する。
+        """
+        try:
+            headings_md = self._format_headings_md(headings)
+            h2_groups = self._group_headings_by_h2(headings)
+            if not h2_groups:
+                return "ERROR: H2見出しがありません", None
+
+            # 各H2セクションの目標文字数（generate_draft と同じ配分）
+            target_per_section = 4500 // len(h2_groups)
+            total_sections = len(h2_groups)
+
+            logger.info(f"[Step1] 初稿をセクション並列で生成中...（H2: {total_sections}個）")
+            start_time = time.time()
+
+            max_workers = max(1, min(total_sections + 1, SECTION_DRAFT_CONCURRENCY))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                intro_future = submit_with_usage_tags(executor, self._generate_intro, keyword, h1_title, headings_md, design_md)
+                section_futures = [
+                    submit_with_usage_tags(
+                        executor, self._generate_h2_section,
+                        keyword, group['h2'], group['sub_headings'], target_per_section,
+                        index + 1, total_sections,
+                        design_md=design_md, headings_md=headings_md, model=SECTION_DRAFT_MODEL
+                    )
+                    for index, group in enumerate(h2_groups)
+                ]
+                intro, intro_usage = intro_future.result()
+                section_results = [future.result() for future in section_futures]
+
+            if intro.startswith("ERROR:"):
+                return intro, None
+            for (content, usage), group in zip(section_results, h2_groups):
+                if usage is None:
+                    return f"ERROR: H2セクション「{group['h2']}」の生成に失敗しました", None
+
+            sections = [content.strip() for content, _ in section_results]
+            draft_md = f"# {h1_title}\n\n{intro}\n\n" + "\n\n".join(sections)
+            usage = _merge_usage([intro_usage] + [u for _, u in section_results])
+
+            logger.info(f"[Step1] 初稿完了（文字数: {len(draft_md)}字、tokens: {usage.total_tokens}、所要時間: {time.time() - start_time:.1f}秒）")
+
+            return draft_md, usage
+
+        except Exception as e:
+            logger.error(f"エラー: セクション並列での初稿生成に失敗 - {e}")
+            return f"ERROR: {str(e)}", None
+
+    @timed_stage('draft_claude')
     def generate_draft_with_claude(self, keyword, h1_title, headings):
         """Claude APIを使用して初稿を生成（性能テスト用・最小フロー）"""
         try:
@@ -931,20 +3504,21 @@ H1: #、H2: ##、H3: ###、H4: ####
             max_target = target_per_section + 100
             target_str = f"{min_target}～{max_target}"
 
-            system_prompt = f"""あなたはクライアント企業メディアの記事ライターです。
+            # システムプロンプトは記事ごとの値を含めない（cache_control でプロンプトキャッシュする）
+            system_prompt = """あなたはクライアント企業メディアの記事ライターです。
 
 # 絶対厳守ルール
 
 ## 【ルール1】見出しは全て使用（省略厳禁）
 提供された見出しを「全て」「そのまま」使用すること。
-- H2が{h2_count}個あれば、記事にもH2を{h2_count}個全て書く
+- H2の個数は依頼文に記載。その個数を全て書く
 - 見出しを1つでも省略したら不合格
 - 見出しを1文字でも変更したら不合格
 
 ## 【ルール2】文字数は5,000〜6,000字（厳守）
 - 記事全体: 5,000〜6,000文字
 - 理想は5,500字
-- 各H2セクション: {target_str}文字
+- 各H2セクション: 依頼文に記載の文字数
 - 導入部: 400〜500文字
 
 ## 【ルール3】禁止事項
@@ -995,26 +3569,24 @@ H1: #、H2: ##、H3: ###、H4: ####
 
 記事本文のみを出力してください。説明や前置きは不要です。"""
 
-            response = self.claude_client.messages.create(
+            response = claude_message(
+                self.claude_client,
+                cache_step=self._cache_step('draft'),
                 model="claude-sonnet-4-20250514",
                 max_tokens=8000,
                 messages=[
                     {"role": "user", "content": user_prompt}
                 ],
-                system=system_prompt
+                system=[{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
             )
 
             draft_md = response.content[0].text
             char_count = len(draft_md)
 
             # 使用量情報を作成
-            usage_info = {
-                'input_tokens': response.usage.input_tokens,
-                'output_tokens': response.usage.output_tokens,
-                'total_tokens': response.usage.input_tokens + response.usage.output_tokens
-            }
+            usage_info = _claude_usage_info(response.usage)
 
-            logger.info(f"[Claude] 初稿完了（文字数: {char_count}字、tokens: {usage_info['total_tokens']}）")
+            logger.info(f"[Claude] 初稿完了（文字数: {char_count}字、tokens: {usage_info['total_tokens']}、キャッシュ読込: {usage_info['cache_read_input_tokens']}）")
 
             return draft_md, usage_info
 
@@ -1028,33 +3600,76 @@ H1: #、H2: ##、H3: ###、H4: ####
             usage_log = {}
 
             # Step0: 設計
+            self._report_stage('design', "全体設計を生成中")
             design_md, usage0 = self.generate_design(keyword, h1_title, headings)
             if "ERROR:" in design_md:
                 return design_md
             usage_log['step0'] = usage0
-
-            # Step1: 初稿
-            draft_md, usage1 = self.generate_draft(keyword, h1_title, headings, design_md)
+            if self._aborted_error():
+                return self._aborted_error()
+
+            self._report_stage('draft', "初稿を生成中")
+            # Step1: 初稿（sectioned モードはH2ごとに並列生成し、失敗時は一括生成にフォールバック）
+            if self.draft_mode == 'sectioned':
+                draft_md, usage1 = self.generate_draft_sectioned(keyword, h1_title, headings, design_md)
+                if draft_md.startswith("ERROR:"):
+                    logger.warning(f"[WARNING] セクション並列生成に失敗。一括生成で再試行します: {draft_md}")
+                    draft_md, usage1 = self.generate_draft(keyword, h1_title, headings, design_md)
+            else:
+                draft_md, usage1 = self.generate_draft(keyword, h1_title, headings, design_md)
+            if self._aborted_error():
+                return self._aborted_error()
             if "ERROR:" in draft_md:
                 return draft_md
             usage_log['step1'] = usage1
 
+            # 機械的に直せるルール違反（働・太字・文字数カウント・見出し表記）はローカルで修正
+            draft_md = self._autofix_rules(draft_md, headings, "初稿")
+            rule_report = check_article_rules(draft_md, headings)
+
             # Step2: 監査
+            self._report_stage('audit', f"初稿を監査中（{rule_report['visible_chars']}字）")
             issues_json, usage2 = self.audit_draft(design_md, draft_md)
             if "ERROR:" in issues_json:
                 logger.warning(f"[WARNING] 監査に失敗。初稿をそのまま使用します: {issues_json}")
                 return draft_md
             usage_log['step2'] = usage2
 
-            # Step3: 修正
-            final_md, usage3 = self.refine_draft(draft_md, issues_json)
-            if "ERROR:" in final_md:
-                logger.warning(f"[WARNING] 修正に失敗。初稿をそのまま使用します: {final_md}")
-                return draft_md
-            usage_log['step3'] = usage3
-
-            # 文字数チェック（Google Docs保存時に約5%減る可能性があるため、余裕を持たせる）
-            char_count = len(final_md)
+            # ローカル検査で直せなかった違反（見出しの過不足・表/箇条書きの個数）だけを監査結果に加える
+            if rule_report['issues']:
+                logger.info(f"[ルール検査] 残存違反 {len(rule_report['issues'])}件を修正指示に追加します")
+            issues_json = merge_rule_issues(issues_json, rule_report['issues'])
+
+            # Step3: 修正（監査スコアが低ければスキップ、中程度なら軽量モデルで修正）
+            refine_plan = self._plan_refine(issues_json, rule_report['visible_chars'])
+            if refine_plan == 'skip':
+                logger.info(f"[Step3] 指摘がなく文字数も範囲内のため修正をスキップします（{rule_report['visible_chars']}字）")
+                REFINE_STATS.record('skip')
+                final_md = draft_md
+            else:
+                refine_model = REFINE_LIGHT_MODEL if refine_plan == 'light' else REFINE_MODEL
+                self._report_stage('refine', f"指摘に従って修正中（{refine_model}）")
+                refine_start = time.time()
+                if REFINE_MODE == 'patch':
+                    final_md, usage3 = self.refine_draft_patch(draft_md, issues_json, model=refine_model)
+                    if final_md.startswith("ERROR:") and not self._aborted_error():
+                        logger.warning(f"[WARNING] 編集操作による修正に失敗。全文の修正で再試行します: {final_md}")
+                        patch_usage = usage3
+                        final_md, usage3 = self.refine_draft(draft_md, issues_json, model=refine_model)
+                        usage3 = _merge_usage([patch_usage, usage3])
+                else:
+                    final_md, usage3 = self.refine_draft(draft_md, issues_json, model=refine_model)
+                if self._aborted_error():
+                    return self._aborted_error()
+                if "ERROR:" in final_md:
+                    logger.warning(f"[WARNING] 修正に失敗。初稿をそのまま使用します: {final_md}")
+                    return draft_md
+                REFINE_STATS.record(refine_plan, time.time() - refine_start)
+                usage_log['step3'] = usage3
+                final_md = self._autofix_rules(final_md, headings, "修正後")
+
+            # 文字数チェック（Googleドキュメント上で見える文字数。Markdown記法は数えない）
+            char_count = visible_char_count(final_md)
             target_min = 5000  # 目標5500字
             target_max = 6000
 
@@ -1067,9 +3682,16 @@ H1: #、H2: ##、H3: ###、H4: ####
                 append_attempt += 1
                 missing_chars = target_min - char_count
                 logger.warning(f"[WARNING] 文字数不足（-{missing_chars}字）。追記を実行します...（試行 {append_attempt}/{max_append_attempts}）")
-                final_md, usage4 = self.append_content_if_needed(final_md, issues_json, missing_chars)
+                self._report_stage('append', f"文字数不足（{char_count}字）のため追記中（{append_attempt}/{max_append_attempts}）")
+                if LENGTH_TOPUP_MODE == 'section':
+                    final_md, usage4 = self.top_up_thin_sections(final_md, issues_json, missing_chars)
+                else:
+                    final_md, usage4 = self.append_content_if_needed(final_md, issues_json, missing_chars)
+                if self._aborted_error():
+                    return self._aborted_error()
                 usage_log[f'step4_{append_attempt}'] = usage4
-                char_count = len(final_md)
+                final_md = self._autofix_rules(final_md, headings, "追記後")
+                char_count = visible_char_count(final_md)
                 logger.info(f"[追記後 {append_attempt}回目] 文字数: {char_count}字")
 
                 # 追記しても文字数が増えなかった場合は終了
@@ -1080,12 +3702,13 @@ H1: #、H2: ##、H3: ###、H4: ####
             if char_count < target_min:
                 logger.warning(f"[WARNING] {max_append_attempts}回追記しても目標文字数に達しませんでした（{char_count}字）")
 
-            # トークン使用量をログ出力
+            # トークン使用量をログ出力（キャッシュ: プロンプトキャッシュにヒットした入力トークン）
             total_tokens = sum([u.total_tokens for u in usage_log.values() if u])
-            logger.info(f"[トークン使用量] 合計: {total_tokens} tokens")
+            total_cached = sum([_cached_prompt_tokens(u) for u in usage_log.values() if u])
+            logger.info(f"[トークン使用量] 合計: {total_tokens} tokens（キャッシュ: {total_cached}）")
             for step, usage in usage_log.items():
                 if usage:
-                    logger.info(f"  {step}: {usage.total_tokens} tokens (入力: {usage.prompt_tokens}, 出力: {usage.completion_tokens})")
+                    logger.info(f"  {step}: {usage.total_tokens} tokens (入力: {usage.prompt_tokens}, うちキャッシュ: {_cached_prompt_tokens(usage)}, 出力: {usage.completion_tokens})")
 
             return final_md
 
@@ -1093,59 +3716,267 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"エラー: 記事の生成に失敗 - {e}")
             return f"ERROR: {str(e)}"
 
+    @timed_stage('incremental')
+    def generate_article_incremental(self, keyword, h1_title, headings, snapshot):
+        """見出しの変更差分だけを再生成（前回から変わっていないH2セクションは本文をそのまま流用）
+
+        H2とその配下のH3/H4が前回と完全一致するセクションを流用し、追加・変更されたセクションのみ
+        設計を共通コンテキストとして並列生成する。導入部はH1が変わった場合のみ再生成する。
+
+        監査・修正（Step2/3）は行わない代わりに、結合後の記事をローカルのルール検査と文字数（5,000〜6,000字）で
+        確かめる。文字数不足は薄いセクションへの加筆で1回だけ補い、それでも範囲外か違反が残る場合は None を返す。
+
+        Returns:
+            記事（Markdown）。差分再生成が適さない場合（キーワード変更・全セクション変更・変更なし）や
+            検査を通らなかった場合は None（呼び出し元で全体を再生成する）
+        """
+        if snapshot['keyword'] != keyword:
+            logger.info("[INCREMENTAL] キーワードが変わったため全体を再生成します")
+            return None
+
+        def signature(h2, sub_headings):
+            return (h2, tuple((sub['level'], sub['text']) for sub in sub_headings))
+
+        previous_sections = {}
+        for section in snapshot['sections']:
+            previous_sections.setdefault(signature(section['h2'], section['sub_headings']), []).append(section['content'])
+
+        h2_groups = self._group_headings_by_h2(headings)
+        reused = {}
+        for index, group in enumerate(h2_groups):
+            candidates = previous_sections.get(signature(group['h2'], group['sub_headings']))
+            if candidates:
+                reused[index] = candidates.pop(0)
+
+        h1_changed = snapshot['h1_title'] != h1_title
+        changed = [index for index in range(len(h2_groups)) if index not in reused]
+        if not reused:
+            logger.info("[INCREMENTAL] 流用できるセクションがないため全体を再生成します")
+            return None
+        if not changed and not h1_changed and len(h2_groups) == len(snapshot['sections']):
+            logger.info("[INCREMENTAL] 見出しに変更がないため全体を再生成します")
+            return None
+
+        logger.info(f"[INCREMENTAL] 差分再生成: {len(changed)}/{len(h2_groups)}セクション（H1変更: {h1_changed}）")
+        self._report_stage('incremental', f"変更された{len(changed)}セクションを再生成中")
+        start_time = time.time()
+
+        design_md, design_usage = self.generate_design(keyword, h1_title, headings)
+        if "ERROR:" in design_md:
+            return design_md
+
+        headings_md = self._format_headings_md(headings)
+        target_per_section = 4500 // len(h2_groups)
+
+        max_workers = max(1, min(len(changed) + 1, SECTION_DRAFT_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            intro_future = submit_with_usage_tags(executor, self._generate_intro, keyword, h1_title, headings_md, design_md) if h1_changed else None
+            section_futures = {
+                index: submit_with_usage_tags(
+                    executor,
+                    self._generate_h2_section,
+                    keyword, h2_groups[index]['h2'], h2_groups[index]['sub_headings'], target_per_section,
+                    index + 1, len(h2_groups),
+                    design_md=design_md, headings_md=headings_md, model=SECTION_DRAFT_MODEL
+                )
+                for index in changed
+            }
+            intro, intro_usage = intro_future.result() if intro_future else (snapshot['intro'], None)
+            generated = {index: future.result() for index, future in section_futures.items()}
+
+        if intro.startswith("ERROR:"):
+            return intro
+        for index, (content, usage) in generated.items():
+            if usage is None:
+                return f"ERROR: H2セクション「{h2_groups[index]['h2']}」の生成に失敗しました"
+
+        sections = [reused[index] if index in reused else generated[index][0].strip() for index in range(len(h2_groups))]
+        article = f"# {h1_title}\n\n{intro}\n\n" + "\n\n".join(sections)
+        article = self._autofix_rules(article, headings, "差分再生成")
+
+        # 文字数（Googleドキュメント上で見える文字数）の確認。不足なら薄いセクションに1回だけ加筆
+        topup_usage = None
+        char_count = visible_char_count(article)
+        if char_count < 5000:
+            logger.info(f"[INCREMENTAL] 文字数不足（{char_count}字）のため薄いセクションに加筆します")
+            article, topup_usage = self.top_up_thin_sections(article, '{}', 5000 - char_count)
+            if self._aborted_error():
+                return self._aborted_error()
+            article = self._autofix_rules(article, headings, "差分再生成の追記後")
+
+        rule_report = check_article_rules(article, headings)
+        if not 5000 <= rule_report['visible_chars'] <= 6000:
+            logger.warning(f"[INCREMENTAL] 文字数が範囲外（{rule_report['visible_chars']}字）のため全体を再生成します")
+            return None
+        if rule_report['issues']:
+            logger.warning(f"[INCREMENTAL] ルール違反が{len(rule_report['issues'])}件残るため全体を再生成します: "
+                           f"{[issue['issue'] for issue in rule_report['issues']]}")
+            return None
+
+        usage = _merge_usage([design_usage, intro_usage, topup_usage] + [u for _, u in generated.values()])
+        logger.info(f"[INCREMENTAL] 差分再生成完了（文字数: {rule_report['visible_chars']}字、tokens: {usage.total_tokens if usage else 0}、"
+                    f"所要時間: {time.time() - start_time:.1f}秒）")
+        return article
+
+    def _autofix_rules(self, article, headings, label):
+        """autofix_article_rules を適用し、修正内容をログに出す"""
+        article, fixes = autofix_article_rules(article, headings)
+        if fixes:
+            logger.info(f"[ルール検査] {label}をローカルで修正: {fixes}")
+        return article
+
+    @timed_stage('audit')
     def audit_draft(self, design_md, draft_md):
         """Step2: 監査（問題点をJSONで返す、本文は変更しない）"""
         try:
             logger.info(f"[Step2] 監査を実行中...")
 
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('audit'),
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": """本文は一切変更しない。問題点だけをJSONで返す。
 観点：見出し逸脱/漏れ、重複、矛盾、用語ゆれ、薄い（具体例/手順不足）
 
-出力(JSONのみ)：
-{
-  "offtrack":[{"location":"","issue":"","fix":""}],
-  "repetition":[{"location":"","issue":"","fix":""}],
-  "contradiction":[{"location":"","issue":"","fix":""}],
-  "term":[{"preferred":"","found":["",""],"locations":[""]}],
-  "thin":[{"h2":"","issue":"","fix":""}]
-}"""},
-                    {"role": "user", "content": f"""# 全体設計
-{design_md}
+出力(JSONのみ)：
+{
+  "offtrack":[{"location":"","issue":"","fix":""}],
+  "repetition":[{"location":"","issue":"","fix":""}],
+  "contradiction":[{"location":"","issue":"","fix":""}],
+  "term":[{"preferred":"","found":["",""],"locations":[""]}],
+  "thin":[{"h2":"","issue":"","fix":""}]
+}"""},
+                    {"role": "user", "content": f"""# 全体設計
+{design_md}
+
+本文：
+{draft_md}"""}
+                ],
+                max_completion_tokens=2000
+            )
+
+            issues_json = response.choices[0].message.content
+            usage = response.usage
+            logger.info(f"[Step2] 監査完了（tokens: {usage.total_tokens}）")
+
+            return issues_json, usage
+
+        except Exception as e:
+            logger.error(f"エラー: 監査に失敗 - {e}")
+            return f"ERROR: {str(e)}", None
+
+    def _plan_refine(self, issues_json, char_count):
+        """監査結果をスコア化し、Step3 の実行方式を決める
+
+        Returns:
+            'skip'（修正しない）/ 'light'（REFINE_LIGHT_MODEL で修正）/ 'full'（REFINE_MODEL で修正）
+        """
+        issues = parse_audit_issues(issues_json)
+        if issues is None:
+            logger.warning("[Step3] 監査結果のJSONを解析できないため通常の修正を行います")
+            return 'full'
+
+        score = score_audit_issues(issues)
+        in_range = 5000 <= char_count <= 6000
+        if score <= REFINE_SKIP_MAX_SCORE and in_range:
+            plan = 'skip'
+        elif score <= REFINE_LIGHT_MAX_SCORE:
+            plan = 'light'
+        else:
+            plan = 'full'
+        logger.info(f"[Step3] 監査スコア: {score}（文字数: {char_count}字） → {plan}")
+        return plan
+
+    @timed_stage('refine')
+    def refine_draft_patch(self, draft_md, issues_json, model=None):
+        """Step3（patch）: 指摘箇所の編集操作だけをJSONで出力させ、ローカルで記事に適用
+
+        出力トークンが記事の長さではなく指摘の数に比例するため、全文を再出力する refine_draft より速い。
+        見出し構成が変わる編集は適用しない。
+        """
+        try:
+            logger.info(f"[Step3] 編集操作による修正を実行中...")
+
+            response = chat_completion(
+                self.openai_client,
+                model=model or REFINE_MODEL,
+                messages=[
+                    # システムプロンプトは記事ごとの値を含めない（プロンプトキャッシュが効くよう先頭を固定する）
+                    {"role": "system", "content": """あなたはクライアント企業メディアの記事編集者です。
+指摘JSONに従って記事を修正するための「編集操作」だけをJSONで出力してください。記事全体は出力しないこと。
+
+# 編集操作
+1. replace_text（文・段落単位の置換。基本はこちらを使う）
+   {"op": "replace_text", "section": "対象のH2見出し（導入部なら「導入部」）", "find": "修正前の文（記事から一字一句そのまま抜き出す）", "replace": "修正後の文"}
+   - find は記事内で1箇所に特定できる長さにする（短すぎる断片は不可）
+2. replace_section（セクション全体の書き直し。指摘が広範囲に及ぶ場合のみ）
+   {"op": "replace_section", "section": "対象のH2見出し", "content": "H2見出し行を除くセクション本文全体"}
+   - content 内のH3/H4見出し（###, ####）は元の記事と一字一句同じ・同じ順序で残す
+
+# 修正ルール
+- 指摘された箇所のみを修正する
+- 見出し（#, ##, ###, ####）は追加・変更・削除しない。find / replace に見出し行を含めない
+- 「働」のみ平仮名（はたらく等）。履歴書・自己PR・面接・職場等は漢字のまま
+- 太字マークダウン（**）は使わない
+- です・ます調で統一
+- 記事全体が5,000〜6,000字の範囲に収まるようにする（超過していれば冗長な文を削る置換を含める）
+
+# 出力（JSONのみ）
+{"edits": [ ...編集操作... ]}
+修正不要なら {"edits": []}"""},
+                    {"role": "user", "content": f"""# 指摘JSON
+{issues_json}
 
-本文：
+# 現在の記事（{len(draft_md)}字）
 {draft_md}"""}
                 ],
-                max_completion_tokens=2000
+                response_format={"type": "json_object"},
+                max_completion_tokens=4000
             )
 
-            issues_json = response.choices[0].message.content
             usage = response.usage
-            logger.info(f"[Step2] 監査完了（tokens: {usage.total_tokens}）")
-
-            return issues_json, usage
+            try:
+                edits = json.loads(response.choices[0].message.content).get('edits', [])
+            except (json.JSONDecodeError, AttributeError) as e:
+                return f"ERROR: 編集操作のJSONを解析できません - {e}", usage
+            if not isinstance(edits, list):
+                return "ERROR: 編集操作の形式が不正です", usage
+
+            final_md, applied, failed = apply_refine_edits(draft_md, edits)
+            if final_md is None:
+                return "ERROR: 編集操作の適用で見出し構成が変わりました", usage
+            if applied == 0 and failed > 0:
+                # 指摘が1件も反映されないまま成功扱いにしない（呼び出し元で全文の修正に切り替える）
+                return f"ERROR: 編集操作を1件も適用できませんでした（{failed}件）", usage
+
+            logger.info(f"[Step3] 修正完了（編集操作: 適用{applied}件・不適用{failed}件、文字数: {len(final_md)}字、"
+                        f"tokens: {usage.total_tokens if usage else 0}）")
+            return final_md, usage
 
         except Exception as e:
-            logger.error(f"エラー: 監査に失敗 - {e}")
+            logger.error(f"エラー: 編集操作による修正に失敗 - {e}")
             return f"ERROR: {str(e)}", None
 
-    def refine_draft(self, draft_md, issues_json):
+    @timed_stage('refine')
+    def refine_draft(self, draft_md, issues_json, model=None):
         """Step3: 最小修正（JSON指摘箇所のみ修正）"""
         try:
             logger.info(f"[Step3] 最小修正を実行中...")
 
             current_chars = len(draft_md)
 
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4.1",
+            response = chat_completion(
+                self.openai_client,
+                on_text=self._stream_handler('refine'),
+                model=model or REFINE_MODEL,
                 messages=[
-                    {"role": "system", "content": f"""あなたはクライアント企業メディアの記事編集者です。指摘JSONに従って記事を修正してください。
+                    # システムプロンプトは記事ごとの値を含めない（プロンプトキャッシュが効くよう先頭を固定する）
+                    {"role": "system", "content": """あなたはクライアント企業メディアの記事編集者です。指摘JSONに従って記事を修正してください。
 
 # ★最重要ルール★ 文字数調整
 - 目標: 5,000〜6,000字の範囲内（絶対厳守）
-- 現在: {current_chars}字
+- 現在の文字数: 依頼文の「現在の記事」の見出しに記載
 - 調整方針:
   - 5,000字未満の場合 → 具体例や説明を追加して5,000字以上にする
   - 6,000字超過の場合 → 冗長な部分を削って6,000字以下にする
@@ -1193,6 +4024,81 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"エラー: 修正に失敗 - {e}")
             return f"ERROR: {str(e)}", None
 
+    def _expand_section(self, block, add_chars):
+        """1つのH2セクションに add_chars 字程度を加筆（見出しが変わった・増えなかった場合は元のまま）"""
+        try:
+            response = chat_completion(
+                self.openai_client,
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": """あなたはクライアント企業メディアの記事編集者です。
+与えられた1つのH2セクションに内容を加筆し、セクション全体を出力してください。
+
+# 加筆の方法
+- 具体例・数字・手順・注意点など、読者の役に立つ情報を足す
+- 既存の文章は削除・要約しない
+
+# 禁止事項（絶対厳守）
+- 見出し（##, ###, ####）の追加・変更・削除
+- 「働」の漢字（平仮名で「はたらく」等。共働き→共ばたらき）
+- 太字マークダウン（**）
+- 文字数カウント（例：「文字数：○○字」）やコメント・前置き"""},
+                    {"role": "user", "content": f"""以下のセクションに約{add_chars}字を加筆し、見出し行を含めたセクション全体を出力してください。
+
+{block.strip()}"""}
+                ],
+                max_completion_tokens=4000
+            )
+
+            expanded = response.choices[0].message.content.strip()
+            if _heading_lines(expanded) != _heading_lines(block) or len(expanded) <= len(block.strip()):
+                logger.warning("[Step4] 加筆結果の見出しが一致しない・文字数が増えていないため元のセクションを使用します")
+                return block, response.usage
+            return expanded + block[len(block.rstrip()):], response.usage
+
+        except Exception as e:
+            logger.error(f"エラー: セクションの加筆に失敗 - {e}")
+            return block, None
+
+    @timed_stage('append')
+    def top_up_thin_sections(self, final_md, issues_json, missing_chars):
+        """文字数追記（section モード）: 薄いH2セクションだけを並列に加筆して差し戻す
+
+        監査の thin に挙がったH2を優先し、残りはローカルで数えた文字数の少ない順に選ぶ（まとめは除く）。
+        """
+        try:
+            current_chars = visible_char_count(final_md)
+            chars_to_add = max(missing_chars, 5500 - current_chars)
+            blocks = _split_h2_blocks(final_md)
+
+            candidates = [i for i, (h2, _) in enumerate(blocks) if h2 and 'まとめ' not in h2]
+            if not candidates:
+                return final_md, None
+
+            issues = parse_audit_issues(issues_json) or {}
+            thin_h2s = {re.sub(r'\s', '', str(item.get('h2', ''))) for item in issues.get('thin') or [] if isinstance(item, dict)}
+            candidates.sort(key=lambda i: (re.sub(r'\s', '', blocks[i][0]) not in thin_h2s, visible_char_count(blocks[i][1])))
+
+            section_count = min(len(candidates), -(-chars_to_add // TOPUP_CHARS_PER_SECTION))
+            targets = candidates[:section_count]
+            add_per_section = -(-chars_to_add // section_count)
+            logger.info(f"[Step4] 文字数追記（セクション単位）: {', '.join(blocks[i][0] for i in targets)} に各{add_per_section}字")
+
+            with ThreadPoolExecutor(max_workers=max(1, min(section_count, SECTION_DRAFT_CONCURRENCY))) as executor:
+                futures = {i: submit_with_usage_tags(executor, self._expand_section, blocks[i][1], add_per_section) for i in targets}
+                expanded = {i: future.result() for i, future in futures.items()}
+
+            usage = _merge_usage([u for _, u in expanded.values()])
+            appended_md = '\n'.join(expanded[i][0] if i in expanded else text for i, (_, text) in enumerate(blocks))
+            logger.info(f"[Step4] 追記完了（文字数: {current_chars}字 → {len(appended_md)}字、tokens: {usage.total_tokens if usage else 0}）")
+
+            return appended_md, usage
+
+        except Exception as e:
+            logger.error(f"エラー: セクション単位の文字数追記に失敗 - {e}")
+            return final_md, None
+
+    @timed_stage('append')
     def append_content_if_needed(self, final_md, issues_json, missing_chars):
         """文字数追記（必要時のみ）"""
         try:
@@ -1213,7 +4119,9 @@ H1: #、H2: ##、H3: ###、H4: ####
             # 追記すべき文字数を計算（目標5500字）
             chars_to_add = max(missing_chars, 5500 - current_chars)
 
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                on_text=self._stream_handler('append'),
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": f"""あなたはクライアント企業メディアの記事編集者です。
@@ -1348,13 +4256,13 @@ H1: #、H2: ##、H3: ###、H4: ####
         query = f"name = '{folder_name}' and mimeType = 'application/vnd.google-apps.folder' and '{parent_folder_id}' in parents and trashed = false"
 
         try:
-            results = self.drive_service.files().list(
+            results = execute_google(self.drive_service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name)',
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True
-            ).execute()
+            ))
 
             files = results.get('files', [])
 
@@ -1371,11 +4279,11 @@ H1: #、H2: ##、H3: ###、H4: ####
                 'parents': [parent_folder_id]
             }
 
-            folder = self.drive_service.files().create(
+            folder = execute_google(self.drive_service.files().create(
                 body=file_metadata,
                 supportsAllDrives=True,
                 fields='id'
-            ).execute()
+            ))
 
             folder_id = folder.get('id')
             logger.info(f"✓ 月別フォルダ「{folder_name}」を作成: {folder_id}")
@@ -1390,9 +4298,9 @@ H1: #、H2: ##、H3: ###、H4: ####
         """スプレッドシート名から年月を抽出"""
         try:
             # スプレッドシートのメタデータを取得
-            spreadsheet = self.sheets_service.spreadsheets().get(
+            spreadsheet = execute_google(self.sheets_service.spreadsheets().get(
                 spreadsheetId=self.spreadsheet_id
-            ).execute()
+            ))
 
             spreadsheet_name = spreadsheet.get('properties', {}).get('title', '')
             logger.info(f"[DEBUG] スプレッドシート名: {spreadsheet_name}")
@@ -1416,8 +4324,13 @@ H1: #、H2: ##、H3: ###、H4: ####
             now = datetime.now()
             return now.year, now.month
 
+    @timed_stage('docs_save')
     def save_to_google_docs(self, article, title):
-        """Googleドキュメントに保存（見出しスタイル付き、表対応、月別フォルダ）"""
+        """Googleドキュメントに保存（見出しスタイル付き、表対応、月別フォルダ）
+
+        Returns:
+            (doc_url, document_id, 表データ, DocumentStructureIndex)。失敗時は (None, None, [], None)
+        """
         try:
             # 保存前の文字数をログ出力
             logger.info(f"[DEBUG] Google Docs保存前の文字数: {len(article)}字")
@@ -1436,35 +4349,33 @@ H1: #、H2: ##、H3: ###、H4: ####
 
             if not self.drive_service:
                 logger.error("Drive Serviceが初期化されていません")
-                return None
+                return None, None, [], None
 
             # ファイル作成（空のドキュメント）共有ドライブ対応
-            doc = self.drive_service.files().create(
+            doc = execute_google(self.drive_service.files().create(
                 body=file_metadata,
                 supportsAllDrives=True
-            ).execute()
+            ))
             document_id = doc.get('id')
 
             # 記事からMarkdownの表を抽出
             tables = self._extract_tables_from_article(article)
             logger.info(f"[DEBUG] 抽出された表の数: {len(tables)}")
 
-            # マークダウンを解析してGoogleドキュメントのリクエストに変換（表はプレースホルダー）
-            requests, table_count = self._convert_markdown_to_docs_requests(article)
+            # マークダウンを解析してGoogleドキュメントのリクエストに変換（本文・見出し・表を1回で書き込む）
+            requests, table_count, doc_index = self._convert_markdown_to_docs_requests(article)
 
-            # テキストを挿入
-            self.docs_service.documents().batchUpdate(
+            execute_google(self.docs_service.documents().batchUpdate(
                 documentId=document_id,
                 body={'requests': requests}
-            ).execute()
+            ))
 
-            # 表データを返す（画像挿入後にテーブルを挿入するため）
             doc_url = f"https://docs.google.com/document/d/{document_id}/edit"
-            return doc_url, document_id, tables
+            return doc_url, document_id, tables, doc_index
 
         except HttpError as err:
             logger.error(f"エラー: ドキュメントの作成に失敗 - {err}")
-            return None, None, []
+            return None, None, [], None
 
     def _parse_markdown_table(self, table_lines):
         """Markdownの表をパースして2次元配列で返す"""
@@ -1533,13 +4444,16 @@ H1: #、H2: ##、H3: ###、H4: ####
         return '<table>\n' + '\n'.join(html_rows) + '\n</table>'
 
     def _convert_markdown_to_docs_requests(self, article):
-        """マークダウンをGoogleドキュメントのリクエストに変換（表はプレースホルダー）"""
-        import re
+        """マークダウンをGoogleドキュメントのリクエストに変換
 
-        requests = []
-        current_index = 1
+        本文全体を1つの insertText で挿入し、見出しスタイルは事前に計算したオフセットの範囲指定で適用する。
+        Docs API のインデックスは UTF-16 のコード単位のため、オフセットは _utf16_len で数える。
+        DOCS_NATIVE_TABLES が有効な場合、表の位置には空の段落を置き、そこへの insertTable とセルへの
+        insertText を同じリクエスト列の末尾に後ろの表から順に追加する（_native_table_requests）。
 
-        # 記事を行ごとに処理
+        Returns:
+            (requests, 表の数, DocumentStructureIndex)
+        """
         lines = article.split('\n')
 
         # デバッグ：最初の20行をログ出力
@@ -1547,94 +4461,106 @@ H1: #、H2: ##、H3: ###、H4: ####
         for i, line in enumerate(lines[:20]):
             logger.info(f"[DEBUG] 行{i+1}: '{line[:100]}'" if len(line) > 100 else f"[DEBUG] 行{i+1}: '{line}'")
 
-        heading_count = 0
+        paragraphs = []  # 挿入するテキスト（段落ごと、末尾の改行を含む）
+        heading_ranges = []  # (開始インデックス, 終了インデックス, 見出しレベル)
+        native_tables = []  # (insertTable の位置, 表データ)
+        current_index = 1
         table_count = 0
         i = 0
 
         while i < len(lines):
             line = lines[i]
 
-            # 表の検出 - マークダウン形式でそのまま挿入
             if self._is_table_line(line):
-                # 表の開始
                 table_lines = []
                 while i < len(lines) and self._is_table_line(lines[i]):
                     table_lines.append(lines[i])
                     i += 1
-
-                # マークダウン形式の表をそのまま挿入
                 table_count += 1
-                table_text = '\n'.join(table_lines) + '\n\n'
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_index},
-                        'text': table_text
-                    }
-                })
-                current_index += len(table_text)
+
+                rows = self._parse_markdown_table(table_lines) if DOCS_NATIVE_TABLES else None
+                if rows:
+                    # insertTable は表の直前に改行を挿入し、表の後ろには置き場所の空段落が残るため、
+                    # 表の前後の空行はそれで代替する
+                    if paragraphs and paragraphs[-1] == '\n':
+                        paragraphs.pop()
+                        current_index -= 1
+                    native_tables.append((current_index, rows))
+                    paragraphs.append('\n')
+                    current_index += 1
+                    if i < len(lines) and not lines[i].strip():
+                        i += 1
+                    logger.info(f"[DEBUG] 表{table_count}をネイティブの表として挿入: {len(rows)}行")
+                    continue
+
+                # マークダウン形式でそのまま挿入（表の後に空行を1つ入れる）
+                text = '\n'.join(table_lines) + '\n\n'
+                paragraphs.append(text)
+                current_index += _utf16_len(text)
                 logger.info(f"[DEBUG] マークダウン表{table_count}を挿入: {len(table_lines)}行")
                 continue
 
             # 見出しを検出（スペースなしのパターンも対応）
             heading_match = re.match(r'^(#{1,4})\s*(.+)$', line.strip())
-
             if heading_match:
-                # 見出しレベルを取得
-                hashes = heading_match.group(1)
-                heading_text = heading_match.group(2).strip()
-                heading_level = len(hashes)
-                heading_count += 1
-
-                logger.info(f"[DEBUG] 見出し検出 H{heading_level}: '{heading_text}'")
-
-                # 見出しテキストを挿入
-                requests.append({
-                    'insertText': {
-                        'location': {'index': current_index},
-                        'text': heading_text + '\n'
-                    }
-                })
+                text = heading_match.group(2).strip()
+                heading_ranges.append((current_index, current_index + _utf16_len(text), len(heading_match.group(1))))
+            else:
+                text = line
+            paragraphs.append(text + '\n')
+            current_index += _utf16_len(text) + 1
+            i += 1
 
-                # 見出しスタイルを適用
-                named_style = f'HEADING_{heading_level}'
-                requests.append({
-                    'updateParagraphStyle': {
-                        'range': {
-                            'startIndex': current_index,
-                            'endIndex': current_index + len(heading_text)
-                        },
-                        'paragraphStyle': {
-                            'namedStyleType': named_style
-                        },
-                        'fields': 'namedStyleType'
-                    }
-                })
+        body_text = ''.join(paragraphs)
+        requests = [{
+            'insertText': {
+                'location': {'index': 1},
+                'text': body_text
+            }
+        }]
+        for start_index, end_index, level in heading_ranges:
+            requests.append({
+                'updateParagraphStyle': {
+                    'range': {'startIndex': start_index, 'endIndex': end_index},
+                    'paragraphStyle': {'namedStyleType': f'HEADING_{level}'},
+                    'fields': 'namedStyleType'
+                }
+            })
+        # 後ろの表から挿入すれば、前にある表の位置は本文挿入直後のインデックスのまま使える
+        for location, rows in reversed(native_tables):
+            requests.extend(self._native_table_requests(location, rows))
 
-                current_index += len(heading_text) + 1
-            else:
-                # 通常のテキスト
-                if line:
-                    requests.append({
-                        'insertText': {
-                            'location': {'index': current_index},
-                            'text': line + '\n'
-                        }
-                    })
-                    current_index += len(line) + 1
-                else:
-                    # 空行
+        logger.info(f"[DEBUG] マークダウン変換完了: 見出し総数={len(heading_ranges)}, 表数={table_count}, リクエスト数={len(requests)}")
+        return requests, table_count, DocumentStructureIndex.from_local(body_text, heading_ranges, native_tables)
+
+    @staticmethod
+    def _native_table_requests(location, rows):
+        """location（空段落の先頭）に表を作成し、各セルに文字を入れるリクエスト
+
+        insertTable は location に改行を挿入してから表を置くため、表の開始は location + 1。
+        空の表では行が 2 × 列数 + 1、セルが 2 のインデックスを占めるので、
+        セル (r, c) の段落の先頭は location + 4 + r × (2 × 列数 + 1) + 2 × c になる。
+        後ろのセルから挿入して、前のセルのインデックスをずらさないようにする。
+        """
+        num_cols = max(len(row) for row in rows)
+        requests = [{
+            'insertTable': {
+                'rows': len(rows),
+                'columns': num_cols,
+                'location': {'index': location}
+            }
+        }]
+        for r in range(len(rows) - 1, -1, -1):
+            for c in range(num_cols - 1, -1, -1):
+                text = rows[r][c] if c < len(rows[r]) else ''
+                if text:
                     requests.append({
                         'insertText': {
-                            'location': {'index': current_index},
-                            'text': '\n'
+                            'location': {'index': location + 4 + r * (2 * num_cols + 1) + 2 * c},
+                            'text': text
                         }
                     })
-                    current_index += 1
-
-            i += 1
-
-        logger.info(f"[DEBUG] マークダウン変換完了: 見出し総数={heading_count}, 表数={table_count}")
-        return requests, table_count
+        return requests
 
     def _extract_tables_from_article(self, article):
         """記事からMarkdownの表を抽出"""
@@ -1657,258 +4583,134 @@ H1: #、H2: ##、H3: ###、H4: ####
 
         return tables
 
-    def _insert_tables_into_doc(self, document_id, tables):
-        """ドキュメント内のプレースホルダーを実際の表に置換"""
-        if not tables:
-            return
-
-        # 表を逆順で処理（後ろから処理することでインデックスのずれを防ぐ）
-        for table_idx in range(len(tables), 0, -1):
-            placeholder = f"[[TABLE_PLACEHOLDER_{table_idx}]]"
-            table_data = tables[table_idx - 1]
-
-            if not table_data or len(table_data) == 0:
-                continue
-
-            # ドキュメントを取得してプレースホルダーの位置を特定
-            doc = self.docs_service.documents().get(documentId=document_id).execute()
-            content = doc.get('body', {}).get('content', [])
-
-            placeholder_index = None
-            placeholder_end_index = None
-
-            for element in content:
-                if 'paragraph' in element:
-                    paragraph = element['paragraph']
-                    for elem in paragraph.get('elements', []):
-                        if 'textRun' in elem:
-                            text = elem['textRun'].get('content', '')
-                            if placeholder in text:
-                                placeholder_index = elem.get('startIndex')
-                                placeholder_end_index = elem.get('endIndex')
-                                break
-                    if placeholder_index:
-                        break
-
-            if placeholder_index is None:
-                logger.warning(f"[WARNING] プレースホルダー {placeholder} が見つかりません")
-                continue
-
-            # 行数と列数
-            num_rows = len(table_data)
-            num_cols = max(len(row) for row in table_data) if table_data else 1
-
-            logger.info(f"[DEBUG] 表{table_idx}を挿入: {num_rows}行 x {num_cols}列, index={placeholder_index}")
-
-            # プレースホルダーを削除
-            requests = [{
-                'deleteContentRange': {
-                    'range': {
-                        'startIndex': placeholder_index,
-                        'endIndex': placeholder_end_index
-                    }
-                }
-            }]
-
-            self.docs_service.documents().batchUpdate(
-                documentId=document_id,
-                body={'requests': requests}
-            ).execute()
-
-            # 表を挿入
-            requests = [{
-                'insertTable': {
-                    'rows': num_rows,
-                    'columns': num_cols,
-                    'location': {'index': placeholder_index}
-                }
-            }]
-
-            self.docs_service.documents().batchUpdate(
-                documentId=document_id,
-                body={'requests': requests}
-            ).execute()
-
-            # 表のセルにテキストを挿入（ドキュメントを再取得してセルのインデックスを取得）
-            doc = self.docs_service.documents().get(documentId=document_id).execute()
-            content = doc.get('body', {}).get('content', [])
-
-            # 表を探す
-            table_element = None
-            for element in content:
-                if 'table' in element:
-                    start_idx = element.get('startIndex', 0)
-                    if start_idx >= placeholder_index - 5 and start_idx <= placeholder_index + 5:
-                        table_element = element['table']
-                        break
-
-            if not table_element:
-                logger.warning(f"[WARNING] 挿入した表が見つかりません")
-                continue
-
-            # 各セルにテキストを挿入（逆順で処理）
-            cell_requests = []
-            table_rows = table_element.get('tableRows', [])
-
-            for row_idx in range(len(table_rows) - 1, -1, -1):
-                row = table_rows[row_idx]
-                cells = row.get('tableCells', [])
-
-                for col_idx in range(len(cells) - 1, -1, -1):
-                    cell = cells[col_idx]
-                    cell_content = cell.get('content', [])
-
-                    if cell_content:
-                        # セルの最初の段落のインデックスを取得
-                        first_para = cell_content[0]
-                        if 'paragraph' in first_para:
-                            cell_start = first_para['paragraph']['elements'][0]['startIndex']
-
-                            # テーブルデータから対応するテキストを取得
-                            if row_idx < len(table_data) and col_idx < len(table_data[row_idx]):
-                                cell_text = table_data[row_idx][col_idx]
-                                if cell_text:
-                                    cell_requests.append({
-                                        'insertText': {
-                                            'location': {'index': cell_start},
-                                            'text': cell_text
-                                        }
-                                    })
-
-            if cell_requests:
-                self.docs_service.documents().batchUpdate(
-                    documentId=document_id,
-                    body={'requests': cell_requests}
-                ).execute()
-
-            logger.info(f"[DEBUG] 表{table_idx}の挿入完了")
-
+    @timed_stage('image_generate')
     def generate_image_with_vertex(self, h2_heading, keyword, max_retries=3):
         """Vertex AI Imagenで画像を生成（リトライ処理付き）"""
         # 日本語プロンプトを作成
-        prompt = f"{keyword}、{h2_heading}に関連する明るく親しみやすいイラスト"
+        prompt = image_prompt(h2_heading, keyword)
 
         logger.info(f"画像生成中: {prompt}")
 
-        # Vertex AIの初期化（認証情報を使用）
+        # Vertex AIの初期化（プロセスで1回のみ）
         if self.credentials:
-            aiplatform.init(
-                project=self.project_id,
-                location='us-central1',
-                credentials=self.credentials
-            )
+            GOOGLE_CLIENTS.ensure_vertex_initialized(self.project_id)
         else:
             logger.error("認証情報が設定されていません")
             return None
 
-        # Imagen 3を使用して画像を生成
-        from vertexai.preview.vision_models import ImageGenerationModel
-
-        model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
+        # Imagen 3を使用して画像を生成（モデルはプロセスで1回だけ読み込む）
+        model_name = IMAGEN_MODEL
+        model = IMAGE_SCHEDULER.model(model_name)
 
-        # リトライ処理（指数バックオフ）
-        for attempt in range(max_retries):
-            try:
-                images = model.generate_images(
+        # 429時の待機・同時実行数の調整は RATE_LIMITER（vertex_imagen）が行う
+        try:
+            start_time = time.time()
+            images = RATE_LIMITER.call(
+                'vertex_imagen',
+                lambda: model.generate_images(
                     prompt=prompt,
                     number_of_images=1,
-                )
-
-                # 画像が生成されたか確認
-                if images is None:
-                    logger.warning(f"[VERTEX] 画像が生成されませんでした（None応答）: {prompt}")
-                    return "ERROR: 画像が生成されませんでした（None応答）"
+                ),
+                max_retries=max_retries
+            )
 
-                # イテレートして画像を取得
-                image_list = list(images)
-                if not image_list:
-                    logger.warning(f"[VERTEX] 画像が生成されませんでした（空のリスト）: {prompt}")
-                    return "ERROR: 画像が生成されませんでした（コンテンツポリシー等）"
+            # 画像が生成されたか確認
+            if images is None:
+                logger.warning(f"[VERTEX] 画像が生成されませんでした（None応答）: {prompt}")
+                return "ERROR: 画像が生成されませんでした（None応答）"
 
-                # 最初の画像を取得
-                image = image_list[0]
+            # イテレートして画像を取得
+            image_list = list(images)
+            if not image_list:
+                logger.warning(f"[VERTEX] 画像が生成されませんでした（空のリスト）: {prompt}")
+                return "ERROR: 画像が生成されませんでした（コンテンツポリシー等）"
+            with usage_scope(step='image'):
+                USAGE_LEDGER.record('vertex_imagen', model_name, images=len(image_list), latency=time.time() - start_time)
 
-                # 画像データをバイト形式で取得
-                image_bytes = image._image_bytes
+            # 最初の画像を取得
+            image = image_list[0]
 
-                logger.info(f"✓ 画像生成完了: {len(image_bytes)} bytes")
-                return image_bytes
+            # 画像データをバイト形式で取得
+            image_bytes = image._image_bytes
 
-            except IndexError as e:
-                logger.warning(f"[VERTEX] 画像リストが空でした: {e}")
-                return "ERROR: 画像が生成されませんでした（IndexError）"
-            except Exception as e:
-                error_str = str(e)
+            logger.info(f"✓ 画像生成完了: {len(image_bytes)} bytes")
+            return image_bytes
 
-                # クォータエラー（429）の検出
-                if '429' in error_str or 'quota' in error_str.lower() or 'resource exhausted' in error_str.lower():
-                    if attempt < max_retries - 1:
-                        # 指数バックオフ: 30秒、60秒、120秒
-                        wait_time = 30 * (2 ** attempt)
-                        logger.warning(f"[QUOTA] クォータ制限検出。{wait_time}秒待機後にリトライ ({attempt + 1}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        logger.error(f"[QUOTA] クォータ制限: {max_retries}回リトライ後も失敗。この画像をスキップします")
-                        return "ERROR:QUOTA_EXCEEDED"
+        except IndexError as e:
+            logger.warning(f"[VERTEX] 画像リストが空でした: {e}")
+            return "ERROR: 画像が生成されませんでした（IndexError）"
+        except Exception as e:
+            # クォータエラー（429）がリトライ後も解消しない場合
+            if _is_rate_limit_error(e):
+                logger.error(f"[QUOTA] クォータ制限: {max_retries}回リトライ後も失敗。この画像をスキップします")
+                return "ERROR:QUOTA_EXCEEDED"
 
-                # その他のエラー
-                logger.error(f"エラー: 画像の生成に失敗しました - {e}")
-                return f"ERROR: {error_str}"
+            # その他のエラー
+            logger.error(f"エラー: 画像の生成に失敗しました - {e}")
+            return f"ERROR: {str(e)}"
 
-        return "ERROR: リトライ上限到達"
+    @timed_stage('image_upload')
+    def upload_image_to_drive(self, image_bytes, filename, max_retries=3, image_key=None):
+        """生成した画像をGoogle Driveにアップロード（リトライ処理付き）
 
-    def upload_image_to_drive(self, image_bytes, filename, max_retries=3):
-        """生成した画像をGoogle Driveにアップロード（リトライ処理付き）"""
+        image_key（generated_image_key）を渡すとファイルIDを GENERATED_IMAGES に記録する。
+        """
         if not self.image_folder_id:
             logger.error("画像フォルダーIDが設定されていません")
             return None
 
-        # 画像をPNG形式に変換
-        from io import BytesIO
-        image = Image.open(BytesIO(image_bytes))
-
-        # PNG形式で保存
-        output = BytesIO()
-        image.save(output, format='PNG')
+        # 保存形式への変換・縮小（必要な場合のみ）
+        data, mimetype, extension = prepare_upload_image(image_bytes)
+        output = BytesIO(data)
 
         # Google Driveにアップロード
         file_metadata = {
-            'name': f"{filename}.png",
+            'name': f"{filename}.{extension}",
             'parents': [self.image_folder_id],
-            'mimeType': 'image/png'
+            'mimeType': mimetype
         }
 
         from googleapiclient.http import MediaIoBaseUpload
 
+        # 小さい画像はマルチパート（1リクエスト）でアップロード
+        resumable = len(data) > UPLOAD_MULTIPART_MAX_BYTES
+        inherits_sharing = self._folder_shared_with_domain(self.image_folder_id)
+
         # リトライ処理
+        uploaded_file = None
         for attempt in range(max_retries):
             try:
-                output.seek(0)  # リトライ時にストリームを先頭に戻す
-                media = MediaIoBaseUpload(output, mimetype='image/png', resumable=True)
-
-                uploaded_file = self.drive_service.files().create(
-                    body=file_metadata,
-                    media_body=media,
-                    fields='id, webViewLink, webContentLink',
-                    supportsAllDrives=True
-                ).execute()
+                if uploaded_file is None:
+                    output.seek(0)  # リトライ時にストリームを先頭に戻す
+                    media = MediaIoBaseUpload(output, mimetype=mimetype, resumable=resumable)
+
+                    # メディアの再送はこのループで行うため、execute_google 側ではリトライしない
+                    uploaded_file = execute_google(self.drive_service.files().create(
+                        body=file_metadata,
+                        media_body=media,
+                        fields='id, webViewLink, webContentLink',
+                        supportsAllDrives=True
+                    ), max_retries=0)
 
                 file_id = uploaded_file.get('id')
 
                 # 組織内共有設定 - 親フォルダから継承されている場合はスキップ
-                try:
-                    self.drive_service.permissions().create(
-                        fileId=file_id,
-                        body={'type': 'domain', 'domain': 'vexum-ai.com', 'role': 'reader'},
-                        supportsAllDrives=True
-                    ).execute()
-                except Exception as perm_error:
-                    # 親フォルダから権限が継承されている場合はエラーになるが、問題ない
-                    logger.warning(f"権限設定をスキップ（親フォルダから継承）: {perm_error}")
+                if not inherits_sharing:
+                    try:
+                        execute_google(self.drive_service.permissions().create(
+                            fileId=file_id,
+                            body={'type': 'domain', 'domain': 'vexum-ai.com', 'role': 'reader'},
+                            supportsAllDrives=True
+                        ))
+                    except Exception as perm_error:
+                        # 親フォルダから権限が継承されている場合はエラーになるが、問題ない
+                        logger.warning(f"権限設定をスキップ（親フォルダから継承）: {perm_error}")
+
+                if image_key:
+                    GENERATED_IMAGES.put(image_key, file_id)
 
                 # 直接アクセス可能なURLを生成
-                image_url = f"https://drive.google.com/uc?export=view&id={file_id}"
+                image_url = drive_image_url(file_id)
 
                 logger.info(f"✓ 画像アップロード完了: {image_url}")
                 return image_url
@@ -1916,53 +4718,113 @@ H1: #、H2: ##、H3: ###、H4: ####
             except Exception as e:
                 error_str = str(e)
                 if attempt < max_retries - 1:
-                    # 500エラーやタイムアウトの場合はリトライ
+                    # 429（待機は RATE_LIMITER のクールダウン）・500エラー・タイムアウトの場合はリトライ
+                    if _is_rate_limit_error(e):
+                        logger.warning(f"[RETRY] アップロードがレート制限されました。リトライ ({attempt + 1}/{max_retries})")
+                        continue
                     if '500' in error_str or '503' in error_str or 'timeout' in error_str.lower():
                         wait_time = 10 * (attempt + 1)  # 10秒、20秒、30秒
                         logger.warning(f"[RETRY] アップロード失敗。{wait_time}秒待機後にリトライ ({attempt + 1}/{max_retries}): {e}")
                         time.sleep(wait_time)
+                        # 作成済みの可能性があるため、同名ファイルがあれば再送せずにそれを使う
+                        uploaded_file = self._find_uploaded_file(file_metadata['name'])
                         continue
                 logger.error(f"エラー: 画像のアップロードに失敗しました - {e}")
                 return None
 
         return None
 
+    def _find_uploaded_file(self, name):
+        """画像フォルダー内の同名ファイル（アップロードが反映済みか確認するため）。なければ None"""
+        escaped = name.replace('\\', '\\\\').replace("'", "\\'")
+        try:
+            files = execute_google(self.drive_service.files().list(
+                q=f"name = '{escaped}' and '{self.image_folder_id}' in parents and trashed = false",
+                fields='files(id)',
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True
+            )).get('files', [])
+        except Exception as e:
+            logger.warning(f"アップロード済みファイルの確認に失敗: {e}")
+            return None
+        if files:
+            logger.info(f"[RETRY] 同名ファイルが作成済みのため再送しません: {name}")
+            return files[0]
+        return None
+
+    def _folder_shared_with_domain(self, folder_id):
+        """フォルダーに組織内共有（または「リンクを知っている全員」）が設定済みか（プロセスで1回だけ確認）
+
+        設定済みなら中のファイルに継承されるため、アップロードした画像ごとの権限追加を省略できる。
+        確認できなかった場合は False（従来どおり権限を追加する）。
+        """
+        with _FOLDER_SHARING_LOCK:
+            if folder_id in _FOLDER_SHARING:
+                return _FOLDER_SHARING[folder_id]
+        try:
+            response = execute_google(self.drive_service.permissions().list(
+                fileId=folder_id,
+                supportsAllDrives=True,
+                fields='permissions(type, role, domain)'
+            ))
+            shared = any(
+                p.get('type') == 'anyone' or (p.get('type') == 'domain' and p.get('domain') == 'vexum-ai.com')
+                for p in response.get('permissions', [])
+            )
+        except Exception as e:
+            logger.warning(f"フォルダーの共有設定を確認できませんでした（画像ごとに権限を設定します）: {e}")
+            return False
+        logger.info(f"画像フォルダーの共有設定: {'継承あり' if shared else '継承なし'}")
+        with _FOLDER_SHARING_LOCK:
+            _FOLDER_SHARING[folder_id] = shared
+        return shared
+
+    def generated_image_key(self, h2_heading, keyword):
+        """生成画像の記録（GENERATED_IMAGES）のキー"""
+        return GeneratedImageStore.key(image_prompt(h2_heading, keyword), IMAGEN_MODEL, self.image_folder_id)
+
+    def find_generated_images(self, h2_texts, keyword):
+        """同じプロンプトで生成済みの画像 {h2_text: 画像URL}（Drive 上にあるものだけ）"""
+        keys = {h2_text: self.generated_image_key(h2_text, keyword) for h2_text in h2_texts}
+        try:
+            found = GENERATED_IMAGES.lookup(self.drive_service, keys.values())
+        except Exception as e:
+            logger.error(f"[IMAGE_STORE] 生成画像の検索に失敗: {e}")
+            return {}
+        images = {h2_text: drive_image_url(found[key]) for h2_text, key in keys.items() if key in found}
+        if images:
+            logger.info(f"[IMAGE_STORE] 生成済みの画像を{len(images)}枚再利用します")
+        return images
+
+    @timed_stage('status_update')
     def update_sheet_status(self, sheet_name, status="処理済み", doc_url=""):
-        """ステータスを更新（リトライ機能付き）"""
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                range_name = f"'{sheet_name}'!F2:G2"
-                values = [[status, doc_url]]
-                
-                logger.info(f"[UPDATE_STATUS] シート名: {sheet_name} (試行 {attempt+1}/{max_retries})")
-                logger.info(f"[UPDATE_STATUS] 範囲: {range_name}")
-                logger.info(f"[UPDATE_STATUS] ステータス: {status}")
-                logger.info(f"[UPDATE_STATUS] URL: {doc_url}")
-
-                result = self.sheets_service.spreadsheets().values().update(
-                    spreadsheetId=self.spreadsheet_id,
-                    range=range_name,
-                    valueInputOption='RAW',
-                    body={'values': values}
-                ).execute()
-                
-                logger.info(f"[UPDATE_STATUS] ✓ 更新成功: {result.get('updatedCells', 0)}セル更新")
-                return  # 成功したら終了
+        """ステータスを更新（429・一時エラーのリトライは execute_google が行う）"""
+        try:
+            range_name = f"'{sheet_name}'!F2:G2"
+            values = [[status, doc_url]]
 
-            except HttpError as err:
-                logger.error(f"[UPDATE_STATUS] ✗ エラー (試行 {attempt+1}): {err}")
-                if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)  # 指数バックオフ (1s, 2s, 4s...)
-                else:
-                    logger.error(f"[UPDATE_STATUS] 全てのリトライに失敗しました")
-            except Exception as e:
-                logger.error(f"[UPDATE_STATUS] ✗ 予期しないエラー: {e}")
-                import traceback
-                logger.error(f"[UPDATE_STATUS] トレースバック: {traceback.format_exc()}")
-                break  # 予期しないエラーはリトライしない
+            logger.info(f"[UPDATE_STATUS] シート名: {sheet_name}")
+            logger.info(f"[UPDATE_STATUS] 範囲: {range_name}")
+            logger.info(f"[UPDATE_STATUS] ステータス: {status}")
+            logger.info(f"[UPDATE_STATUS] URL: {doc_url}")
+
+            result = execute_google(self.sheets_service.spreadsheets().values().update(
+                spreadsheetId=self.spreadsheet_id,
+                range=range_name,
+                valueInputOption='RAW',
+                body={'values': values}
+            ))
+
+            logger.info(f"[UPDATE_STATUS] ✓ 更新成功: {result.get('updatedCells', 0)}セル更新")
 
+        except HttpError as err:
+            logger.error(f"[UPDATE_STATUS] ✗ 全てのリトライに失敗しました: {err}")
+        except Exception as e:
+            logger.error(f"[UPDATE_STATUS] ✗ 予期しないエラー: {e}")
+            import traceback
+            logger.error(f"[UPDATE_STATUS] トレースバック: {traceback.format_exc()}")
+
+    @timed_stage('master_update')
     def update_master_sheet_article_url(self, master_spreadsheet_id, keyword, doc_url, keyword_column='G', url_column='N'):
         """マスターシートに初稿URLを書き込む
 
@@ -1979,10 +4841,10 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.info(f"[MASTER_UPDATE] URL: {doc_url}")
 
             # マスターシートのキーワード列を取得
-            result = self.sheets_service.spreadsheets().values().get(
+            result = execute_google(self.sheets_service.spreadsheets().values().get(
                 spreadsheetId=master_spreadsheet_id,
                 range=f'{keyword_column}:{keyword_column}'
-            ).execute()
+            ))
 
             values = result.get('values', [])
 
@@ -2004,12 +4866,12 @@ H1: #、H2: ##、H3: ###、H4: ####
                 return False
 
             # URLを書き込む
-            self.sheets_service.spreadsheets().values().update(
+            execute_google(self.sheets_service.spreadsheets().values().update(
                 spreadsheetId=master_spreadsheet_id,
                 range=f'{url_column}{row_num}',
                 valueInputOption='RAW',
                 body={'values': [[doc_url]]}
-            ).execute()
+            ))
 
             logger.info(f"[MASTER_UPDATE] ✓ マスターシート {url_column}{row_num} にURL書き込み完了")
             return True
@@ -2018,8 +4880,9 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"[MASTER_UPDATE] エラー: {e}")
             return False
 
+    @timed_stage('image_folders')
     def get_image_folders(self):
-        """画像フォルダー内のサブフォルダーとその中の画像を取得"""
+        """画像フォルダー内のサブフォルダーとその中の画像を取得（IMAGE_FOLDER_CATALOG を使用）"""
         if not self.image_folder_id:
             logger.info("画像フォルダーIDが設定されていません")
             return {}
@@ -2029,49 +4892,11 @@ H1: #、H2: ##、H3: ###、H4: ####
             return self.image_cache
 
         try:
-            # サブフォルダーを取得（共有ドライブ対応）
-            query = f"'{self.image_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-
-            logger.info(f"[DEBUG] 画像フォルダーID: {self.image_folder_id}")
-            logger.info(f"[DEBUG] クエリ: {query}")
-
-            response = self.drive_service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)',
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True,
-                corpora='allDrives'  # 共有ドライブも検索対象に含める
-            ).execute()
-
-            subfolders = response.get('files', [])
-            logger.info(f"サブフォルダー数: {len(subfolders)}")
-
-            if subfolders:
-                logger.info(f"[DEBUG] 検出されたサブフォルダー: {[f['name'] for f in subfolders]}")
-
-            # 各サブフォルダー内の画像を取得
-            folder_images = {}
-            for folder in subfolders:
-                folder_name = folder['name']
-                folder_id = folder['id']
-
-                # サブフォルダー内の画像を取得（共有ドライブ対応）
-                image_query = f"'{folder_id}' in parents and (mimeType contains 'image/') and trashed=false"
-                image_response = self.drive_service.files().list(
-                    q=image_query,
-                    spaces='drive',
-                    fields='files(id, name, webContentLink)',
-                    supportsAllDrives=True,
-                    includeItemsFromAllDrives=True,
-                    corpora='allDrives'  # 共有ドライブも検索対象に含める
-                ).execute()
-
-                images = image_response.get('files', [])
-                if images:
-                    folder_images[folder_name] = images
-                    logger.info(f"フォルダー '{folder_name}': {len(images)}枚の画像")
-
+            # プロセス共通の一覧（一定時間内・変更がなければ Drive の一覧取得を行わない）
+            folder_images = IMAGE_FOLDER_CATALOG.get(self.drive_service, self.image_folder_id)
+            logger.info(f"サブフォルダー数（画像あり）: {len(folder_images)}")
+            get_folder_matcher(folder_images.keys())
+            # 並列実行中の記事から同時に代入されても、いずれも同じ一覧なので結果は変わらない
             self.image_cache = folder_images
             return folder_images
 
@@ -2079,51 +4904,149 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"エラー: 画像フォルダーの取得に失敗 - {err}")
             return {}
 
-    def match_heading_to_folder(self, h2_text, folder_names):
-        """H2見出しに最適なフォルダーをAIで選択"""
+    @timed_stage('image_permissions')
+    def ensure_images_shared(self, image_ids):
+        """画像フォルダーの画像を組織内共有に設定
+
+        共有設定済みと記録されている画像（IMAGE_FOLDER_CATALOG）は確認しない。
+        残りは権限の確認・追加をそれぞれ1回のバッチリクエストで行う。
+        """
+        image_ids = list(image_ids)
+        known = IMAGE_FOLDER_CATALOG.shared_file_ids(image_ids)
+        pending = [image_id for image_id in image_ids if image_id not in known]
+        if not pending:
+            logger.info(f"[DEBUG] 画像{len(image_ids)}枚はすべて共有設定済み（記録済み）")
+            return
+
+        try:
+            # 既存の権限を確認（「リンクを知っている全員」または組織内共有の権限があれば追加しない）
+            listed = execute_google_batch(self.drive_service, {
+                image_id: self.drive_service.permissions().list(
+                    fileId=image_id,
+                    supportsAllDrives=True,
+                    fields='permissions(id, type, role, domain)'
+                )
+                for image_id in pending
+            })
+            shared = []
+            to_create = []
+            for image_id in pending:
+                response, error = listed.get(image_id, (None, None))
+                if error is not None or response is None:
+                    # 確認できなかった画像は共有なしとみなさない（権限は追加せず、次回改めて確認する）
+                    logger.error(f"権限確認エラー: {image_id} - {error}")
+                elif any(p.get('type') == 'anyone' or (p.get('type') == 'domain' and p.get('domain') == 'vexum-ai.com')
+                         for p in response.get('permissions', [])):
+                    shared.append(image_id)
+                else:
+                    to_create.append(image_id)
+
+            # なければ追加（組織内のみに制限）
+            if to_create:
+                created = execute_google_batch(self.drive_service, {
+                    image_id: self.drive_service.permissions().create(
+                        fileId=image_id,
+                        supportsAllDrives=True,
+                        body={
+                            'type': 'domain',
+                            'domain': 'vexum-ai.com',
+                            'role': 'reader'
+                        }
+                    )
+                    for image_id in to_create
+                })
+                for image_id in to_create:
+                    _, error = created.get(image_id, (None, None))
+                    if error is not None:
+                        logger.error(f"権限設定エラー: {image_id} - {error}")
+                    else:
+                        shared.append(image_id)
+                        logger.info(f"[DEBUG] 画像を組織内共有に設定: {image_id}")
+
+            IMAGE_FOLDER_CATALOG.mark_shared(shared)
+
+        except Exception as e:
+            logger.error(f"権限設定エラー: {e}")
+
+    @timed_stage('image_match')
+    def match_headings_to_folders(self, h2_texts, folder_names):
+        """記事のH2見出しすべてについて最適なフォルダーをまとめて選択
+
+        文字n-gramの類似度で選び、FOLDER_MATCH_MIN_SCORE 未満の見出しだけを1回のLLM呼び出しで判定する。
+
+        Returns:
+            {h2_text: フォルダー名 or None}
+        """
         if not folder_names:
-            return None
+            return {}
 
+        matcher = get_folder_matcher(folder_names)
+        matches = {}
+        pending = []
+        for h2_text in dict.fromkeys(h2_texts):
+            if h2_text in matcher.memo:
+                matches[h2_text] = matcher.memo[h2_text]
+                continue
+            folder_name, score = matcher.best(h2_text)
+            if score >= FOLDER_MATCH_MIN_SCORE:
+                logger.info(f"H2 '{h2_text}' → フォルダー '{folder_name}'（類似度: {score:.2f}）")
+                matches[h2_text] = matcher.memo[h2_text] = folder_name
+            else:
+                pending.append(h2_text)
+
+        if pending and FOLDER_MATCH_LLM_FALLBACK:
+            llm_matches = self._match_folders_with_llm(pending, folder_names)
+            if llm_matches is not None:
+                for h2_text in pending:
+                    folder_name = llm_matches.get(h2_text)
+                    matches[h2_text] = matcher.memo[h2_text] = folder_name if folder_name in folder_names else None
+                    logger.info(f"H2 '{h2_text}' → フォルダー '{matches[h2_text]}'（LLM）")
+                return matches
+        for h2_text in pending:
+            matches[h2_text] = None
+        return matches
+
+    def _match_folders_with_llm(self, h2_texts, folder_names):
+        """類似度で決められなかった見出しのフォルダーを1回のLLM呼び出しで選択。失敗時は None"""
         try:
+            heading_list = '\n'.join([f"- {text}" for text in h2_texts])
             folder_list = '\n'.join([f"- {name}" for name in folder_names])
             prompt = f"""# フォルダーマッチングタスク
 
-以下のH2見出しに最も関連性の高いフォルダー名を1つだけ選んでください。
+以下の各H2見出しについて、最も関連性の高いフォルダー名を1つずつ選んでください。
 
 ## H2見出し
-{h2_text}
+{heading_list}
 
 ## 利用可能なフォルダー
 {folder_list}
 
 ## 出力ルール
-- フォルダー名のみを回答してください
-- フォルダーが見つからない場合は「なし」と回答してください
-- 説明や理由は不要です"""
+- {{"見出し": "フォルダー名"}} の形式のJSONのみを出力してください
+- 見出しは上記の文字列をそのまま使ってください
+- 該当するフォルダーがない場合は "なし" としてください"""
 
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                usage_step='folder_match',
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": "あなたは記事の見出しとフォルダー名をマッチングする専門家です。"},
                     {"role": "user", "content": prompt}
                 ],
-                max_completion_tokens=50
+                response_format={"type": "json_object"},
+                max_completion_tokens=50 + 40 * len(h2_texts)
             )
-
-            selected_folder = response.choices[0].message.content.strip()
-            logger.info(f"H2 '{h2_text}' → フォルダー '{selected_folder}'")
-
-            if selected_folder == "なし" or selected_folder not in folder_names:
-                return None
-
-            return selected_folder
+            result = json.loads(response.choices[0].message.content)
+            return result if isinstance(result, dict) else None
 
         except Exception as e:
             logger.error(f"エラー: フォルダーマッチングに失敗 - {e}")
             return None
 
-    def insert_images_into_doc(self, document_id, h2_headings):
-        """H2見出しの後に画像を挿入"""
+    @timed_stage('images')
+    def insert_images_into_doc(self, document_id, h2_headings, doc_index=None):
+        """H2見出しの後に画像を挿入（doc_index は save_to_google_docs が返す DocumentStructureIndex）"""
         logger.info(f"[DEBUG] 画像挿入開始 - document_id: {document_id}")
 
         if not self.image_folder_id:
@@ -2140,68 +5063,12 @@ H1: #、H2: ##、H3: ###、H4: ####
         logger.info(f"利用可能なフォルダー: {folder_names}")
 
         try:
-            # ドキュメントの内容を取得
-            logger.info(f"[DEBUG] ドキュメント内容を取得中...")
-            doc = self.docs_service.documents().get(documentId=document_id).execute()
-            content = doc.get('body').get('content')
-            logger.info(f"[DEBUG] ドキュメント要素数: {len(content)}")
-
-            # H2見出しを検索（Googleドキュメントの見出しスタイル or マークダウン形式に対応）
-            # スペースなしでもマッチするように修正
-            h2_pattern = re.compile(r'^\s*##\s*(.+?)\s*$')
-
-            # まず全てのH2見出しを検出
-            h2_elements = []
-            paragraph_count = 0
-            for element in content:
-                if 'paragraph' in element:
-                    paragraph_count += 1
-                    paragraph = element['paragraph']
-
-                    # パラグラフのテキストを取得
-                    para_text = ''
-                    for text_element in paragraph.get('elements', []):
-                        if 'textRun' in text_element:
-                            para_text += text_element['textRun']['content']
-
-                    para_text_stripped = para_text.strip()
-
-                    # 見出しスタイルをチェック（HEADING_2）
-                    paragraph_style = paragraph.get('paragraphStyle', {})
-                    named_style = paragraph_style.get('namedStyleType', '')
-
-                    if named_style == 'HEADING_2':
-                        # Googleドキュメントの見出しスタイル
-                        h2_text = para_text_stripped
-                        h2_elements.append({
-                            'text': h2_text,
-                            'element': element,
-                            'end_index': element['endIndex']
-                        })
-                        logger.info(f"[DEBUG] H2見出しスタイル検出: '{h2_text}' (end_index: {element['endIndex']})")
-                    else:
-                        # マークダウン形式もサポート（後方互換性）
-                        if para_text_stripped.startswith('##'):
-                            logger.info(f"[DEBUG] マークダウン形式のH2検出: '{para_text_stripped[:100]}'")
-
-                        match = h2_pattern.match(para_text_stripped)
-                        if match:
-                            h2_text = match.group(1).strip()
-                            h2_elements.append({
-                                'text': h2_text,
-                                'element': element,
-                                'end_index': element['endIndex']
-                            })
-                            logger.info(f"[DEBUG] マークダウンH2マッチ成功: '{h2_text}' (end_index: {element['endIndex']})")
-                        elif para_text_stripped.startswith('##'):
-                            logger.warning(f"[DEBUG] ## で始まるがマッチせず: '{para_text_stripped[:100]}'")
-
-            logger.info(f"[DEBUG] パラグラフ総数: {paragraph_count}")
-            logger.info(f"[DEBUG] 検出されたH2見出し数: {len(h2_elements)}")
+            # H2見出しの位置（保存時のインデックスがなければ必要なフィールドだけを1回取得）
+            if doc_index is None:
+                doc_index = DocumentStructureIndex.fetch(self.docs_service, document_id)
+            h2_elements = doc_index.h2_elements()
 
-            # 検出された全H2を出力
-            for idx, h2 in enumerate(h2_elements):
-                logger.info(f"[DEBUG] H2 [{idx+1}]: '{h2['text']}' (end_index: {h2['end_index']})")
+            logger.info(f"[DEBUG] 検出されたH2見出し数: {len(h2_elements)}")
 
             # 使用済み画像IDを記録
             used_image_ids = set()
@@ -2214,6 +5081,15 @@ H1: #、H2: ##、H3: ###、H4: ####
             if len(h2_elements) > 0:
                 logger.info(f"[DEBUG] 最後のH2（スキップ予定）: '{h2_elements[-1]['text']}'")
 
+            # 全H2のフォルダーをまとめて選択（失敗時は各H2でランダム選択）
+            try:
+                folder_matches = self.match_headings_to_folders(
+                    [h2['text'] for h2 in h2_to_process if 'まとめ' not in h2['text']], folder_names
+                )
+            except Exception as e:
+                logger.error(f"フォルダーマッチング中にエラー発生 - {e}")
+                folder_matches = {}
+
             for i, h2_info in enumerate(h2_to_process):
                 h2_text = h2_info['text']
                 end_index = h2_info['end_index']
@@ -2225,20 +5101,10 @@ H1: #、H2: ##、H3: ###、H4: ####
                     logger.warning(f"[SKIP] H2 '{h2_text}': 「まとめ」を含むためスキップ")
                     continue
 
-                # H2見出しに対応するフォルダーを選択（AIマッチング、失敗時はランダム）
-                selected_folder = None
-                try:
-                    selected_folder = self.match_heading_to_folder(h2_text, folder_names)
-
-                    # フォルダー名の検証
-                    if selected_folder and selected_folder in folder_names:
-                        logger.info(f"H2 '{h2_text}': AIマッチング成功 → フォルダー '{selected_folder}' を選択")
-                    else:
-                        logger.info(f"H2 '{h2_text}': AIマッチング結果が無効 ('{selected_folder}')、ランダム選択に切り替え")
-                        selected_folder = None
-                except Exception as e:
-                    logger.error(f"H2 '{h2_text}': AIマッチング中にエラー発生 - {e}")
-                    selected_folder = None
+                # H2見出しに対応するフォルダー（マッチングできなければランダム）
+                selected_folder = folder_matches.get(h2_text)
+                if selected_folder:
+                    logger.info(f"H2 '{h2_text}': マッチング成功 → フォルダー '{selected_folder}' を選択")
 
                 # マッチングに失敗した場合は必ずランダムにフォルダーを選択
                 if not selected_folder:
@@ -2282,36 +5148,6 @@ H1: #、H2: ##、H3: ###、H4: ####
 
                 logger.info(f"H2 '{h2_text}': ✓ 画像 '{selected_image['name']}' (ID: {image_id[:20]}...) を挿入予定")
 
-                # 画像を「リンクを知っている全員」に設定（Google Docs APIからアクセス可能にするため）
-                try:
-                    # 既存の権限を確認
-                    permissions = self.drive_service.permissions().list(
-                        fileId=image_id,
-                        supportsAllDrives=True,
-                        fields='permissions(id, type, role)'
-                    ).execute()
-
-                    # 「リンクを知っている全員」の権限があるか確認
-                    has_public_link = any(
-                        p.get('type') == 'anyone' for p in permissions.get('permissions', [])
-                    )
-
-                    # なければ追加（組織内のみに制限）
-                    if not has_public_link:
-                        self.drive_service.permissions().create(
-                            fileId=image_id,
-                            supportsAllDrives=True,
-                            body={
-                                'type': 'domain',
-                                'domain': 'vexum-ai.com',
-                                'role': 'reader'
-                            }
-                        ).execute()
-                        logger.info(f"[DEBUG] 画像を組織内共有に設定: {image_id}")
-
-                except Exception as e:
-                    logger.error(f"権限設定エラー: {e}")
-
                 # 直接アクセス可能なURL形式を使用
                 image_url = f"https://lh3.googleusercontent.com/d/{image_id}"
 
@@ -2345,11 +5181,15 @@ H1: #、H2: ##、H3: ###、H4: ####
 
                 insert_requests.reverse()
 
+                # 画像を組織内共有に設定（Google Docs APIからアクセス可能にするため）
+                self.ensure_images_shared(used_image_ids)
+
                 try:
-                    result = self.docs_service.documents().batchUpdate(
-                        documentId=document_id,
-                        body={'requests': insert_requests}
-                    ).execute()
+                    with timed_stage('image_insert'):
+                        result = execute_google(self.docs_service.documents().batchUpdate(
+                            documentId=document_id,
+                            body={'requests': insert_requests}
+                        ))
                     logger.info(f"✓ {len(insert_requests)}枚の画像を挿入しました")
                     logger.info(f"[DEBUG] batchUpdate結果: {result}")
                 except Exception as batch_error:
@@ -2364,8 +5204,9 @@ H1: #、H2: ##、H3: ###、H4: ####
             import traceback
             logger.error(f"詳細: {traceback.format_exc()}")
 
-    def insert_generated_images_into_doc(self, document_id, h2_headings, keyword):
-        """Vertex AIで画像を生成してH2見出しの後に挿入"""
+    @timed_stage('images')
+    def insert_generated_images_into_doc(self, document_id, h2_headings, keyword, doc_index=None):
+        """Vertex AIで画像を生成してH2見出しの後に挿入（doc_index は save_to_google_docs が返す DocumentStructureIndex）"""
         logger.info(f"[DEBUG] 画像生成・挿入開始 - document_id: {document_id}")
 
         if not self.image_folder_id:
@@ -2373,52 +5214,10 @@ H1: #、H2: ##、H3: ###、H4: ####
             return
 
         try:
-            # ドキュメントの内容を取得
-            logger.info(f"[DEBUG] ドキュメント内容を取得中...")
-            doc = self.docs_service.documents().get(documentId=document_id).execute()
-            content = doc.get('body').get('content')
-            logger.info(f"[DEBUG] ドキュメント要素数: {len(content)}")
-
-            # H2見出しを検索（Googleドキュメントの見出しスタイル or マークダウン形式に対応）
-            # スペースなしでもマッチするように修正
-            h2_pattern = re.compile(r'^\s*##\s*(.+?)\s*$')
-
-            # 全てのH2見出しを検出
-            h2_elements = []
-            for element in content:
-                if 'paragraph' in element:
-                    paragraph = element['paragraph']
-                    para_text = ''
-                    for text_element in paragraph.get('elements', []):
-                        if 'textRun' in text_element:
-                            para_text += text_element['textRun']['content']
-
-                    para_text_stripped = para_text.strip()
-
-                    # 見出しスタイルをチェック（HEADING_2）
-                    paragraph_style = paragraph.get('paragraphStyle', {})
-                    named_style = paragraph_style.get('namedStyleType', '')
-
-                    if named_style == 'HEADING_2':
-                        # Googleドキュメントの見出しスタイル
-                        h2_text = para_text_stripped
-                        h2_elements.append({
-                            'text': h2_text,
-                            'element': element,
-                            'end_index': element['endIndex']
-                        })
-                        logger.info(f"[DEBUG] H2見出しスタイル検出: '{h2_text}' (end_index: {element['endIndex']})")
-                    else:
-                        # マークダウン形式もサポート（後方互換性）
-                        match = h2_pattern.match(para_text_stripped)
-                        if match:
-                            h2_text = match.group(1).strip()
-                            h2_elements.append({
-                                'text': h2_text,
-                                'element': element,
-                                'end_index': element['endIndex']
-                            })
-                            logger.info(f"[DEBUG] マークダウンH2マッチ: '{h2_text}' (end_index: {element['endIndex']})")
+            # H2見出しの位置（保存時のインデックスがなければ必要なフィールドだけを1回取得）
+            if doc_index is None:
+                doc_index = DocumentStructureIndex.fetch(self.docs_service, document_id)
+            h2_elements = doc_index.h2_elements()
 
             logger.info(f"[DEBUG] 検出されたH2見出し数: {len(h2_elements)}")
 
@@ -2429,6 +5228,16 @@ H1: #、H2: ##、H3: ###、H4: ####
             h2_to_process = h2_elements[:-1] if len(h2_elements) > 1 else []
             logger.info(f"[DEBUG] 画像を挿入するH2見出し数: {len(h2_to_process)}")
 
+            # 生成済みの画像は再利用し、残りの生成をまとめて IMAGE_SCHEDULER に投入（記事ごとに公平に並列実行）
+            cached_images = self.find_generated_images(
+                [h2_info['text'] for h2_info in h2_to_process if 'まとめ' not in h2_info['text']], keyword
+            )
+            generations = {
+                i: IMAGE_SCHEDULER.submit(document_id, self.generate_image_with_vertex, h2_info['text'], keyword)
+                for i, h2_info in enumerate(h2_to_process)
+                if 'まとめ' not in h2_info['text'] and h2_info['text'] not in cached_images
+            }
+
             for i, h2_info in enumerate(h2_to_process):
                 h2_text = h2_info['text']
                 end_index = h2_info['end_index']
@@ -2440,27 +5249,37 @@ H1: #、H2: ##、H3: ###、H4: ####
                     logger.warning(f"[SKIP] H2 '{h2_text}': 「まとめ」を含むためスキップ")
                     continue
 
-                # Vertex AIで画像を生成
-                image_bytes = self.generate_image_with_vertex(h2_text, keyword)
+                # 生成済みの画像があれば再利用
+                image_url = cached_images.get(h2_text)
+                if image_url:
+                    logger.info(f"H2 '{h2_text}': 生成済みの画像を再利用")
+                else:
+                    # 生成結果を待つ
+                    try:
+                        image_bytes = generations[i].result()
+                    except Exception as e:
+                        image_bytes = f"ERROR: {e}"
 
-                if isinstance(image_bytes, str) and image_bytes.startswith("ERROR:"):
-                    logger.warning(f"[SKIP] H2 '{h2_text}': 画像生成失敗 - {image_bytes}")
-                    image_errors.append(f"H2 '{h2_text}': {image_bytes}")
-                    continue
+                    if isinstance(image_bytes, str) and image_bytes.startswith("ERROR:"):
+                        logger.warning(f"[SKIP] H2 '{h2_text}': 画像生成失敗 - {image_bytes}")
+                        image_errors.append(f"H2 '{h2_text}': {image_bytes}")
+                        continue
 
-                if not image_bytes:
-                    logger.warning(f"[SKIP] H2 '{h2_text}': 画像生成に失敗")
-                    continue
+                    if not image_bytes:
+                        logger.warning(f"[SKIP] H2 '{h2_text}': 画像生成に失敗")
+                        continue
 
-                # Google Driveにアップロード
-                import time
-                timestamp = int(time.time())
-                filename = f"{keyword}_{h2_text[:20]}_{timestamp}"
-                image_url = self.upload_image_to_drive(image_bytes, filename)
+                    # Google Driveにアップロード
+                    import time
+                    timestamp = int(time.time())
+                    filename = f"{keyword}_{h2_text[:20]}_{timestamp}"
+                    image_url = self.upload_image_to_drive(
+                        image_bytes, filename, image_key=self.generated_image_key(h2_text, keyword)
+                    )
 
-                if not image_url:
-                    logger.warning(f"[SKIP] H2 '{h2_text}': 画像アップロードに失敗")
-                    continue
+                    if not image_url:
+                        logger.warning(f"[SKIP] H2 '{h2_text}': 画像アップロードに失敗")
+                        continue
 
                 # 画像挿入リクエストを追加
                 insert_requests.append({
@@ -2484,10 +5303,11 @@ H1: #、H2: ##、H3: ###、H4: ####
                 insert_requests.reverse()
 
                 try:
-                    result = self.docs_service.documents().batchUpdate(
-                        documentId=document_id,
-                        body={'requests': insert_requests}
-                    ).execute()
+                    with timed_stage('image_insert'):
+                        result = execute_google(self.docs_service.documents().batchUpdate(
+                            documentId=document_id,
+                            body={'requests': insert_requests}
+                        ))
                     logger.info(f"✓ {len(insert_requests)}枚の生成画像を挿入しました")
                 except Exception as batch_error:
                     logger.error(f"[ERROR] batchUpdate実行中にエラー発生: {batch_error}")
@@ -2505,10 +5325,12 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"詳細: {traceback.format_exc()}")
             return [f"画像処理全体エラー: {str(e)}"]
 
-    def insert_both_images_into_doc(self, document_id, h2_headings, keyword):
+    @timed_stage('images')
+    def insert_both_images_into_doc(self, document_id, h2_headings, keyword, doc_index=None):
         """フォルダ画像とVertex AI生成画像の両方をH2見出しの後に挿入（並列処理版）
 
-        人間が最終チェックでどちらか選んで不要な方を削除する想定
+        人間が最終チェックでどちらか選んで不要な方を削除する想定。
+        doc_index は save_to_google_docs が返す DocumentStructureIndex（なければ文書を1回取得する）。
         """
         from concurrent.futures import ThreadPoolExecutor, as_completed
         import time
@@ -2525,40 +5347,10 @@ H1: #、H2: ##、H3: ###、H4: ####
         logger.info(f"[BOTH] 利用可能なフォルダー: {folder_names}")
 
         try:
-            # ドキュメントの内容を取得
-            doc = self.docs_service.documents().get(documentId=document_id).execute()
-            content = doc.get('body').get('content')
-
-            # H2見出しを検索
-            h2_pattern = re.compile(r'^\s*##\s*(.+?)\s*$')
-            h2_elements = []
-
-            for element in content:
-                if 'paragraph' in element:
-                    paragraph = element['paragraph']
-                    para_text = ''
-                    for text_element in paragraph.get('elements', []):
-                        if 'textRun' in text_element:
-                            para_text += text_element['textRun']['content']
-
-                    para_text_stripped = para_text.strip()
-                    paragraph_style = paragraph.get('paragraphStyle', {})
-                    named_style = paragraph_style.get('namedStyleType', '')
-
-                    if named_style == 'HEADING_2':
-                        h2_elements.append({
-                            'text': para_text_stripped,
-                            'element': element,
-                            'end_index': element['endIndex']
-                        })
-                    else:
-                        match = h2_pattern.match(para_text_stripped)
-                        if match:
-                            h2_elements.append({
-                                'text': match.group(1).strip(),
-                                'element': element,
-                                'end_index': element['endIndex']
-                            })
+            # H2見出しの位置（保存時のインデックスがなければ必要なフィールドだけを1回取得）
+            if doc_index is None:
+                doc_index = DocumentStructureIndex.fetch(self.docs_service, document_id)
+            h2_elements = doc_index.h2_elements()
 
             logger.info(f"[BOTH] 検出されたH2見出し数: {len(h2_elements)}")
 
@@ -2571,6 +5363,14 @@ H1: #、H2: ##、H3: ###、H4: ####
             h2_to_process = [h for h in h2_to_process if 'まとめ' not in h['text']]
             logger.info(f"[BOTH] 画像を挿入するH2見出し数: {len(h2_to_process)}")
 
+            # 全H2のフォルダーをまとめて選択（失敗時は各H2でランダム選択）
+            folder_matches = {}
+            if folder_images:
+                try:
+                    folder_matches = self.match_headings_to_folders([h['text'] for h in h2_to_process], folder_names)
+                except Exception as e:
+                    logger.error(f"[BOTH] フォルダーマッチング中にエラー発生 - {e}")
+
             # フォルダ画像を先に全て割り当て（順番を保持するため）
             folder_assignments = {}
             for i, h2_info in enumerate(h2_to_process):
@@ -2578,14 +5378,8 @@ H1: #、H2: ##、H3: ###、H4: ####
                 folder_image_url = None
 
                 if folder_images:
-                    # フォルダ名でマッチングを試行
-                    matched_folder = None
-                    for folder_name in folder_names:
-                        if folder_name in h2_text or h2_text in folder_name:
-                            matched_folder = folder_name
-                            break
-
-                    if matched_folder and folder_images[matched_folder]:
+                    matched_folder = folder_matches.get(h2_text)
+                    if matched_folder and folder_images.get(matched_folder):
                         for img in folder_images[matched_folder]:
                             if img['id'] not in used_folder_image_ids:
                                 folder_image_url = f"https://drive.google.com/uc?id={img['id']}"
@@ -2607,18 +5401,18 @@ H1: #、H2: ##、H3: ###、H4: ####
 
                 folder_assignments[i] = folder_image_url
 
-            # Vertex AI画像生成を並列実行するための関数
-            def generate_ai_image_task(index, h2_info):
-                """並列実行用のタスク"""
+            # 生成結果をDriveにアップロード
+            def upload_ai_image_task(index, h2_info, generation):
                 h2_text = h2_info['text']
                 try:
-                    logger.info(f"[PARALLEL] AI画像生成開始 ({index+1}/{len(h2_to_process)}): '{h2_text[:30]}...'")
-                    image_bytes = self.generate_image_with_vertex(h2_text, keyword)
+                    image_bytes = generation.result()
 
                     if image_bytes and not (isinstance(image_bytes, str) and image_bytes.startswith("ERROR:")):
                         timestamp = int(time.time())
                         filename = f"AI_{keyword}_{h2_text[:20]}_{timestamp}"
-                        ai_image_url = self.upload_image_to_drive(image_bytes, filename)
+                        ai_image_url = self.upload_image_to_drive(
+                            image_bytes, filename, image_key=self.generated_image_key(h2_text, keyword)
+                        )
 
                         if ai_image_url:
                             logger.info(f"[PARALLEL] AI画像生成完了 ({index+1}): '{h2_text[:30]}...'")
@@ -2631,38 +5425,42 @@ H1: #、H2: ##、H3: ###、H4: ####
                 except Exception as e:
                     return (index, None, f"H2 '{h2_text}': 例外発生 - {str(e)}")
 
-            # AI画像生成を順次実行（クォータ超過対策）
+            # AI画像生成をまとめて IMAGE_SCHEDULER に投入（同時実行数・生成間隔は RATE_LIMITER の vertex_imagen 枠で制御）
             ai_image_results = {}
-            logger.info(f"[SEQUENTIAL] {len(h2_to_process)}個のAI画像を順次生成開始")
+            logger.info(f"[PARALLEL] {len(h2_to_process)}個のAI画像を並列生成開始")
             start_time = time.time()
             quota_exceeded = False  # クォータ超過フラグ
+            # 生成済みの画像は再利用（同じプロンプト・モデル・保存先）
+            cached_images = self.find_generated_images([h2_info['text'] for h2_info in h2_to_process], keyword)
+            generations = {
+                i: IMAGE_SCHEDULER.submit(document_id, self.generate_image_with_vertex, h2_info['text'], keyword)
+                for i, h2_info in enumerate(h2_to_process)
+                if h2_info['text'] not in cached_images
+            }
 
-            # 順次処理で1枚ずつ生成（各生成後に30秒待機）
             for i, h2_info in enumerate(h2_to_process):
-                # クォータ超過済みなら残りをスキップ
-                if quota_exceeded:
-                    logger.warning(f"[SEQUENTIAL] クォータ超過のため残り{len(h2_to_process) - i}枚をスキップ")
-                    break
+                if h2_info['text'] in cached_images:
+                    ai_image_results[i] = cached_images[h2_info['text']]
+                    continue
+
+                # クォータ超過後に取り消された生成はスキップ
+                if generations[i].cancelled():
+                    continue
 
-                index, ai_url, error = generate_ai_image_task(i, h2_info)
+                index, ai_url, error = upload_ai_image_task(i, h2_info, generations[i])
                 ai_image_results[index] = ai_url
 
                 if error:
                     image_errors.append(error)
-                    logger.warning(f"[SEQUENTIAL] {error}")
-                    # クォータ超過エラーの場合、フラグを立てる
-                    if "QUOTA_EXCEEDED" in error:
+                    logger.warning(f"[PARALLEL] {error}")
+                    # クォータ超過エラーの場合、この記事の未着手の生成を取り消す
+                    if "QUOTA_EXCEEDED" in error and not quota_exceeded:
                         quota_exceeded = True
-                        logger.warning("[SEQUENTIAL] クォータ超過を検出。以降のAI画像生成をスキップします")
-                        continue
-
-                # 次の生成まで30秒待機（クォータ制限対策・強化版）
-                if i < len(h2_to_process) - 1 and not quota_exceeded:
-                    logger.info(f"[SEQUENTIAL] 次の画像生成まで30秒待機...")
-                    time.sleep(30)
+                        cancelled = IMAGE_SCHEDULER.cancel(document_id)
+                        logger.warning(f"[PARALLEL] クォータ超過を検出。未着手の{cancelled}枚のAI画像生成をスキップします")
 
             elapsed_time = time.time() - start_time
-            logger.info(f"[SEQUENTIAL] AI画像生成完了: {elapsed_time:.1f}秒 (クォータ超過: {quota_exceeded})")
+            logger.info(f"[PARALLEL] AI画像生成完了: {elapsed_time:.1f}秒 (クォータ超過: {quota_exceeded})")
 
             # 画像挿入リクエストを構築
             insert_requests = []
@@ -2714,44 +5512,45 @@ H1: #、H2: ##、H3: ###、H4: ####
                 insert_requests.reverse()
                 logger.info(f"[BOTH] 画像挿入リクエスト数: {len(insert_requests)}")
 
-                # 全リクエストを一度に送信（リトライ処理付き）
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        self.docs_service.documents().batchUpdate(
+                # 全リクエストを一度に送信（429のリトライは execute_google が行う）
+                try:
+                    with timed_stage('image_insert'):
+                        execute_google(self.docs_service.documents().batchUpdate(
                             documentId=document_id,
                             body={'requests': insert_requests}
-                        ).execute()
-                        logger.info(f"[BOTH] 全{len(insert_requests)}件の画像挿入完了")
-                        break
-                    except Exception as batch_error:
-                        error_str = str(batch_error)
-                        if attempt < max_retries - 1:
-                            wait_time = 5 * (attempt + 1)  # 5秒、10秒、15秒
-                            logger.warning(f"[BOTH] 画像挿入失敗（リトライ {attempt + 1}/{max_retries}、{wait_time}秒待機）: {batch_error}")
-                            time.sleep(wait_time)
-                        else:
-                            logger.error(f"[BOTH] 画像挿入最終失敗: {batch_error}")
-                            # フォールバック: 2リクエストずつペアで挿入（改行+画像）
-                            logger.info("[BOTH] フォールバック: ペアで画像を挿入します")
-                            success_count = 0
-                            total_pairs = len(insert_requests) // 2
-                            for i in range(0, len(insert_requests), 2):
-                                pair = insert_requests[i:i+2]
-                                pair_num = i // 2 + 1
-                                try:
-                                    self.docs_service.documents().batchUpdate(
-                                        documentId=document_id,
-                                        body={'requests': pair}
-                                    ).execute()
-                                    success_count += 1
-                                    logger.info(f"[BOTH] ペア{pair_num}/{total_pairs}挿入成功")
-                                except Exception as single_error:
-                                    logger.warning(f"[BOTH] ペア{pair_num}挿入失敗: {single_error}")
-                                time.sleep(2)  # ペアごとに2秒待機
-                            logger.info(f"[BOTH] フォールバック完了: {success_count}/{total_pairs}ペア成功")
-                            if success_count < total_pairs:
-                                image_errors.append(f"画像挿入: {success_count}/{total_pairs}ペアのみ成功")
+                        ))
+                    logger.info(f"[BOTH] 全{len(insert_requests)}件の画像挿入完了")
+                except HttpError as batch_error:
+                    if getattr(batch_error.resp, 'status', 500) >= 500:
+                        # サーバーエラーは反映済みの可能性があるため再送しない（画像の二重挿入を防ぐ）
+                        logger.error(f"[BOTH] 画像挿入失敗（再送しません）: {batch_error}")
+                        image_errors.append(f"画像挿入エラー: {str(batch_error)}")
+                        return image_errors
+                    # 4xx の場合 batchUpdate は何も反映されていない
+                    logger.error(f"[BOTH] 画像挿入失敗: {batch_error}")
+                    # フォールバック: 2リクエストずつペアで挿入（改行+画像）
+                    logger.info("[BOTH] フォールバック: ペアで画像を挿入します")
+                    success_count = 0
+                    total_pairs = len(insert_requests) // 2
+                    for i in range(0, len(insert_requests), 2):
+                        pair = insert_requests[i:i+2]
+                        pair_num = i // 2 + 1
+                        try:
+                            execute_google(self.docs_service.documents().batchUpdate(
+                                documentId=document_id,
+                                body={'requests': pair}
+                            ))
+                            success_count += 1
+                            logger.info(f"[BOTH] ペア{pair_num}/{total_pairs}挿入成功")
+                        except Exception as single_error:
+                            logger.warning(f"[BOTH] ペア{pair_num}挿入失敗: {single_error}")
+                    logger.info(f"[BOTH] フォールバック完了: {success_count}/{total_pairs}ペア成功")
+                    if success_count < total_pairs:
+                        image_errors.append(f"画像挿入: {success_count}/{total_pairs}ペアのみ成功")
+                except Exception as batch_error:
+                    # タイムアウト等は反映済みの可能性があるため再送しない（画像の二重挿入を防ぐ）
+                    logger.error(f"[BOTH] 画像挿入失敗（再送しません）: {batch_error}")
+                    image_errors.append(f"画像挿入エラー: {str(batch_error)}")
 
                 logger.info(f"[BOTH] 画像挿入完了")
 
@@ -2763,12 +5562,13 @@ H1: #、H2: ##、H3: ###、H4: ####
             logger.error(f"詳細: {traceback.format_exc()}")
             return [f"画像処理全体エラー: {str(e)}"]
 
-    def process_single_sheet(self, sheet_name, force=False):
+    def process_single_sheet(self, sheet_name, force=False, incremental=True):
         """指定されたシート1つを処理
 
         Args:
             sheet_name: シート名
             force: Trueの場合、処理済みでも再生成する
+            incremental: force 時、前回から変更されたセクションのみを再生成する
         """
         logger.info(f"[SINGLE] シート '{sheet_name}' の処理を開始 (force={force})")
         self.authenticate_google()
@@ -2782,90 +5582,158 @@ H1: #、H2: ##、H3: ###、H4: ####
         h2_count = len([h for h in heading_data['headings'] if h['level'] == 'H2'])
         logger.info(f"[SINGLE] シート '{sheet_name}': H1='{heading_data['h1_title']}', H2数={h2_count}")
 
+        # force 再生成では前回のスナップショットとの差分だけを再生成する
+        snapshot = None
+        if force and incremental and INCREMENTAL_REGENERATION:
+            snapshot = ARTICLE_SNAPSHOTS.load(self.spreadsheet_id, sheet_name)
+
         try:
-            # 記事生成（初稿）
-            article_draft = self.generate_article(
+            with usage_scope(spreadsheet_id=self.spreadsheet_id, sheet_name=sheet_name):
+                result = self._run_article_pipeline(sheet_name, heading_data, snapshot=snapshot)
+            result.pop('stage', None)
+            result.pop('warnings', None)
+            return result
+
+        except Exception as e:
+            logger.error(f"[SINGLE] 例外発生: {e}")
+            import traceback
+            logger.error(f"[SINGLE] トレースバック: {traceback.format_exc()}")
+            return {'status': 'error', 'error': str(e)}
+
+    @timed_stage('article_total')
+    def _run_article_pipeline(self, sheet_name, heading_data, snapshot=None):
+        """1記事分の処理（記事生成 → Docs保存 → 画像挿入 → ステータス更新 → 通知）
+
+        process_single_sheet と process_all_sheets で共通に使う。
+        インスタンスの状態は画像フォルダー一覧のキャッシュ（self.image_cache。どのスレッドも
+        IMAGE_FOLDER_CATALOG の同じ一覧を代入するだけ）以外書き換えないため、複数記事を並列に実行してもよい。
+        snapshot（前回の生成結果）を渡した場合は変更されたセクションのみを再生成する。
+
+        Returns:
+            成功時: {'status': 'success', 'title', 'url', 'warnings': [...]}
+            失敗時: {'status': 'error', 'stage': 'generate' | 'save', 'error': str}
+        """
+        # 記事生成（差分再生成できない場合は Step0〜Step4）
+        article = None
+        if snapshot:
+            article = self.generate_article_incremental(
+                heading_data['keyword'],
+                heading_data['h1_title'],
+                heading_data['headings'],
+                snapshot
+            )
+            if article and article.startswith("ERROR:") and not self._aborted_error():
+                # 差分再生成の失敗（一時的なLLMエラー等）でもシートを失敗にせず、全体の再生成を試す
+                logger.warning(f"[INCREMENTAL] 差分再生成に失敗したため全体を再生成します: {article}")
+                article = None
+        if article is None:
+            article = self.generate_article(
                 heading_data['keyword'],
                 heading_data['h1_title'],
                 heading_data['headings']
             )
 
-            if not article_draft or article_draft.startswith("ERROR:"):
-                error_detail = article_draft if article_draft else "Unknown Error"
-                logger.error(f"[SINGLE] 記事生成失敗: {error_detail}")
-                return {'status': 'error', 'error': error_detail}
+        if not article or article.startswith("ERROR:"):
+            error_detail = article if article else "Unknown Error"
+            logger.error(f"[ARTICLE] 記事生成失敗 ({sheet_name}): {error_detail}")
+            return {'status': 'error', 'stage': 'generate', 'error': error_detail}
 
-            article = article_draft
+        # Googleドキュメントに保存
+        self._report_stage('save', f"Googleドキュメントに保存中（{len(article)}字）")
+        doc_url, document_id, tables, doc_index = self.save_to_google_docs(article, heading_data['h1_title'])
 
-            # Googleドキュメントに保存
-            doc_url, document_id, tables = self.save_to_google_docs(article, heading_data['h1_title'])
+        if not doc_url:
+            logger.error(f"[ARTICLE] ドキュメント保存失敗 ({sheet_name})")
+            return {'status': 'error', 'stage': 'save', 'error': 'ドキュメント保存失敗'}
 
-            if not doc_url:
-                logger.error(f"[SINGLE] ドキュメント保存失敗")
-                return {'status': 'error', 'error': 'ドキュメント保存失敗'}
+        # 次回の差分再生成用に見出し構成とセクション本文を保存
+        if INCREMENTAL_REGENERATION:
+            ARTICLE_SNAPSHOTS.save(
+                self.spreadsheet_id, sheet_name, heading_data,
+                self._group_headings_by_h2(heading_data['headings']), article
+            )
 
-            logger.info(f"[SINGLE] ドキュメント生成成功: {doc_url}")
-            self.update_sheet_status(sheet_name, "画像処理中...", doc_url)
+        # 【重要】URL生成直後にスプレッドシートに書き込む（最優先）
+        logger.info(f"[ARTICLE] ドキュメント生成成功 ({sheet_name}): {doc_url}")
+        self.update_sheet_status(sheet_name, "画像処理中...", doc_url)
 
-            # 画像挿入処理
-            h2_headings = [h for h in heading_data['headings'] if h['level'] == 'H2']
-            if self.image_generation_method == 'both':
-                logger.info("[SINGLE] 両方の画像（フォルダ + Vertex AI）を挿入します")
-                try:
-                    self.insert_both_images_into_doc(document_id, h2_headings, heading_data['keyword'])
-                except Exception as e:
-                    logger.error(f"[SINGLE] 両方の画像挿入エラー（継続）: {e}")
-            elif self.image_generation_method == 'vertex_ai':
-                logger.info("[SINGLE] Vertex AIで画像を生成します")
-                self.insert_generated_images_into_doc(document_id, h2_headings, heading_data['keyword'])
-            else:
-                logger.info("[SINGLE] 既存の画像フォルダから画像を取得します")
-                try:
-                    self.insert_images_into_doc(document_id, h2_headings)
-                except Exception as e:
-                    logger.error(f"[SINGLE] 画像挿入エラー（継続）: {e}")
-
-            # 表はマークダウン形式で既に挿入済み（save_to_google_docs内で処理）
-            if tables:
-                logger.info(f"[SINGLE] 表は既にマークダウン形式で挿入済み: {len(tables)}個")
-
-            # 最終ステータス更新
-            self.update_sheet_status(sheet_name, "処理済み", doc_url)
-
-            # マスターシートに初稿URLを書き込む（設定されている場合）
-            if self.master_spreadsheet_id:
-                self.update_master_sheet_article_url(
-                    self.master_spreadsheet_id,
-                    heading_data['keyword'],
-                    doc_url,
-                    self.keyword_column,
-                    self.article_url_column
-                )
+        # 画像生成方法に応じて処理を切り替え
+        self._report_stage('images', "画像を挿入中")
+        warnings = []
+        h2_headings = [h for h in heading_data['headings'] if h['level'] == 'H2']
+        if self.image_generation_method == 'both':
+            logger.info("[ARTICLE] 両方の画像（フォルダ + Vertex AI）を挿入します")
+            try:
+                self.insert_both_images_into_doc(document_id, h2_headings, heading_data['keyword'], doc_index=doc_index)
+            except Exception as e:
+                logger.error(f"[ARTICLE] 両方の画像挿入エラー（継続）: {e}")
+        elif self.image_generation_method == 'vertex_ai':
+            logger.info("[ARTICLE] Vertex AIで画像を生成します")
+            img_errors = self.insert_generated_images_into_doc(document_id, h2_headings, heading_data['keyword'], doc_index=doc_index)
+            if img_errors:
+                warnings.append(f"画像生成エラー: {'; '.join(img_errors)}")
+        else:
+            logger.info("[ARTICLE] 既存の画像フォルダから画像を取得します")
+            try:
+                self.insert_images_into_doc(document_id, h2_headings, doc_index=doc_index)
+            except Exception as e:
+                logger.error(f"[ARTICLE] 画像挿入エラー（継続）: {e}")
+
+        # 表は save_to_google_docs で本文と同時に挿入済み
+        if tables:
+            logger.info(f"[ARTICLE] 表は挿入済み（{'ネイティブの表' if DOCS_NATIVE_TABLES else 'マークダウン形式'}）: {len(tables)}個")
 
-            logger.info(f"[SINGLE] 処理完了: {sheet_name}")
+        # 最終ステータス更新
+        self.update_sheet_status(sheet_name, "処理済み", doc_url)
 
-            # Slack通知を送信
-            self.send_article_notification(
-                title=heading_data['h1_title'],
-                url=doc_url,
-                keyword=heading_data['keyword']
+        # マスターシートに初稿URLを書き込む（設定されている場合）
+        if self.master_spreadsheet_id:
+            self.update_master_sheet_article_url(
+                self.master_spreadsheet_id,
+                heading_data['keyword'],
+                doc_url,
+                self.keyword_column,
+                self.article_url_column
             )
 
-            return {
-                'status': 'success',
-                'title': heading_data['h1_title'],
-                'url': doc_url
-            }
+        logger.info(f"[ARTICLE] 処理完了: {sheet_name}")
+
+        # Slack通知を送信
+        self.send_article_notification(
+            title=heading_data['h1_title'],
+            url=doc_url,
+            keyword=heading_data['keyword']
+        )
+
+        return {
+            'status': 'success',
+            'title': heading_data['h1_title'],
+            'url': doc_url,
+            'warnings': warnings
+        }
 
+    def _process_sheet_isolated(self, sheet_name, heading_data):
+        """1記事を処理し、例外を結果に閉じ込める（並列実行時に他の記事へ影響させない）"""
+        try:
+            h2_count = len([h for h in heading_data['headings'] if h['level'] == 'H2'])
+            logger.info(f"処理中: {heading_data['h1_title']}（シート '{sheet_name}'、H2数={h2_count}）")
+            with usage_scope(spreadsheet_id=self.spreadsheet_id, sheet_name=sheet_name):
+                return self._run_article_pipeline(sheet_name, heading_data)
         except Exception as e:
-            logger.error(f"[SINGLE] 例外発生: {e}")
+            logger.error(f"[ARTICLE] 例外発生 ({sheet_name}): {e}")
             import traceback
-            logger.error(f"[SINGLE] トレースバック: {traceback.format_exc()}")
-            return {'status': 'error', 'error': str(e)}
+            logger.error(f"[ARTICLE] トレースバック: {traceback.format_exc()}")
+            return {'status': 'error', 'stage': 'exception', 'error': str(e)}
 
-    def process_all_sheets(self, max_articles=None):
-        """すべての未処理シートを処理"""
-        logger.info(f"[DEBUG] 処理開始 - max_articles: {max_articles}")
+    def process_all_sheets(self, max_articles=None, concurrency=None):
+        """すべての未処理シートを処理
+
+        Args:
+            max_articles: 処理（成功）する最大記事数（None = すべて）
+            concurrency: 同時に生成する記事数（None = 環境変数 ARTICLE_CONCURRENCY、既定1）
+        """
+        concurrency = max(1, int(concurrency or ARTICLE_CONCURRENCY))
+        logger.info(f"[DEBUG] 処理開始 - max_articles: {max_articles}, concurrency: {concurrency}")
         self.authenticate_google()
 
         sheets = self.get_all_sheets()
@@ -2882,153 +5750,95 @@ H1: #、H2: ##、H3: ###、H4: ####
                 'all_sheets_status': []
             }
 
-        processed = []
-        errors = []
-        skipped = []  # スキップされたシートの情報を追加
-        all_sheets_status = []  # 全シートの状態を記録
+        # 全シートの見出しを batchGet で先読み（シートごとの往復を削減）
+        headings_by_sheet = self.get_headings_from_sheets(sheets)
+
+        # シート順のインデックス → 結果（None はスキップ）
+        results = {}
+        in_flight = {}
+        success_count = 0
+        next_index = 0
+        logger.info(f"[DEBUG] ループ開始: {len(sheets)}シートを最大{concurrency}並列で処理します")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                # 空きスロットに次の記事を投入（成功数+実行中が上限に達したら投入しない）
+                while len(in_flight) < concurrency and next_index < len(sheets):
+                    if max_articles and success_count + len(in_flight) >= max_articles:
+                        break
 
-        count = 0
-        logger.info(f"[DEBUG] ループ開始: {len(sheets)}シートを処理します")
+                    sheet_name = sheets[next_index]
+                    logger.info(f"[DEBUG] シート '{sheet_name}' を確認中...")
+                    heading_data = headings_by_sheet.get(sheet_name)
 
-        for sheet_name in sheets:
-            logger.info(f"[DEBUG] ループ内: シート '{sheet_name}' を確認中...")
-            if max_articles and count >= max_articles:
-                logger.info(f"[DEBUG] 最大記事数 {max_articles} に到達。処理終了。")
-                break
+                    if not heading_data:
+                        logger.info(f"[DEBUG] シート '{sheet_name}': 見出しデータなし。スキップ。")
+                        results[next_index] = None
+                    else:
+                        future = executor.submit(self._process_sheet_isolated, sheet_name, heading_data)
+                        in_flight[future] = next_index
+                    next_index += 1
 
-            heading_data = self.get_headings_from_sheet(sheet_name)
+                if not in_flight:
+                    break
 
-            if not heading_data:
-                reason = "見出しデータなし"
-                logger.info(f"[DEBUG] シート '{sheet_name}': {reason}。スキップ。")
-                skipped.append({
-                    'sheet': sheet_name,
-                    'reason': reason
-                })
-                all_sheets_status.append({
-                    'sheet': sheet_name,
-                    'status': 'skipped',
-                    'reason': reason
-                })
-                continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = in_flight.pop(future)
+                    result = future.result()
+                    results[index] = result
+                    if result['status'] == 'success':
+                        success_count += 1
 
-            h2_count = len([h for h in heading_data['headings'] if h['level'] == 'H2'])
-            logger.info(f"[DEBUG] シート '{sheet_name}': 処理対象として検出。H1='{heading_data['h1_title']}', 見出し総数={len(heading_data['headings'])}, H2数={h2_count}")
+        if max_articles and success_count >= max_articles:
+            logger.info(f"[DEBUG] 最大記事数 {max_articles} に到達。処理終了。")
 
-            try:
-                logger.info(f"処理中: {heading_data['h1_title']}")
+        # シート順に結果をまとめる
+        processed = []
+        errors = []
+        skipped = []  # スキップされたシートの情報を追加
+        all_sheets_status = []  # 全シートの状態を記録
 
-                # 記事生成（初稿）
-                article_draft = self.generate_article(
-                    heading_data['keyword'],
-                    heading_data['h1_title'],
-                    heading_data['headings']
-                )
+        for index in sorted(results):
+            sheet_name = sheets[index]
+            result = results[index]
 
-                if not article_draft or article_draft.startswith("ERROR:"):
-                    # 初稿生成失敗
-                    error_detail = article_draft if article_draft else "Unknown Error"
-                    error_msg = f"記事生成に失敗しました: {error_detail}"
-                    errors.append({'sheet': sheet_name, 'error': error_msg})
-                    all_sheets_status.append({'sheet': sheet_name, 'status': 'error', 'error': error_msg})
-                    continue
+            if result is None:
+                reason = "見出しデータなし"
+                skipped.append({'sheet': sheet_name, 'reason': reason})
+                all_sheets_status.append({'sheet': sheet_name, 'status': 'skipped', 'reason': reason})
+                continue
 
-                # generate_articleで既にStep0〜Step4の処理済み
-                article = article_draft
-
-                if article:
-                    # Googleドキュメントに保存
-                    doc_url, document_id, tables = self.save_to_google_docs(article, heading_data['h1_title'])
-
-                    if doc_url:
-                        # 【重要】URL生成直後にスプレッドシートに書き込む（最優先）
-                        logger.info(f"ドキュメント生成成功: {doc_url}")
-                        self.update_sheet_status(sheet_name, "画像処理中...", doc_url)
-
-                        # 画像生成方法に応じて処理を切り替え
-                        h2_headings = [h for h in heading_data['headings'] if h['level'] == 'H2']
-                        if self.image_generation_method == 'both':
-                            # 両方の画像（フォルダ + Vertex AI）を挿入
-                            logger.info("両方の画像（フォルダ + Vertex AI）を挿入します")
-                            try:
-                                self.insert_both_images_into_doc(document_id, h2_headings, heading_data['keyword'])
-                            except Exception as e:
-                                logger.error(f"両方の画像挿入中にエラーが発生しましたが、処理を継続します: {e}")
-                        elif self.image_generation_method == 'vertex_ai':
-                            # Vertex AIで画像を生成して挿入
-                            logger.info("Vertex AIで画像を生成します")
-                            img_errors = self.insert_generated_images_into_doc(document_id, h2_headings, heading_data['keyword'])
-                            if img_errors:
-                                error_msg = "; ".join(img_errors)
-                                all_sheets_status.append({'sheet': sheet_name, 'status': 'warning', 'error': f"画像生成エラー: {error_msg}"})
-                        else:
-                            # 既存の画像フォルダから取得して挿入
-                            logger.info("既存の画像フォルダから画像を取得します")
-                            # 画像挿入処理（エラーが出ても停止しないようにtry-exceptで囲む手もあるが、insert_images_into_doc内でログが出ているはず）
-                            try:
-                                self.insert_images_into_doc(document_id, h2_headings)
-                            except Exception as e:
-                                logger.error(f"画像挿入中にエラーが発生しましたが、処理を継続します: {e}")
-
-                        # 表はマークダウン形式で既に挿入済み（save_to_google_docs内で処理）
-                        if tables:
-                            logger.info(f"表は既にマークダウン形式で挿入済み: {len(tables)}個")
-
-                        # 最終ステータス更新
-                        self.update_sheet_status(sheet_name, "処理済み", doc_url)
-
-                        # マスターシートに初稿URLを書き込む（設定されている場合）
-                        if self.master_spreadsheet_id:
-                            self.update_master_sheet_article_url(
-                                self.master_spreadsheet_id,
-                                heading_data['keyword'],
-                                doc_url,
-                                self.keyword_column,
-                                self.article_url_column
-                            )
-
-                        # Slack通知を送信
-                        self.send_article_notification(
-                            title=heading_data['h1_title'],
-                            url=doc_url,
-                            keyword=heading_data['keyword']
-                        )
+            if result['status'] != 'success':
+                if result.get('stage') == 'generate':
+                    error_msg = f"記事生成に失敗しました: {result['error']}"
+                elif result.get('stage') == 'save':
+                    error_msg = "ドキュメント保存に失敗しました"
+                else:
+                    error_msg = result['error']
+                errors.append({'sheet': sheet_name, 'error': error_msg})
+                all_sheets_status.append({'sheet': sheet_name, 'status': 'error', 'error': error_msg})
+                continue
 
-                        processed.append({
-                            'sheet': sheet_name,
-                            'title': heading_data['h1_title'],
-                            'url': doc_url
-                        })
-                        all_sheets_status.append({
-                            'sheet': sheet_name,
-                            'status': 'processed',
-                            'url': doc_url
-                        })
-                        count += 1
-                    else:
-                        # ドキュメント保存失敗
-                        error_msg = "ドキュメント保存に失敗しました"
-                        errors.append({'sheet': sheet_name, 'error': error_msg})
-                        all_sheets_status.append({'sheet': sheet_name, 'status': 'error', 'error': error_msg})
-                # else句は不要（初稿生成失敗は上で処理済み）
+            for warning in result.get('warnings', []):
+                all_sheets_status.append({'sheet': sheet_name, 'status': 'warning', 'error': warning})
 
-            except Exception as e:
-                error_msg = str(e)
-                errors.append({
-                    'sheet': sheet_name,
-                    'error': error_msg
-                })
-                all_sheets_status.append({
-                    'sheet': sheet_name,
-                    'status': 'error',
-                    'error': error_msg
-                })
+            processed.append({
+                'sheet': sheet_name,
+                'title': result['title'],
+                'url': result['url']
+            })
+            all_sheets_status.append({
+                'sheet': sheet_name,
+                'status': 'processed',
+                'url': result['url']
+            })
 
         return {
             'processed': processed,
             'errors': errors,
             'skipped': skipped,  # スキップ情報を追加
-            'total': count,
+            'total': success_count,
             'total_sheets': len(sheets),  # 全シート数を追加
             'all_sheets_status': all_sheets_status  # 全シートの詳細状態
         }
@@ -3039,8 +5849,9 @@ H1: #、H2: ##、H3: ###、H4: ####
         all_sheets = self.get_all_sheets()
         unprocessed = []
 
+        headings_by_sheet = self.get_headings_from_sheets(all_sheets)
         for sheet_name in all_sheets:
-            heading_data = self.get_headings_from_sheet(sheet_name)
+            heading_data = headings_by_sheet.get(sheet_name)
             if heading_data:  # 処理済みでない場合のみheading_dataが返る
                 unprocessed.append({
                     'sheet_name': sheet_name,
@@ -3051,6 +5862,7 @@ H1: #、H2: ##、H3: ###、H4: ####
         logger.info(f"[PARALLEL] 未処理シート: {len(unprocessed)}件")
         return unprocessed
 
+    @timed_stage('slack')
     def send_article_notification(self, title, url, keyword=""):
         """1件の記事生成完了時にSlack通知"""
         slack_webhook_url = os.environ.get('SLACK_WEBHOOK_URL')
@@ -3109,6 +5921,8 @@ H1: #、H2: ##、H3: ###、H4: ####
                     'master_spreadsheet_id': self.master_spreadsheet_id,
                     'keyword_column': self.keyword_column,
                     'article_url_column': self.article_url_column,
+                    'draft_mode': self.draft_mode,
+                    'bypass_llm_cache': self.bypass_llm_cache,
                     'task_index': i + 1,
                     'total_tasks': total
                 }
@@ -3188,29 +6002,19 @@ class SearchConsoleKeywordFetcher:
     def __init__(self, site_url, spreadsheet_id):
         self.site_url = site_url
         self.spreadsheet_id = spreadsheet_id
-        self.search_console_service = None
-        self.sheets_service = None
-
-    def authenticate_google(self):
-        """サービスアカウントで認証"""
-        service_account_key = os.environ.get('GOOGLE_SERVICE_ACCOUNT_KEY')
-
-        if not service_account_key:
-            raise ValueError("GOOGLE_SERVICE_ACCOUNT_KEY environment variable is not set")
+        self.credentials = None
 
-        try:
-            service_account_info = json.loads(service_account_key)
-            logger.info(f"認証情報を読み込みました: {service_account_info.get('client_email', 'N/A')}")
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_KEY: {e}")
+    @property
+    def search_console_service(self):
+        return GOOGLE_CLIENTS.service('searchconsole', 'v1') if self.credentials else None
 
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=SCOPES
-        )
+    @property
+    def sheets_service(self):
+        return GOOGLE_CLIENTS.service('sheets', 'v4') if self.credentials else None
 
-        self.search_console_service = build('searchconsole', 'v1', credentials=credentials)
-        self.sheets_service = build('sheets', 'v4', credentials=credentials)
+    def authenticate_google(self):
+        """サービスアカウントで認証（プロセス共通のクライアントプールを使用）"""
+        self.credentials = GOOGLE_CLIENTS.get_credentials()
         logger.info("認証成功")
 
     def fetch_keywords(self, days=30, row_limit=1000):
@@ -3234,10 +6038,10 @@ class SearchConsoleKeywordFetcher:
             }
 
             logger.info(f"Search Console APIにリクエスト送信中... (site: {self.site_url})")
-            response = self.search_console_service.searchanalytics().query(
+            response = execute_google(self.search_console_service.searchanalytics().query(
                 siteUrl=self.site_url,
                 body=request_body
-            ).execute()
+            ))
 
             rows = response.get('rows', [])
             logger.info(f"✓ {len(rows)}件のキーワードデータを取得しました")
@@ -3264,9 +6068,9 @@ class SearchConsoleKeywordFetcher:
         """スプレッドシートにキーワードデータを書き込む"""
         try:
             # シートが存在するか確認、なければ作成
-            sheet_metadata = self.sheets_service.spreadsheets().get(
+            sheet_metadata = execute_google(self.sheets_service.spreadsheets().get(
                 spreadsheetId=self.spreadsheet_id
-            ).execute()
+            ))
 
             sheets = sheet_metadata.get('sheets', [])
             sheet_exists = any(sheet['properties']['title'] == sheet_name for sheet in sheets)
@@ -3282,18 +6086,18 @@ class SearchConsoleKeywordFetcher:
                         }
                     }]
                 }
-                self.sheets_service.spreadsheets().batchUpdate(
+                execute_google(self.sheets_service.spreadsheets().batchUpdate(
                     spreadsheetId=self.spreadsheet_id,
                     body=batch_update_request
-                ).execute()
+                ))
                 logger.info(f"✓ シート '{sheet_name}' を作成しました")
             else:
                 # 既存のシートをクリア
                 logger.info(f"シート '{sheet_name}' をクリア中...")
-                self.sheets_service.spreadsheets().values().clear(
+                execute_google(self.sheets_service.spreadsheets().values().clear(
                     spreadsheetId=self.spreadsheet_id,
                     range=f"'{sheet_name}'!A1:Z1000"
-                ).execute()
+                ))
 
             # ヘッダー行 + データ行
             from datetime import datetime
@@ -3316,12 +6120,12 @@ class SearchConsoleKeywordFetcher:
             range_name = f"'{sheet_name}'!A1"
             logger.info(f"スプレッドシートにデータ書き込み中... ({len(keywords_data)}件)")
 
-            self.sheets_service.spreadsheets().values().update(
+            execute_google(self.sheets_service.spreadsheets().values().update(
                 spreadsheetId=self.spreadsheet_id,
                 range=range_name,
                 valueInputOption='RAW',
                 body={'values': values}
-            ).execute()
+            ))
 
             logger.info(f"✓ スプレッドシートへの書き込み完了")
 
@@ -3367,42 +6171,40 @@ class SearchConsoleKeywordFetcher:
 class OutlineGenerator:
     """キーワードから構成案を生成してスプレッドシートに書き込む"""
 
-    def __init__(self, spreadsheet_id, openai_api_key, custom_search_api_key=None, custom_search_cx=None, anthropic_api_key=None):
+    def __init__(self, spreadsheet_id, openai_api_key, custom_search_api_key=None, custom_search_cx=None, anthropic_api_key=None,
+                 bypass_llm_cache=False):
         self.spreadsheet_id = spreadsheet_id
         self.openai_api_key = openai_api_key
+        self.bypass_llm_cache = bypass_llm_cache  # True の場合、LLM応答キャッシュを参照・保存しない
         self.custom_search_api_key = custom_search_api_key or os.environ.get('GOOGLE_CUSTOM_SEARCH_API_KEY')
         self.custom_search_cx = custom_search_cx or os.environ.get('GOOGLE_CUSTOM_SEARCH_CX')
-        self.sheets_service = None
+        self.credentials = None
         # OpenAI クライアントを初期化
         self.openai_client = OpenAI(
-            api_key=openai_api_key
+            api_key=openai_api_key,
+            max_retries=0  # 429・一時エラーのリトライは RATE_LIMITER で行う
         )
         # Claude クライアントを初期化（APIキーがあれば）
         self.anthropic_api_key = anthropic_api_key or os.environ.get('ANTHROPIC_API_KEY')
         self.claude_client = None
         if self.anthropic_api_key:
-            self.claude_client = anthropic.Anthropic(api_key=self.anthropic_api_key)
+            self.claude_client = anthropic.Anthropic(api_key=self.anthropic_api_key, max_retries=0)
 
-    def authenticate_google(self):
-        """サービスアカウントで認証"""
-        service_account_key = os.environ.get('GOOGLE_SERVICE_ACCOUNT_KEY')
-
-        if not service_account_key:
-            raise ValueError("GOOGLE_SERVICE_ACCOUNT_KEY environment variable is not set")
+    @property
+    def sheets_service(self):
+        return GOOGLE_CLIENTS.service('sheets', 'v4') if self.credentials else None
 
-        try:
-            service_account_info = json.loads(service_account_key)
-            logger.info(f"認証情報を読み込みました: {service_account_info.get('client_email', 'N/A')}")
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Invalid JSON in GOOGLE_SERVICE_ACCOUNT_KEY: {e}")
+    @property
+    def drive_service(self):
+        return GOOGLE_CLIENTS.service('drive', 'v3') if self.credentials else None
 
-        credentials = service_account.Credentials.from_service_account_info(
-            service_account_info,
-            scopes=SCOPES
-        )
+    def _cache_step(self, step):
+        """LLM応答キャッシュのステップ名（バイパス指定時は None = キャッシュしない）"""
+        return None if self.bypass_llm_cache else step
 
-        self.sheets_service = build('sheets', 'v4', credentials=credentials)
-        self.drive_service = build('drive', 'v3', credentials=credentials)
+    def authenticate_google(self):
+        """サービスアカウントで認証（プロセス共通のクライアントプールを使用）"""
+        self.credentials = GOOGLE_CLIENTS.get_credentials()
         logger.info("認証成功")
 
     def get_or_create_monthly_spreadsheet(self, year, month, folder_id=None):
@@ -3418,13 +6220,13 @@ class OutlineGenerator:
         query = f"name = '{spreadsheet_name}' and mimeType = 'application/vnd.google-apps.spreadsheet' and '{folder_id}' in parents and trashed = false"
 
         try:
-            results = self.drive_service.files().list(
+            results = execute_google(self.drive_service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(id, name)',
                 supportsAllDrives=True,
                 includeItemsFromAllDrives=True
-            ).execute()
+            ))
 
             files = results.get('files', [])
 
@@ -3439,7 +6241,7 @@ class OutlineGenerator:
                 logger.info(f"テンプレートから月別スプレッドシート「{spreadsheet_name}」を作成中...")
 
                 # テンプレートをコピー
-                copied_file = self.drive_service.files().copy(
+                copied_file = execute_google(self.drive_service.files().copy(
                     fileId=template_id,
                     body={
                         'name': spreadsheet_name,
@@ -3447,7 +6249,7 @@ class OutlineGenerator:
                     },
                     supportsAllDrives=True,
                     fields='id'
-                ).execute()
+                ))
 
                 spreadsheet_id = copied_file.get('id')
                 logger.info(f"✓ テンプレートから月別スプレッドシート「{spreadsheet_name}」を作成: {spreadsheet_id}")
@@ -3460,11 +6262,11 @@ class OutlineGenerator:
                     'parents': [folder_id]
                 }
 
-                spreadsheet = self.drive_service.files().create(
+                spreadsheet = execute_google(self.drive_service.files().create(
                     body=file_metadata,
                     supportsAllDrives=True,
                     fields='id'
-                ).execute()
+                ))
 
                 spreadsheet_id = spreadsheet.get('id')
                 logger.info(f"✓ 月別スプレッドシート「{spreadsheet_name}」を作成: {spreadsheet_id}")
@@ -3502,7 +6304,10 @@ class OutlineGenerator:
 キーワード3
 """
 
-            response = self.openai_client.chat.completions.create(
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('related_keywords'),
+                usage_step='related_keywords',
                 model="gpt-4.1-mini",
                 messages=[
                     {"role": "system", "content": "あなたはSEOキーワードリサーチの専門家です。"},
@@ -3664,8 +6469,12 @@ class OutlineGenerator:
                     'start': start
                 }
 
-                response = requests.get(url, params=params, timeout=10)
-                response.raise_for_status()
+                def search_request():
+                    response = requests.get(url, params=params, timeout=10)
+                    response.raise_for_status()
+                    return response
+
+                response = RATE_LIMITER.call('custom_search', search_request, max_retries=GOOGLE_API_MAX_RETRIES)
                 data = response.json()
 
                 for item in data.get('items', []):
@@ -3781,7 +6590,7 @@ class OutlineGenerator:
         try:
             # ステップ1: 共起語（TF-DF分析）と上位URLを並列取得
             with ThreadPoolExecutor(max_workers=2) as executor:
-                future_keywords = executor.submit(self.extract_cooccurrence_keywords, keyword)
+                future_keywords = submit_with_usage_tags(executor, self.extract_cooccurrence_keywords, keyword)
                 future_articles = executor.submit(self.fetch_top_articles, keyword)
 
                 related_keywords = future_keywords.result()
@@ -3809,23 +6618,13 @@ class OutlineGenerator:
                 top_articles_text = "（上位記事の取得に失敗）"
 
             # ステップ2: メインキーワード + 共起語 + 上位URLで構成案を生成
-            prompt = f"""# 記事構成案作成タスク
+            # 固定の仕様を先頭、キーワードごとの情報を末尾に置く（プロンプトキャッシュが効くよう先頭を固定する）
+            prompt = """# 記事構成案作成タスク
 
 検索意図を満たす包括的な記事構成案を作成してください。
 
 ---
 
-## 基本情報
-
-### メインキーワード
-{keyword}
-
-### 共起語（上位ページから抽出・構成案に自然に組み込む）
-{related_keywords_text}
-
-### 検索上位記事の分析（重要：この見出し構造を参考に構成案を作成）
-{top_articles_text}
-
 ## 【最重要】記事仕様
 
 ### 文字数（絶対厳守）
@@ -4153,9 +6952,29 @@ H2: まとめ
 - [ ] ランキング系: 数の整合性OK
 - [ ] 関連KW: H2/H3に自然に組み込み
 - [ ] 共起語: スペース区切りのまま入れていない（自然な日本語に言い換え済み）
-- [ ] 文字数: 構成で5,500字達成可能"""
+- [ ] 文字数: 構成で5,500字達成可能
+
+---
+
+""" + f"""## 基本情報
+
+### メインキーワード
+{keyword}
+
+### 共起語（上位ページから抽出・構成案に自然に組み込む）
+{related_keywords_text}
 
-            response = self.openai_client.chat.completions.create(
+### 検索上位記事の分析（重要：この見出し構造を参考に構成案を作成）
+{top_articles_text}
+
+---
+
+上記の仕様に従い、この基本情報をもとに構成案を出力してください。"""
+
+            response = chat_completion(
+                self.openai_client,
+                cache_step=self._cache_step('outline'),
+                usage_step='outline',
                 model="gpt-5.2",
                 messages=[
                     {"role": "system", "content": """あなたはSEO記事構成案の専門家として振る舞う。
@@ -4379,7 +7198,7 @@ H3の例：
 
             # ステップ1: 共起語と上位記事を並列取得（GPT版と同じ）
             with ThreadPoolExecutor(max_workers=2) as executor:
-                future_keywords = executor.submit(self.extract_cooccurrence_keywords, keyword)
+                future_keywords = submit_with_usage_tags(executor, self.extract_cooccurrence_keywords, keyword)
                 future_articles = executor.submit(self.fetch_top_articles, keyword)
 
                 related_keywords = future_keywords.result()
@@ -4474,25 +7293,24 @@ H2: まとめ"""
 
 構成案のみを出力してください。"""
 
-            response = self.claude_client.messages.create(
+            response = claude_message(
+                self.claude_client,
+                cache_step=self._cache_step('outline'),
+                usage_step='outline',
                 model="claude-sonnet-4-20250514",
                 max_tokens=4000,
                 messages=[
                     {"role": "user", "content": user_prompt}
                 ],
-                system=system_prompt
+                system=[{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
             )
 
             outline = response.content[0].text
 
             # 使用量情報
-            usage_info = {
-                'input_tokens': response.usage.input_tokens,
-                'output_tokens': response.usage.output_tokens,
-                'total_tokens': response.usage.input_tokens + response.usage.output_tokens
-            }
+            usage_info = _claude_usage_info(response.usage)
 
-            logger.info(f"[Claude] 構成案生成完了（tokens: {usage_info['total_tokens']}）")
+            logger.info(f"[Claude] 構成案生成完了（tokens: {usage_info['total_tokens']}、キャッシュ読込: {usage_info['cache_read_input_tokens']}）")
 
             return {
                 'keyword': keyword,
@@ -4514,13 +7332,18 @@ H2: まとめ"""
                 'error': str(e)
             }
 
+    def _generate_outline_tagged(self, keyword):
+        """generate_outline_for_keyword を利用料の集計タグ（スプレッドシート・キーワード）付きで実行"""
+        with usage_scope(spreadsheet_id=self.spreadsheet_id, sheet_name=keyword):
+            return self.generate_outline_for_keyword(keyword)
+
     def generate_outlines_parallel(self, keywords, max_workers=10):
         """複数のキーワードに対して並列で構成案を生成"""
         results = []
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_keyword = {
-                executor.submit(self.generate_outline_for_keyword, keyword): keyword
+                executor.submit(self._generate_outline_tagged, keyword): keyword
                 for keyword in keywords
             }
 
@@ -4816,10 +7639,10 @@ H2: まとめ"""
 
         # バッチ更新を実行
         batch_update_request = {'requests': requests}
-        self.sheets_service.spreadsheets().batchUpdate(
+        execute_google(self.sheets_service.spreadsheets().batchUpdate(
             spreadsheetId=self.spreadsheet_id,
             body=batch_update_request
-        ).execute()
+        ))
 
     def parse_outline_to_sheet_format(self, outline_text):
         """構成案テキストをスプレッドシート用のフォーマットに変換"""
@@ -4869,10 +7692,10 @@ H2: まとめ"""
                 }]
             }
 
-            response = self.sheets_service.spreadsheets().batchUpdate(
+            response = execute_google(self.sheets_service.spreadsheets().batchUpdate(
                 spreadsheetId=self.spreadsheet_id,
                 body=batch_update_request
-            ).execute()
+            ))
 
             # シートIDを取得（書式設定で使用）
             sheet_id = response['replies'][0]['addSheet']['properties']['sheetId']
@@ -4904,12 +7727,12 @@ H2: まとめ"""
 
             range_name = f"'{sheet_name}'!A1"
 
-            self.sheets_service.spreadsheets().values().update(
+            execute_google(self.sheets_service.spreadsheets().values().update(
                 spreadsheetId=self.spreadsheet_id,
                 range=range_name,
                 valueInputOption='RAW',
                 body={'values': values}
-            ).execute()
+            ))
 
             logger.info(f"✓ シート '{sheet_name}' にデータを書き込みました")
 
@@ -4941,10 +7764,10 @@ H2: まとめ"""
             logger.info(f"マスターシートに書き込み中... ({len(keyword_data_map)}件)")
 
             # マスターシートのデータを取得（最初のシート）
-            result = self.sheets_service.spreadsheets().values().get(
+            result = execute_google(self.sheets_service.spreadsheets().values().get(
                 spreadsheetId=master_spreadsheet_id,
                 range=f'{keyword_column}:{keyword_column}'
-            ).execute()
+            ))
 
             values = result.get('values', [])
 
@@ -4989,13 +7812,13 @@ H2: まとめ"""
 
             # バッチ更新
             if requests_data:
-                self.sheets_service.spreadsheets().values().batchUpdate(
+                execute_google(self.sheets_service.spreadsheets().values().batchUpdate(
                     spreadsheetId=master_spreadsheet_id,
                     body={
                         'valueInputOption': 'RAW',
                         'data': requests_data
                     }
-                ).execute()
+                ))
 
             logger.info(f"✓ マスターシートに{update_count}件のURL・タイトルを書き込みました")
             return update_count
@@ -5125,6 +7948,12 @@ def health():
     return jsonify({'status': 'ok'})
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """ステージごとの所要時間（Prometheus のテキスト形式）"""
+    return Response(STAGE_METRICS.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/generate-articles', methods=['POST'])
 def generate_articles():
     """記事生成エンドポイント"""
@@ -5134,15 +7963,22 @@ def generate_articles():
 
         spreadsheet_id = data.get('spreadsheet_id')
         max_articles = data.get('max_articles')  # None = すべて処理
+        # 同時生成数（None = 環境変数 ARTICLE_CONCURRENCY）。バックグラウンド処理の開始前に検証する
+        concurrency, concurrency_error = parse_article_concurrency(data.get('concurrency'))
+        if concurrency_error:
+            return jsonify({'error': concurrency_error}), 400
         image_generation_method = data.get('image_generation_method', 'both')  # デフォルトは両方（フォルダ + AI生成）
 
         # マスターシート関連のパラメータ
         master_spreadsheet_id = data.get('master_spreadsheet_id')
         keyword_column = data.get('keyword_column', 'G')
         article_url_column = data.get('article_url_column', 'N')
+        draft_mode = data.get('draft_mode')  # 'single' or 'sectioned'（None = 環境変数 DRAFT_MODE）
+        bypass_llm_cache = data.get('bypass_llm_cache', False)  # LLM応答キャッシュを使わずに再生成
 
         logger.info(f"[DEBUG] スプレッドシートID: {spreadsheet_id}")
         logger.info(f"[DEBUG] 最大記事数: {max_articles}")
+        logger.info(f"[DEBUG] 同時生成数: {concurrency or ARTICLE_CONCURRENCY}")
         logger.info(f"[DEBUG] 画像生成方法: {image_generation_method}")
         logger.info(f"[DEBUG] マスターシートID: {master_spreadsheet_id}")
 
@@ -5169,9 +8005,11 @@ def generate_articles():
                     image_generation_method=image_generation_method,
                     master_spreadsheet_id=master_spreadsheet_id,
                     keyword_column=keyword_column,
-                    article_url_column=article_url_column
+                    article_url_column=article_url_column,
+                    draft_mode=draft_mode,
+                    bypass_llm_cache=bypass_llm_cache
                 )
-                result = automation.process_all_sheets(max_articles)
+                result = automation.process_all_sheets(max_articles, concurrency=concurrency)
                 logger.info(f"[BACKGROUND] 記事生成処理が完了しました: {result}")
             except Exception as e:
                 logger.error(f"[BACKGROUND] エラーが発生しました: {e}")
@@ -5210,11 +8048,14 @@ def generate_single_article():
         sheet_name = data.get('sheet_name')
         image_generation_method = data.get('image_generation_method', 'both')  # デフォルトは両方（フォルダ + AI生成）
         force = data.get('force', False)  # 処理済みでも強制再生成
+        incremental = data.get('incremental', True)  # force 時、変更されたセクションのみ再生成
 
         # マスターシート関連のパラメータ
         master_spreadsheet_id = data.get('master_spreadsheet_id')
         keyword_column = data.get('keyword_column', 'G')
         article_url_column = data.get('article_url_column', 'N')
+        draft_mode = data.get('draft_mode')  # 'single' or 'sectioned'（None = 環境変数 DRAFT_MODE）
+        bypass_llm_cache = data.get('bypass_llm_cache', False)  # LLM応答キャッシュを使わずに再生成
 
         if not spreadsheet_id:
             return jsonify({'error': 'spreadsheet_id is required'}), 400
@@ -5240,9 +8081,11 @@ def generate_single_article():
             image_generation_method=image_generation_method,
             master_spreadsheet_id=master_spreadsheet_id,
             keyword_column=keyword_column,
-            article_url_column=article_url_column
+            article_url_column=article_url_column,
+            draft_mode=draft_mode,
+            bypass_llm_cache=bypass_llm_cache
         )
-        result = automation.process_single_sheet(sheet_name, force=force)
+        result = automation.process_single_sheet(sheet_name, force=force, incremental=incremental)
 
         logger.info(f"[SINGLE] 記事生成完了: {sheet_name} - {result}")
 
@@ -5259,6 +8102,190 @@ def generate_single_article():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/generate-single-article-stream', methods=['POST'])
+def generate_single_article_stream():
+    """単一記事生成エンドポイント（進捗ストリーミング版）
+
+    生成をバックグラウンドで開始して job_id を即座に返す。
+    進捗は GET /article-progress/<job_id>（Server-Sent Events）で受け取る。
+    """
+    try:
+        data = request.get_json()
+        logger.info(f"[STREAM] リクエストデータ: {data}")
+
+        spreadsheet_id = data.get('spreadsheet_id')
+        sheet_name = data.get('sheet_name')
+        image_generation_method = data.get('image_generation_method', 'both')  # デフォルトは両方（フォルダ + AI生成）
+        force = data.get('force', False)  # 処理済みでも強制再生成
+        incremental = data.get('incremental', True)  # force 時、変更されたセクションのみ再生成
+
+        # マスターシート関連のパラメータ
+        master_spreadsheet_id = data.get('master_spreadsheet_id')
+        keyword_column = data.get('keyword_column', 'G')
+        article_url_column = data.get('article_url_column', 'N')
+        draft_mode = data.get('draft_mode')  # 'single' or 'sectioned'（None = 環境変数 DRAFT_MODE）
+        bypass_llm_cache = data.get('bypass_llm_cache', False)  # LLM応答キャッシュを使わずに再生成
+
+        if not spreadsheet_id:
+            return jsonify({'error': 'spreadsheet_id is required'}), 400
+
+        if not sheet_name:
+            return jsonify({'error': 'sheet_name is required'}), 400
+
+        # OpenAI APIキーを環境変数から取得
+        openai_api_key = os.environ.get('OPENAI_API_KEY')
+        if not openai_api_key:
+            return jsonify({'error': 'OPENAI_API_KEY not set'}), 500
+
+        # 画像フォルダーIDを環境変数から取得
+        image_folder_id = os.environ.get('IMAGE_FOLDER_ID')
+
+        automation = ArticleAutomation(
+            spreadsheet_id,
+            openai_api_key,
+            image_folder_id,
+            image_generation_method=image_generation_method,
+            master_spreadsheet_id=master_spreadsheet_id,
+            keyword_column=keyword_column,
+            article_url_column=article_url_column,
+            draft_mode=draft_mode,
+            bypass_llm_cache=bypass_llm_cache
+        )
+        job = PROGRESS_JOBS.create(sheet_name)
+        automation.progress = job
+
+        def process_article_background():
+            try:
+                job.stage('start', f"シート '{sheet_name}' の処理を開始")
+                result = automation.process_single_sheet(sheet_name, force=force, incremental=incremental)
+                logger.info(f"[STREAM] 記事生成完了: {sheet_name} - {result}")
+                job.finish(result)
+            except Exception as e:
+                logger.error(f"[STREAM] エラー: {e}")
+                job.finish({'status': 'error', 'error': str(e)})
+
+        thread = threading.Thread(target=process_article_background)
+        thread.daemon = True
+        thread.start()
+
+        return jsonify({
+            'status': 'processing',
+            'job_id': job.job_id,
+            'sheet_name': sheet_name,
+            'events_url': f"/article-progress/{job.job_id}",
+            'abort_url': f"/article-progress/{job.job_id}/abort"
+        }), 202
+
+    except Exception as e:
+        logger.error(f"[STREAM] エラー: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/article-progress/<job_id>', methods=['GET'])
+def article_progress(job_id):
+    """記事生成の進捗を Server-Sent Events で配信
+
+    イベント: stage（ステージ遷移）/ text（文字数と途中テキスト）/ abort（中断）/ done（結果）
+    Last-Event-ID ヘッダーまたは since パラメータで途中から再開できる。
+    """
+    job = PROGRESS_JOBS.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+
+    try:
+        since = int(request.headers.get('Last-Event-ID', request.args.get('since', -1))) + 1
+    except (TypeError, ValueError):
+        since = 0  # 数値でなければ最初から配信
+    since = max(since, 0)
+
+    def event_stream():
+        cursor = since
+        while True:
+            events = job.wait_events(cursor, timeout=15)
+            if not events:
+                if job.finished:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                cursor = event['seq'] + 1
+                if event['type'] == 'done':
+                    return
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/article-progress/<job_id>/abort', methods=['POST'])
+def abort_article_progress(job_id):
+    """生成中の記事を中断（ストリーミング中のLLM呼び出しを打ち切る）"""
+    job = PROGRESS_JOBS.get(job_id)
+    if not job:
+        return jsonify({'error': 'job not found'}), 404
+
+    data = request.get_json(silent=True) or {}
+    job.abort(data.get('reason', '利用者による中断'))
+
+    return jsonify({
+        'job_id': job_id,
+        'status': 'finished' if job.finished else 'aborting',
+        'stage': job.current_stage
+    }), 200
+
+
+@app.route('/refine-stats', methods=['GET'])
+def refine_stats():
+    """Step3（修正）のスキップ率・軽量化率と短縮できた推定時間（プロセス起動以降）"""
+    return jsonify(REFINE_STATS.get_stats()), 200
+
+
+@app.route('/llm-cache-stats', methods=['GET'])
+def llm_cache_stats():
+    """LLM応答キャッシュのステップごとのヒット率と件数（プロセス起動以降）"""
+    return jsonify(LLM_CACHE.get_stats()), 200
+
+
+@app.route('/usage', methods=['GET'])
+def usage_summary():
+    """LLM・画像生成の利用量と推定コストの集計
+
+    クエリパラメータ:
+    - group_by: article（既定）/ month / client / step / model
+    - since, until: 期間（YYYY-MM-DD、until はその日を含まない）
+    - spreadsheet_id, client: 絞り込み
+    - limit: 最大件数（既定200）
+    """
+    group_by = request.args.get('group_by', 'article')
+    try:
+        since, until = (
+            time.mktime(datetime.datetime.strptime(value, '%Y-%m-%d').timetuple()) if value else None
+            for value in (request.args.get('since'), request.args.get('until'))
+        )
+        rows = USAGE_LEDGER.summarize(
+            group_by=group_by,
+            since=since,
+            until=until,
+            spreadsheet_id=request.args.get('spreadsheet_id'),
+            client=request.args.get('client'),
+            limit=int(request.args.get('limit', 200))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except sqlite3.Error as e:
+        logger.error(f"[USAGE] 集計に失敗: {e}")
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'group_by': group_by,
+        'total_cost_usd': round(sum(row['cost_usd'] for row in rows), 4),
+        'rows': rows
+    }), 200
+
+
 @app.route('/enqueue-all-articles', methods=['POST'])
 def enqueue_all_articles():
     """全未処理シートをCloud Tasksにキュー登録"""
@@ -5273,6 +8300,8 @@ def enqueue_all_articles():
         master_spreadsheet_id = data.get('master_spreadsheet_id')
         keyword_column = data.get('keyword_column', 'G')
         article_url_column = data.get('article_url_column', 'N')
+        draft_mode = data.get('draft_mode')  # 'single' or 'sectioned'（None = 環境変数 DRAFT_MODE）
+        bypass_llm_cache = data.get('bypass_llm_cache', False)  # LLM応答キャッシュを使わずに再生成
 
         if not spreadsheet_id:
             return jsonify({'error': 'spreadsheet_id is required'}), 400
@@ -5295,7 +8324,9 @@ def enqueue_all_articles():
             image_generation_method=image_generation_method,
             master_spreadsheet_id=master_spreadsheet_id,
             keyword_column=keyword_column,
-            article_url_column=article_url_column
+            article_url_column=article_url_column,
+            draft_mode=draft_mode,
+            bypass_llm_cache=bypass_llm_cache
         )
 
         result = automation.enqueue_articles_to_cloud_tasks(cloud_run_url)
@@ -5323,6 +8354,8 @@ def process_article_task():
         master_spreadsheet_id = data.get('master_spreadsheet_id')
         keyword_column = data.get('keyword_column', 'G')
         article_url_column = data.get('article_url_column', 'N')
+        draft_mode = data.get('draft_mode')  # 'single' or 'sectioned'（None = 環境変数 DRAFT_MODE）
+        bypass_llm_cache = data.get('bypass_llm_cache', False)  # LLM応答キャッシュを使わずに再生成
         task_index = data.get('task_index', 0)
         total_tasks = data.get('total_tasks', 0)
 
@@ -5344,7 +8377,9 @@ def process_article_task():
             image_generation_method=image_generation_method,
             master_spreadsheet_id=master_spreadsheet_id,
             keyword_column=keyword_column,
-            article_url_column=article_url_column
+            article_url_column=article_url_column,
+            draft_mode=draft_mode,
+            bypass_llm_cache=bypass_llm_cache
         )
 
         # 記事を生成
@@ -5477,6 +8512,7 @@ def generate_outlines():
     - master_spreadsheet_id: マスターシートのID（オプション、構成案URLを書き込む）
     - keyword_column: マスターシートのキーワード列（オプション、デフォルト'G'）
     - url_column: マスターシートのURL書き込み列（オプション、デフォルト'M'）
+    - bypass_llm_cache: LLM応答キャッシュを使わずに生成（オプション、デフォルトFalse）
     """
     try:
         data = request.get_json()
@@ -5492,6 +8528,7 @@ def generate_outlines():
         master_spreadsheet_id = data.get('master_spreadsheet_id')  # URLを書き込むマスターシート
         keyword_column = data.get('keyword_column', 'G')  # キーワード列
         url_column = data.get('url_column', 'M')  # URL書き込み列
+        bypass_llm_cache = data.get('bypass_llm_cache', False)  # LLM応答キャッシュを使わずに再生成
 
         logger.info(f"[DEBUG] キーワード数: {len(keywords)}")
         logger.info(f"[DEBUG] 年月: {year}年{month}月")
@@ -5527,7 +8564,7 @@ def generate_outlines():
             logger.info(f"[DEBUG] 月別スプレッドシートID: {output_spreadsheet_id}")
 
         # 構成案生成処理（出力先スプレッドシートに書き込む）
-        generator = OutlineGenerator(output_spreadsheet_id, openai_api_key)
+        generator = OutlineGenerator(output_spreadsheet_id, openai_api_key, bypass_llm_cache=bypass_llm_cache)
         result = generator.run(
             keywords,
             max_workers=max_workers,
@@ -5582,7 +8619,8 @@ def generate_outline_claude():
         )
 
         # Claude APIで構成案を生成
-        result = generator.generate_outline_with_claude(keyword)
+        with usage_scope(sheet_name=keyword):
+            result = generator.generate_outline_with_claude(keyword)
 
         return jsonify(result), 200
 